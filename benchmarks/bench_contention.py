@@ -0,0 +1,89 @@
+"""
+Lock contention between concurrent `dripfeed update` processes: N processes each update their own comic K times, in a
+config file holding many comics. "legacy" is how updates used to commit (exclusive lock on the config file to read it,
+and again to rewrite all of it); "per-comic" is run_once() as it is now (a per-comic lock, and progress written to
+its own file).
+
+    python benchmarks/bench_contention.py [--processes 8] [--updates 10] [--comics 500] [--latency 0.02]
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import dripfeed
+import dripfeed.comics
+from dripfeed.comics import IniStore, XPathComic
+from localserver import ArchiveServer
+
+
+def legacy_update(comic_name):
+    store = IniStore()
+    with dripfeed.comics._locked_config_file():
+        pass  # the old get_comic() read the config under an exclusive lock
+    comic = store.get_comic(comic_name)
+    comic.update_progress(comic.next_url())
+    store.put_comics([comic], overwrite=True)
+    dripfeed.write_success_rss(comic)
+
+
+def child(mode, conf_filename, comic_name, updates):
+    dripfeed.comics.CONF_FILENAME = conf_filename
+    for _ in range(updates):
+        if mode == 'legacy':
+            legacy_update(comic_name)
+        else:
+            dripfeed.run_once(comic_name, raise_error=True)
+
+
+def setup(directory, server, comics):
+    conf_filename = os.path.join(directory, 'dripfeed.cfg')
+    dripfeed.comics.CONF_FILENAME = conf_filename
+    dripfeed.comics.put_comics(
+        [XPathComic(name='comic{0}'.format(i), next_xpath='//a[@rel="next"]',
+                    start_url='{0}/{1}'.format(server.url, i * 10000 + 1),
+                    rss_file=os.path.join(directory, 'comic{0}.rss'.format(i)))
+         for i in range(comics)],
+        create_file=True)
+    for comic in dripfeed.comics.get_configured_comics():
+        dripfeed.init_rss(comic)
+    return conf_filename
+
+
+def measure(mode, args, server):
+    directory = tempfile.mkdtemp()
+    try:
+        conf_filename = setup(directory, server, args.comics)
+        start = time.time()
+        processes = [subprocess.Popen([sys.executable, __file__, '--child', mode, conf_filename,
+                                       'comic{0}'.format(i), str(args.updates)])
+                     for i in range(args.processes)]
+        for process in processes:
+            assert process.wait() == 0
+        elapsed = time.time() - start
+        updates = args.processes * args.updates
+        print('{0:10} {1:5} updates {2:8.2f}s {3:8.1f} updates/s'.format(mode, updates, elapsed, updates / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--updates', type=int, default=10)
+    parser.add_argument('--comics', type=int, default=500, help='total comics in the config file')
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated network latency per fetch')
+    args = parser.parse_args()
+    with ArchiveServer(delay=args.latency) as server:
+        for mode in ('legacy', 'per-comic'):
+            measure(mode, args, server)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5]))
+    else:
+        main()
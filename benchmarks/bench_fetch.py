@@ -0,0 +1,62 @@
+"""
+Compare one-connection-per-fetch (plain requests.get, as dripfeed used to do) against the pooled Fetcher, by walking
+the next-link chain of several comics hosted on a few local servers. Reports wall time and the number of TCP
+connections (and so TCP/TLS handshakes) each approach needed.
+
+    python benchmarks/bench_fetch.py [--hosts 3] [--comics-per-host 10] [--episodes 5]
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import time
+import requests
+from dripfeed.comics import XPathComic, Progress
+from dripfeed.fetch import Fetcher
+import dripfeed.fetch
+from localserver import ArchiveServer
+
+
+def walk(servers, comics_per_host, episodes):
+    for server in servers:
+        for comic_number in range(comics_per_host):
+            comic = XPathComic(name='c', next_xpath='//a[@rel="next"]',
+                               progress=Progress(next_url='{0}/{1}'.format(server.url, comic_number * 1000 + 1)))
+            for _ in range(episodes):
+                comic.update_progress(comic.next_url())
+
+
+class _UnpooledFetcher(object):
+    def get(self, url, **kwargs):
+        return requests.get(url, **kwargs)
+
+
+def measure(label, fetcher, args):
+    servers = [ArchiveServer() for _ in range(args.hosts)]
+    for server in servers:
+        server.__enter__()
+    try:
+        dripfeed.fetch._fetcher = fetcher
+        start = time.time()
+        walk(servers, args.comics_per_host, args.episodes)
+        elapsed = time.time() - start
+    finally:
+        for server in servers:
+            server.__exit__()
+    fetches = args.hosts * args.comics_per_host * args.episodes
+    connections = sum(server.connections for server in servers)
+    print('{0:10} {1:5} fetches  {2:5} connections  {3:7.3f}s'.format(label, fetches, connections, elapsed))
+    return connections
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hosts', type=int, default=3)
+    parser.add_argument('--comics-per-host', type=int, default=10)
+    parser.add_argument('--episodes', type=int, default=5)
+    args = parser.parse_args()
+    unpooled = measure('unpooled', _UnpooledFetcher(), args)
+    pooled = measure('pooled', Fetcher(), args)
+    print('handshakes saved: {0}'.format(unpooled - pooled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Time to read one comic from the INI config file: a full ConfigParser parse against the section index (see
+dripfeed.configindex), for growing numbers of configured comics. The first indexed lookup after a change to the config
+file rebuilds the index; that's timed separately.
+
+    python benchmarks/bench_lookup.py [--lookups 100]
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import dripfeed.comics
+from dripfeed.comics import XPathComic, Progress, IniStore, get_global_config, _unlocked_get_comic
+
+COMICS = (1000, 10000, 100000)
+
+
+def setup(directory, comics):
+    dripfeed.comics.CONF_FILENAME = os.path.join(directory, 'dripfeed.cfg')
+    dripfeed.comics.put_comics(
+        [XPathComic(name='comic{0}'.format(i), next_xpath='//a[@rel="next"]', start_url='http://example.com/1',
+                    rss_file=os.path.join(directory, 'comic{0}.rss'.format(i)),
+                    progress=Progress(episode=i, next_url='http://example.com/{0}'.format(i)))
+         for i in range(comics)],
+        create_file=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=100)
+    args = parser.parse_args()
+
+    for comics in COMICS:
+        directory = tempfile.mkdtemp()
+        try:
+            setup(directory, comics)
+            names = ['comic{0}'.format(i * comics // args.lookups) for i in range(args.lookups)]
+            start = time.time()
+            for name in names[:max(1, args.lookups // 10)]:  # full parses are slow: fewer of them
+                _unlocked_get_comic(name, get_global_config())
+            parse = (time.time() - start) / max(1, args.lookups // 10)
+            store = IniStore()
+            start = time.time()
+            store.get_comic(names[0])
+            rebuild = time.time() - start
+            start = time.time()
+            for name in names:
+                store.get_comic(name)
+            indexed = (time.time() - start) / args.lookups
+        finally:
+            shutil.rmtree(directory)
+        print('{0:>7} comics: full parse {1:9.2f}ms  indexed {2:6.2f}ms  (index rebuild {3:.2f}ms)'.format(
+            comics, parse * 1000, indexed * 1000, rebuild * 1000))
+
+
+if __name__ == '__main__':
+    main()
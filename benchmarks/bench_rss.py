@@ -0,0 +1,61 @@
+"""
+Time per feed update: the old feedparser round trip (parse everything, re-serialise everything) against the
+incremental writer, for feeds of growing depth.
+
+    python benchmarks/bench_rss.py [--updates 50]
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from dripfeed.comics import XPathComic, Progress
+from dripfeed.rss import init_rss, parse_rss, add_entry, write_entries, entry_item
+
+
+def legacy_update(comic, num_entries):
+    with open(comic.rss_file, 'rb') as f:
+        rss = parse_rss(f)
+    add_entry(rss, comic, num_entries=num_entries)
+    with open(comic.rss_file, 'r+b') as f:
+        rss.write_xml(f)
+        f.truncate()
+
+
+def incremental_update(comic, num_entries):
+    write_entries(comic.rss_file, [entry_item(comic)], drop_errors=True, num_entries=num_entries)
+
+
+def time_updates(update, rss_file, num_entries, updates):
+    comic = XPathComic(name='bench', start_url='http://example.com/1', rss_file=rss_file,
+                       progress=Progress(episode=1, next_url='http://example.com/1'))
+    init_rss(comic)
+    for _ in range(num_entries):  # fill the feed to its full depth first
+        comic.update_progress('http://example.com/{0}'.format(comic.progress.episode + 1))
+        incremental_update(comic, num_entries)
+    start = time.time()
+    for _ in range(updates):
+        comic.update_progress('http://example.com/{0}'.format(comic.progress.episode + 1))
+        update(comic, num_entries)
+    return (time.time() - start) / updates
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=50)
+    args = parser.parse_args()
+    d = tempfile.mkdtemp()
+    try:
+        rss_file = os.path.join(d, 'bench.rss')
+        print('{0:>8} {1:>14} {2:>14}'.format('entries', 'legacy ms', 'incremental ms'))
+        for num_entries in (20, 100, 500):
+            legacy = time_updates(legacy_update, rss_file, num_entries, args.updates)
+            incremental = time_updates(incremental_update, rss_file, num_entries, args.updates)
+            print('{0:>8} {1:>14.2f} {2:>14.2f}'.format(num_entries, legacy * 1000, incremental * 1000))
+    finally:
+        shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    main()
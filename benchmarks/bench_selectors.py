@@ -0,0 +1,63 @@
+"""
+Cost per page of extracting the next link with each selector engine, on pages the size of a typical comic page with
+its navigation, scripts and a comment thread (tens to hundreds of kilobytes).
+
+    python benchmarks/bench_selectors.py [--iterations 200]
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import timeit
+import lxml.html
+from dripfeed.extract import get_selector
+
+XPATH = '//div[@class="nav"]/a[@rel="next"]'
+CSS = 'div.nav > a[rel="next"]'
+REGEX = r'<a[^>]*href="([^"]*)"[^>]*rel="next"'
+
+HEAD = '''<html><head><title>Episode 41</title>
+<script>window.dataLayer = window.dataLayer || []; function gtag(){dataLayer.push(arguments);}</script>
+<link rel="stylesheet" href="/style.css"></head>
+<body><div class="header"><a href="/">Home</a> <a href="/archive">Archive</a> <a href="/about">About</a></div>
+<div class="comic"><img src="/comics/41.png" alt="Episode 41"></div>
+<div class="nav"><a href="/40" rel="prev">prev</a> <a href="/42" rel="next">next</a></div>
+'''
+COMMENT = '''<div class="comment"><span class="author">reader{0}</span>
+<p>I can't believe what happened to <a href="/characters/annie">Annie</a> this week! #{0}</p></div>
+'''
+
+
+class _Page(object):
+    url = 'http://example.com/41'
+    encoding = 'utf-8'
+
+    def __init__(self, content):
+        self.content = content
+
+
+def page_of(comments):
+    return (HEAD + ''.join(COMMENT.format(i) for i in range(comments)) + '</body></html>').encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    engines = [
+        ('xpath (uncompiled)', lambda page: lxml.html.fromstring(page.content).xpath(XPATH)[0].attrib['href']),
+        ('xpath (compiled)', get_selector(XPATH).find_href),
+        ('css (compiled)', get_selector(CSS, kind='css').find_href),
+        ('regex', get_selector(REGEX, kind='regex').find_href),
+    ]
+    print('{0:>10}  '.format('page') + ''.join('{0:>20}'.format(name) for name, _ in engines))
+    for comments in (20, 200, 1000):
+        page = _Page(page_of(comments))
+        timings = []
+        for name, find in engines:
+            assert find(page) == '/42', name
+            timings.append(timeit.timeit(lambda: find(page), number=args.iterations) / args.iterations)
+        print('{0:>10}  '.format(len(page.content)) + ''.join('{0:>17.1f} us'.format(t * 1e6) for t in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Requests per second from `dripfeed serve` (dripfeed.feedserver) under a local load test: client threads, each on one
+keep-alive connection, polling random feeds the way feed readers do. Most polls send the ETag they got last time (and
+get 304 Not Modified); the rest ask for the whole feed, gzipped.
+
+    python benchmarks/bench_serve.py [--comics 200] [--clients 16] [--seconds 5] [--conditional 0.9]
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from six.moves import http_client
+import dripfeed.comics
+from dripfeed.comics import XPathComic, Progress, put_comics
+from dripfeed.feedserver import FeedServer
+from dripfeed.rss import init_rss, write_entries, entry_item
+
+
+def setup(directory, comics):
+    dripfeed.comics.CONF_FILENAME = os.path.join(directory, 'dripfeed.cfg')
+    configured = [XPathComic(name='comic{0}'.format(i), next_xpath='//a[@rel="next"]', start_url='http://example.com/1',
+                             rss_file=os.path.join(directory, 'comic{0}.rss'.format(i)),
+                             progress=Progress(episode=20, next_url='http://example.com/20'))
+                  for i in range(comics)]
+    put_comics(configured, create_file=True)
+    for comic in configured:
+        init_rss(comic)
+        write_entries(comic.rss_file, [entry_item(comic)] * 19)
+
+
+def client(port, names, conditional, deadline, counts):
+    connection = http_client.HTTPConnection('127.0.0.1', port)
+    etags = {}
+    requests = not_modified = 0
+    while time.time() < deadline:
+        name = random.choice(names)
+        headers = {'Accept-Encoding': 'gzip'}
+        if name in etags and random.random() < conditional:
+            headers['If-None-Match'] = etags[name]
+        connection.request('GET', '/{0}.rss'.format(name), headers=headers)
+        response = connection.getresponse()
+        response.read()
+        etags[name] = response.getheader('ETag')
+        requests += 1
+        not_modified += response.status == 304
+    connection.close()
+    counts.append((requests, not_modified))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--comics', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--conditional', type=float, default=0.9, help='fraction of polls sending their last ETag')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        setup(directory, args.comics)
+        server = FeedServer(port=0)
+        serving = threading.Thread(target=server.run)
+        serving.start()
+        try:
+            names = ['comic{0}'.format(i) for i in range(args.comics)]
+            counts = []
+            deadline = time.time() + args.seconds
+            clients = [threading.Thread(target=client, args=(server.port, names, args.conditional, deadline, counts))
+                       for _ in range(args.clients)]
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+        finally:
+            server.stop()
+            serving.join()
+        requests = sum(total for total, _ in counts)
+        not_modified = sum(count for _, count in counts)
+        print('{0} requests in {1}s from {2} clients: {3:.0f} requests/s ({4:.0%} answered 304)'.format(
+            requests, args.seconds, args.clients, requests / args.seconds, not_modified / float(requests or 1)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
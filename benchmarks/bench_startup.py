@@ -0,0 +1,106 @@
+"""
+Cold-start time of each `dripfeed` subcommand, measured in fresh processes with `python -X importtime`. The heavy
+dependencies (requests, lxml, feedparser, PyRSS2Gen) should only be imported by commands that fetch pages or write
+feeds: if `list`, `info`, `export` or `remove` import any of them, this exits with an error, so a regression that adds
+an eager import fails here.
+
+    python benchmarks/bench_startup.py [--repeat 5]
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_MODULES = ('requests', 'lxml', 'feedparser', 'PyRSS2Gen', 'multiprocessing.pool', 'xml.sax')
+# (arguments, whether the command may import heavy modules)
+COMMANDS = [
+    (['list'], False),
+    (['info', 'bench'], False),
+    (['export', os.devnull], False),
+    (['update', 'bench', '--timeout', '1'], True),  # the fetch fails straight away: connection refused
+    (['remove', 'bench'], False),
+]
+RUN_DRIPFEED = 'import sys, dripfeed; sys.argv[0] = "dripfeed"; dripfeed.main()'
+
+
+def run(args, home, importtime=False):
+    """
+    Run `dripfeed <args>` in a fresh interpreter; return the wall time and the `-X importtime` lines, if requested.
+    """
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', RUN_DRIPFEED] + args
+    env = dict(os.environ, HOME=home)
+    start = time.time()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    elapsed = time.time() - start
+    if process.returncode != 0:
+        raise RuntimeError('dripfeed {0} failed:\n{1}'.format(' '.join(args), stderr.decode('utf-8', 'replace')))
+    return elapsed, [line for line in stderr.decode('utf-8', 'replace').splitlines()
+                     if line.startswith('import time:') and 'cumulative' not in line]
+
+
+def imported_modules(importtime_lines):
+    """
+    {module name: cumulative microseconds} from `-X importtime` output.
+    """
+    modules = {}
+    for line in importtime_lines:
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def total_import_time(importtime_lines):
+    # Top-level imports are the unindented ones; their cumulative times add up to the whole
+    return sum(int(line.split('|')[1]) for line in importtime_lines if not line.split('|')[2].startswith('  '))
+
+
+def heavy_imports(modules):
+    return sorted(name for name in modules
+                  if any(name == heavy or name.startswith(heavy + '.') for heavy in HEAVY_MODULES))
+
+
+def setup(home):
+    run(['init', 'bench', '--rss', os.path.join(home, 'bench.rss'), '--url', 'http://127.0.0.1:1/',
+         '--next', '//a[@rel="next"]'], home)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    eager = []
+    print('{0:<12} {1:>10} {2:>12}  {3}'.format('command', 'wall ms', 'imports ms', 'heavy modules imported'))
+    for command, may_be_heavy in COMMANDS:
+        home = tempfile.mkdtemp()
+        try:
+            walls = []
+            for i in range(args.repeat + 1):
+                if i == 0 or command[0] == 'remove':
+                    setup(home)
+                if i < args.repeat:
+                    walls.append(run(command, home)[0])
+                else:
+                    _, lines = run(command, home, importtime=True)
+        finally:
+            shutil.rmtree(home)
+        heavy = heavy_imports(imported_modules(lines))
+        top_heavy = sorted(set(name.split('.')[0] for name in heavy))
+        print('{0:<12} {1:>10.1f} {2:>12.1f}  {3}'.format(command[0], min(walls) * 1000,
+                                                          total_import_time(lines) / 1000.0,
+                                                          ', '.join(top_heavy) or '-'))
+        if heavy and not may_be_heavy:
+            eager.append((command[0], top_heavy))
+    if eager:
+        for command, modules in eager:
+            print('ERROR: dripfeed {0} imports {1}'.format(command, ', '.join(modules)), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
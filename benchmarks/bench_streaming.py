@@ -0,0 +1,78 @@
+"""
+Time and peak memory of extracting the next link from pages of growing size, with and without streaming. The next
+link sits near the top of the page (as it usually does), followed by a long comment thread; or at the very end of the
+page, after the comments; or nowhere (the latest page of a comic), which are the cases where streaming has to read and
+parse the whole page anyway.
+
+    python benchmarks/bench_streaming.py
+"""
+from __future__ import unicode_literals, print_function
+import resource
+import subprocess
+import sys
+import time
+from dripfeed.extract import find_next_href, CHUNK_SIZE
+
+XPATH = '//a[@rel="next"]'
+HEAD = b'<html><head><script>var x = 1;</script></head><body>'
+NAV = b'<div class="nav"><a href="?p=2" rel="next">next</a></div>'
+COMMENT = b'<div class="comment"><p>Great page! Can\'t wait for the next one.</p></div>\n'
+PLACEMENTS = ('top', 'end', 'none')
+
+
+class _InMemoryResponse(object):
+    url = 'http://example.com/'
+
+    def __init__(self, body):
+        self.content = body
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def page(comments, placement):
+    return (HEAD + (NAV if placement == 'top' else b'') + COMMENT * comments + (NAV if placement == 'end' else b'') +
+            b'</body></html>')
+
+
+def measure_here(comments, stream, placement):
+    """
+    Runs in a fresh process, so that the growth of the peak RSS (which includes libxml2's allocations, unlike
+    tracemalloc) belongs to this one extraction.
+    """
+    body = page(comments, placement)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    href = find_next_href(_InMemoryResponse(body), XPATH, stream=stream)
+    elapsed = time.time() - start
+    assert href == (None if placement == 'none' else '?p=2')
+    print(len(body), elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline)
+
+
+def measure(comments, stream, placement):
+    output = subprocess.check_output([sys.executable, __file__, str(comments), '1' if stream else '0', placement])
+    size, elapsed, peak = output.split()
+    return int(size), float(elapsed), int(peak)
+
+
+def main():
+    print('{0:>6} {1:>10} {2:>10} {3:>14} {4:>10} {5:>14}'.format('link', 'page', 'full s', 'full +rss kB',
+                                                                  'stream s', 'stream +rss kB'))
+    for placement in PLACEMENTS:
+        for comments in (10, 1000, 10000, 50000):
+            size, full_time, full_peak = measure(comments, False, placement)
+            _, stream_time, stream_peak = measure(comments, True, placement)
+            print('{0:>6} {1:>10} {2:>10.4f} {3:>14} {4:>10.4f} {5:>14}'.format(placement, size, full_time, full_peak,
+                                                                              stream_time, stream_peak))
+    print('(chunk size {0} bytes; the page body itself is not counted)'.format(CHUNK_SIZE))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4:
+        measure_here(int(sys.argv[1]), sys.argv[2] == '1', sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,198 @@
+"""
+The benchmark suite: configures many comics against a synthetic archive on a local server (pages of varying sizes,
+with relative and absolute next links) and measures
+
+- updates: updates/s and p50/p99 latency of run_once(), round-robin over the comics, and the peak RSS doing it
+- rss: time per feed update as a function of num_entries
+- contention: updates/s of parallel `dripfeed update` processes sharing one config file (and their peak RSS)
+
+The results are written as JSON; pass an earlier results file with --compare to see how a change moved the numbers.
+
+    python benchmarks/bench_suite.py [--pages 10000] [--comics 200] [--updates 1000] [--latency 0]
+                                     [--output bench_results.json] [--compare old_results.json]
+"""
+from __future__ import unicode_literals, print_function
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import dripfeed
+import dripfeed.comics
+from dripfeed.comics import XPathComic, Progress
+from dripfeed.rss import init_rss, write_entries, entry_item
+from localserver import ArchiveServer
+
+NEXT_XPATH = '//a[@rel="next"]'
+NUM_ENTRIES = (20, 100, 500, 2000)
+PROCESSES = (1, 2, 4, 8)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def setup(directory, server, comics, pages, updates_per_comic):
+    """
+    Configure `comics` comics, spread out over the archive so that each has room for `updates_per_comic` updates.
+    """
+    dripfeed.comics.CONF_FILENAME = os.path.join(directory, 'dripfeed.cfg')
+    stride = max(1, (pages - updates_per_comic - 1) // comics)
+    dripfeed.comics.put_comics(
+        [XPathComic(name='comic{0}'.format(i), next_xpath=NEXT_XPATH,
+                    start_url='{0}/{1}'.format(server.url, 1 + i * stride),
+                    rss_file=os.path.join(directory, 'comic{0}.rss'.format(i)))
+         for i in range(comics)],
+        create_file=True)
+    for comic in dripfeed.comics.get_configured_comics():
+        init_rss(comic)
+    return dripfeed.comics.CONF_FILENAME
+
+
+def bench_updates(server, args):
+    directory = tempfile.mkdtemp()
+    try:
+        setup(directory, server, args.comics, args.pages, args.updates // args.comics + 1)
+        latencies = []
+        start = time.time()
+        for i in range(args.updates):
+            before = time.time()
+            dripfeed.run_once('comic{0}'.format(i % args.comics), raise_error=True)
+            latencies.append(time.time() - before)
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(directory)
+    return {
+        'updates': args.updates,
+        'updates_per_second': args.updates / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def bench_rss(args):
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for num_entries in NUM_ENTRIES:
+            comic = XPathComic(name='c', full_name='Comic', start_url='http://example.com/1',
+                               rss_file=os.path.join(directory, '{0}.rss'.format(num_entries)),
+                               progress=Progress(episode=1, next_url='http://example.com/1'))
+            init_rss(comic)
+            write_entries(comic.rss_file, [entry_item(comic)] * num_entries, num_entries=num_entries)
+            start = time.time()
+            for _ in range(args.rss_writes):
+                comic.progress.episode += 1
+                write_entries(comic.rss_file, [entry_item(comic)], num_entries=num_entries)
+            results[str(num_entries)] = {'write_ms': (time.time() - start) / args.rss_writes * 1000,
+                                         'feed_bytes': os.path.getsize(comic.rss_file)}
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def child(conf_filename, comic_name, updates):
+    dripfeed.comics.CONF_FILENAME = conf_filename
+    for _ in range(updates):
+        dripfeed.run_once(comic_name, raise_error=True)
+
+
+def bench_contention(server, args):
+    results = {}
+    for processes in PROCESSES:
+        directory = tempfile.mkdtemp()
+        try:
+            conf_filename = setup(directory, server, args.comics, args.pages, args.contention_updates)
+            start = time.time()
+            children = [subprocess.Popen([sys.executable, __file__, '--child', conf_filename,
+                                          'comic{0}'.format(i % args.comics), str(args.contention_updates)])
+                        for i in range(processes)]
+            for process in children:
+                assert process.wait() == 0
+            elapsed = time.time() - start
+        finally:
+            shutil.rmtree(directory)
+        results[str(processes)] = {'updates_per_second': processes * args.contention_updates / elapsed}
+    results['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return results
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old, new):
+    old_flat, new_flat = flatten(old['results']), flatten(new['results'])
+    print()
+    print('{0:<40} {1:>12} {2:>12} {3:>8}'.format('compared to ' + old['meta']['date'], 'old', 'new', 'new/old'))
+    for key in sorted(set(old_flat) & set(new_flat)):
+        ratio = new_flat[key] / old_flat[key] if old_flat[key] else float('nan')
+        print('{0:<40} {1:>12.2f} {2:>12.2f} {3:>8.2f}'.format(key, old_flat[key], new_flat[key], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=10000, help='size of the synthetic archive')
+    parser.add_argument('--comics', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=1000, help='run_once() calls for the latency measurement')
+    parser.add_argument('--min-page-size', type=int, default=2 * 1024)
+    parser.add_argument('--max-page-size', type=int, default=200 * 1024)
+    parser.add_argument('--latency', type=float, default=0, help='simulated network latency per fetch')
+    parser.add_argument('--rss-writes', type=int, default=50, help='feed updates per num_entries')
+    parser.add_argument('--contention-updates', type=int, default=20, help='updates per process')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='an earlier results file')
+    args = parser.parse_args()
+
+    results = {}
+    with ArchiveServer(delay=args.latency, pages=args.pages, page_sizes=(args.min_page_size, args.max_page_size),
+                       mixed_links=True) as server:
+        results['updates'] = bench_updates(server, args)
+        print('updates     {updates_per_second:8.1f} updates/s  p50 {p50_ms:.1f}ms  p99 {p99_ms:.1f}ms  '
+              'peak RSS {peak_rss_kb}kB'.format(**results['updates']))
+        results['contention'] = bench_contention(server, args)
+        for processes in PROCESSES:
+            print('contention  {0:8.1f} updates/s  with {1} processes'.format(
+                results['contention'][str(processes)]['updates_per_second'], processes))
+    results['rss'] = bench_rss(args)
+    for num_entries in NUM_ENTRIES:
+        print('rss         {0:8.2f}ms per update  with {1} entries'.format(
+            results['rss'][str(num_entries)]['write_ms'], num_entries))
+
+    run = {
+        'meta': {
+            'date': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'dripfeed': dripfeed.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'arguments': vars(args),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(run, f, indent=2, sort_keys=True)
+    print('results written to {0}'.format(args.output))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), run)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main()
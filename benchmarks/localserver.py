@@ -0,0 +1,108 @@
+"""
+A tiny local HTTP server for benchmarks: serves a numbered archive of comic pages (/1, /2, ...) where each page links
+to the next with <a rel="next">, and counts how many TCP connections clients opened against it.
+
+For a more realistic archive, give it a number of `pages` (the last page has no next link, and later ones are 404s),
+a range of `page_sizes` (each page is padded with comments to a size in that range, the same size every time it's
+served) and `mixed_links` (next links alternate between root-relative, page-relative and absolute urls).
+"""
+from __future__ import unicode_literals, print_function
+import random
+import threading
+import time
+from six.moves import BaseHTTPServer, socketserver
+
+__author__ = 'tikitu'
+
+
+PAGE_TEMPLATE = '''<html><head><title>Episode {0}</title></head>
+<body>
+<div class="comic"><img src="/images/{0}.png"></div>
+<div class="nav">{1}</div>
+{2}</body>
+</html>'''
+NEXT_LINK = '<a href="{0}" rel="next">next</a>'
+COMMENT = '<div class="comment"><p>Comment {0}: great page! Can\'t wait for the next one.</p></div>\n'
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def do_GET(self):
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        body = self.server.render(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ArchiveServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, delay=0, pages=None, page_sizes=None, mixed_links=False):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), _Handler)
+        self.delay = delay  # simulated network latency per request, in seconds
+        self.pages = pages
+        self.page_sizes = page_sizes  # (minimum, maximum) in bytes
+        self.mixed_links = mixed_links
+        self.connections = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def render(self, path):
+        try:
+            episode = int(path.strip('/') or 1)
+        except ValueError:
+            return None
+        if self.pages is not None and not 1 <= episode <= self.pages:
+            return None
+        if self.pages is not None and episode == self.pages:
+            next_link = ''
+        else:
+            next_link = NEXT_LINK.format(self.next_href(episode))
+        page = PAGE_TEMPLATE.format(episode, next_link, '')
+        if self.page_sizes is None:
+            return page
+        size = random.Random(episode).randint(*self.page_sizes)  # seeded: a page is the same every time
+        comments = []
+        while size > len(page):
+            comments.append(COMMENT.format(len(comments) + 1))
+            size -= len(comments[-1])
+        return PAGE_TEMPLATE.format(episode, next_link, ''.join(comments))
+
+    def next_href(self, episode):
+        if not self.mixed_links or episode % 3 == 0:
+            return '/{0}'.format(episode + 1)
+        if episode % 3 == 1:
+            return '{0}'.format(episode + 1)  # relative to /<episode>
+        return '{0}/{1}'.format(self.url, episode + 1)
+
+    def get_request(self):
+        with self._count_lock:
+            self.connections += 1
+        return BaseHTTPServer.HTTPServer.get_request(self)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -6,40 +6,117 @@ Usage:
   dripfeed --help
   dripfeed list
   dripfeed info <comic-name>
-  dripfeed [options] init <comic-name> --rss <rss-file> --url <url> --next <xpath> [--name <long-name>]
-  dripfeed [options] update <comic-name> [--debug]
+  dripfeed stats [<comic-name>]
+  dripfeed [options] init <comic-name> --rss <rss-file> --url <url>
+                     (--next <xpath> | --next-css <selector> | --next-regex <pattern>
+                      | --archive <archive-url> --items <item-xpath> [--newest-first])
+                     [--name <long-name>] [--stream] [--max-body-size <bytes>] [--interval <interval>]
+                     [--num-entries <n>] [--gzip]
+  dripfeed [options] update <comic-name> [--debug] [--count <n>] [--force]
+  dripfeed [options] update-all [<pattern>...]
+  dripfeed [options] crawl <comic-name> --ahead <n>
+  dripfeed [options] seek <comic-name> <episode>
+  dripfeed [options] serve-schedule
+  dripfeed [options] work [--node <name>] [--lease <seconds>]
+  dripfeed [options] serve [--bind <address>] [--port <port>]
   dripfeed [options] remove <comic-name>
+  dripfeed [options] migrate-sqlite
+  dripfeed [options] import <file> [--format <format>] [--no-check] [--skip-invalid] [--overwrite]
+  dripfeed export [<file>] [--format <format>]
 
 Options:
   -h --help         Show this screen.
   --version         Show version.
   --log <log-file>  Log file for output (defaults to stdout)
-  --quiet           Equivalent to --log-level error
+  --quiet           Equivalent to --log-level error, and no per-comic report from update-all
   --verbose         Equivalent to --log-level debug
   --log-level debug|info|warning|error|critical  Show only logs from the specified level or above
+  --workers <n>     Number of comics to update concurrently for update-all, serve-schedule and work [default: 8]
+  --timeout <seconds>  Timeout for each page fetch [default: 30]
+  --per-host <n>    Maximum number of concurrent fetches from a single host [default: 4]
+  --pool-size <n>   Number of keep-alive connections to keep open per host [default: 10]
+  --rate <per-second>  Average number of fetches per second from a single host (0 for no limit) [default: 2]
+  --host-rates <rates>  Exceptions to --rate for particular hosts, e.g. example.com=0.5,cdn.example.com=10
+  --delay <seconds>  Pause between fetches when crawling [default: 1]
+  --statsd <host:port>  Also send the timings of each update to this StatsD agent (over UDP)
+  --profile <file>  Run under cProfile and write the profile to <file> (update-all, serve-schedule, work: one file per
+                    comic)
+  --trace-memory <n>  Trace allocations and report peak memory and the <n> lines holding most memory (per comic, as
+                    above)
+  --count <n>       Number of episodes to add with update [default: 1]
+  --interval <interval>  With init: how often serve-schedule should update the comic, e.g. 30m, 8h or 1d
+  --node <name>     With work: this worker's name, unique among the workers sharing the comics (default: host-pid)
+  --lease <seconds>  With work: how long a worker's claim on a comic lasts if it stops renewing it [default: 300]
+  --bind <address>  With serve: the address to listen on (0.0.0.0 for every interface) [default: 127.0.0.1]
+  --port <port>     With serve: the port to listen on [default: 8080]
+  --format <format>  With import and export: json or csv (default: csv for a .csv file, otherwise json)
+  --num-entries <n>  With init: how many entries the feed keeps (default: 20)
+  --max-body-size <bytes>  With init: refuse comic pages larger than this many bytes
+  --next-css <selector>    With init: CSS selector (instead of --next XPath) for the "next" link; needs cssselect
+  --next-regex <pattern>   With init: regular expression (instead of --next XPath) whose first group is the "next" link
 
 Arguments:
   --rss         Path to the RSS file for output (file will be created)
   --next        XPath expression to extract the "next" link from a comic page
+  --archive     Instead of --next: a page listing every episode (an archive page, or sitemap.xml)...
+  --items       ... and an XPath expression selecting the episode links on it, in order
+  --newest-first  The archive page lists the latest episode first
   --name        Optional long name for output (the short name is usually without spaces, since it's used on commandline)
+  --stream      Read comic pages incrementally, stopping as soon as the "next" link is found (for very large pages)
+  --gzip        Also write a gzipped copy of the feed, <rss-file>.gz (for web servers to send without compressing it)
   --debug       Raise error when updating, instead of writing it into RSS
+  --force       Update even if the comic is backing off after failed updates
+  --ahead       How many episodes beyond the current one to crawl
+  --no-check    Import without fetching each comic's page to check that its "next" link is found
+  --skip-invalid  Import the comics that pass the check even if others fail it (otherwise, nothing is imported)
+  --overwrite   Let imported comics replace configured comics of the same name
+  <file>        File to import comics from or export them to; - for stdin or stdout
+  <episode>     Episode number to move <comic-name> to (1 for its start url)
+  <pattern>     Only update comics whose name matches one of these shell-style patterns (default: all comics)
 
 Commands:
   list    Show all configured comics
   init    Create <rss-file> and set up config for <comic-name>
-  update  Update the RSS feed for <comic-name> with one entry (use cron for regular updates)
+  update  Update the RSS feed for <comic-name> with one entry, or <n> (use cron for regular updates)
+  update-all  Update every configured comic (or those matching <pattern>) with one entry each, in a single run
+  serve-schedule  Keep running, updating each comic every <interval> (instead of cron jobs); SIGHUP reloads config
+  work    Like serve-schedule, but sharing the comics with other workers using the same config (on other machines too)
+  serve   Serve every comic's feed over HTTP, at http://<address>:<port>/<comic-name>.rss
+  crawl   Resolve the next <n> episodes of <comic-name> now, so that updates needn't fetch anything
+  seek    Move <comic-name> back to <episode>, or forward to an episode already crawled (without fetching anything)
   info    Show all config information for <comic-name>
+  stats   Show timings, bytes fetched and error rates of recent updates of <comic-name> (or all comics)
   remove  Remove all configuration for <comic-name>
+  migrate-sqlite  Move all comics from the config file into a SQLite database (better for many comics)
+  import  Add all comics from a JSON or CSV <file> (as written by export), checking each one first
+  export  Write all comics, with their progress, as JSON or CSV to <file> (or stdout)
 """
 
 from __future__ import unicode_literals, print_function
+import contextlib
+from fnmatch import fnmatchcase
 from logging import getLogger
 import logging
 import os
-
-from .rss import parse_rss, add_error_entry, add_entry, init_rss
-from docopt import docopt
-from .comics import get_comic, XPathComic, remove_comic, get_configured_comics, put_comic
+import sys
+import time
+import six
+
+from .rss import write_entries, entry_item, error_item, init_rss
+from .archive import ArchiveComic
+from .bulk import InvalidImportError, export_comics, format_report, import_comics
+from docopt import DocoptExit, docopt
+from .episodes import EpisodeIndex, seek
+from .leases import DEFAULT_LEASE_DURATION
+from .fetch import configure_fetcher, interleave_hosts, url_hostname
+from .lookahead import LookaheadQueue, crawl
+from .comics import get_comic, XPathComic, remove_comic, get_configured_comics, put_comic, get_page_cache, \
+    migrate_to_sqlite, comic_lock, get_progress, put_progress, parse_interval, BackingOffError, NoMatchForXPathError, \
+    NO_NEXT_WARNING, DEFAULT_WORKERS
+from .profiling import is_profiling, profiled, profiled_comic
+from .schedule import Scheduler, Worker, install_signal_handlers
+from .stats import StatsLog, configure_statsd, format_summary, record_stats, summarise
+from .timing import recording, timed
 
 
 __version__ = "1.0.2"
@@ -56,21 +133,67 @@ def main():
 
 def run(args):
     init_logging(args)
+    init_fetcher(args)
+    configure_statsd(args['--statsd'])
+    trace_memory = int(args['--trace-memory']) if args['--trace-memory'] else None
+    with profiled(profile_file=args['--profile'], trace_memory=trace_memory,
+                   per_comic=args['update-all'] or args['serve-schedule'] or args['work']):
+        run_command(args)
+
+
+def run_command(args):
+    workers = int(args['--workers'] or DEFAULT_WORKERS)
+    if is_profiling() and workers > 1 and (args['update-all'] or args['serve-schedule'] or args['work']):
+        logger.info('Profiling: updating one comic at a time')
+        workers = 1
 
     if args['list']:
         list_comics()
     elif args['init']:
         create_comic(name=args['<comic-name>'], rss_file=args['<rss-file>'], next_xpath=args['<xpath>'],
-                     start_url=args['<url>'], full_name=args['<long-name>'])
+                     next_css=args['--next-css'], next_regex=args['--next-regex'], start_url=args['<url>'],
+                     full_name=args['<long-name>'], stream=args['--stream'],
+                     max_body_size=int(args['--max-body-size']) if args['--max-body-size'] else None,
+                     interval=args['--interval'], archive_url=args['<archive-url>'], item_xpath=args['<item-xpath>'],
+                     newest_first=args['--newest-first'],
+                     num_entries=int(args['--num-entries']) if args['--num-entries'] else None, gzip=args['--gzip'])
     elif args['update']:
-        run_once(args['<comic-name>'], raise_error=args['--debug'])
+        if int(args['--count']) < 1:
+            raise DocoptExit('--count must be at least 1')
+        run_once(args['<comic-name>'], raise_error=args['--debug'], count=int(args['--count']), force=args['--force'])
+    elif args['update-all']:
+        results = update_all(args['<pattern>'], workers=workers)
+        if not args['--quiet']:
+            print(os.linesep.join(format_update_report(results)))
+        if any(_is_failure(exception) for _, exception in results):
+            sys.exit(1)
+    elif args['serve-schedule']:
+        serve_schedule(workers=workers)
+    elif args['work']:
+        work(node=args['--node'], lease_duration=float(args['--lease']), workers=workers)
+    elif args['serve']:
+        serve_feeds(bind=args['--bind'], port=int(args['--port']))
+    elif args['crawl']:
+        crawl(args['<comic-name>'], ahead=int(args['<n>']), delay=float(args['--delay']))
+    elif args['seek']:
+        comic = seek(args['<comic-name>'], int(args['<episode>']))
+        logger.info('{0}: episode {1} at {2}'.format(comic.name, comic.progress.episode, comic.progress.next_url))
     elif args['info']:
         current_info(args['<comic-name>'])
+    elif args['stats']:
+        show_stats(args['<comic-name>'])
     elif args['remove']:
         if remove_comic(args['<comic-name>']):
             logger.info('removed')
         else:
             logger.info('not found')
+    elif args['migrate-sqlite']:
+        migrate_to_sqlite()
+    elif args['import']:
+        import_file(args['<file>'], format=args['--format'], workers=workers, check=not args['--no-check'],
+                    skip_invalid=args['--skip-invalid'], overwrite=args['--overwrite'])
+    elif args['export']:
+        export_comics(args['<file>'], format=args['--format'])
     else:
         raise ValueError('Wut? {0}'.format(args))
 
@@ -90,7 +213,7 @@ def init_logging(cli_args):
     log_file = cli_args['--log']
 
     # "update" command typically runs under cron: better to have no output
-    default_log_level = 'ERROR' if cli_args['update'] else 'INFO'
+    default_log_level = 'ERROR' if cli_args['update'] or cli_args['update-all'] else 'INFO'
 
     final_log_level = default_log_level
     if log_level:
@@ -103,49 +226,287 @@ def init_logging(cli_args):
     logging.basicConfig(filename=log_file, format='%(name)s [%(levelname)s] %(message)s')
 
 
-def create_comic(name, rss_file, next_xpath, start_url, full_name=None):
+def init_fetcher(cli_args):
+    host_rates = {}
+    for host_rate in (cli_args['--host-rates'] or '').split(','):
+        if host_rate.strip():
+            hostname, _, rate = host_rate.partition('=')
+            host_rates[hostname.strip()] = float(rate)
+    configure_fetcher(timeout=float(cli_args['--timeout']), per_host=int(cli_args['--per-host']),
+                      pool_size=int(cli_args['--pool-size']), rate=float(cli_args['--rate']) or None,
+                      host_rates=host_rates)
+
+
+def create_comic(name, rss_file, next_xpath, start_url, full_name=None, stream=False, max_body_size=None,
+                 next_css=None, next_regex=None, interval=None, archive_url=None, item_xpath=None, newest_first=False,
+                 num_entries=None, gzip=False):
     rss_file = os.path.abspath(rss_file)
-    comic = XPathComic(name=name, next_xpath=next_xpath, full_name=full_name, start_url=start_url, rss_file=rss_file,
-                       progress=None)
+    if interval is not None:
+        parse_interval(interval)  # fail early
+    if num_entries is not None and num_entries < 1:
+        raise ValueError('A feed needs at least one entry, not {0}'.format(num_entries))
+    if archive_url is not None:
+        comic = ArchiveComic(name=name, archive_url=archive_url, item_xpath=item_xpath, newest_first=newest_first,
+                             full_name=full_name, start_url=start_url, rss_file=rss_file,
+                             max_body_size=max_body_size, interval=interval, num_entries=num_entries, gzip=gzip,
+                             progress=None)
+    else:
+        comic = XPathComic(name=name, next_xpath=next_xpath, next_css=next_css, next_regex=next_regex,
+                           full_name=full_name, start_url=start_url, rss_file=rss_file, stream=stream,
+                           max_body_size=max_body_size, interval=interval, num_entries=num_entries, gzip=gzip,
+                           progress=None)
+    comic.selector  # fail early on an invalid expression (or a missing cssselect)
     put_comic(comic, create_file=True)
     init_rss(comic)
 
 
-def run_once(comic_name, raise_error=False):
-    comic = get_comic(comic_name)
-    try:
-        next_url = comic.next_url()
-    except Exception as exception:
-        if raise_error:
-            raise
-        write_error_rss(comic, exception, comic.current_url)
-    else:  # only update the config file if there was no problem
+def run_once(comic_name, raise_error=False, count=1, force=False):
+    if count < 1:
+        raise ValueError('Can only update by at least one episode, not {0}'.format(count))
+    with _recorded_lock(comic_name) as timings:
+        with timed('read'):
+            comic = get_comic(comic_name)
+        try:
+            timings.error = _update_locked(comic, raise_error=raise_error, count=count, force=force)
+        finally:
+            get_page_cache().flush()
+    if isinstance(timings.error, BackingOffError):
+        logger.info('{0} (use --force to update anyway)'.format(timings.error))
+
+
+@contextlib.contextmanager
+def _recorded_lock(comic_name):
+    """
+    comic_lock(comic_name), recording the timings of everything done while holding it (and of waiting for it) in the
+    comic's stats, and profiling it as one of the comic's updates when profiling per comic.
+    """
+    with profiled_comic(comic_name):
+        with recording(comic_name) as timings:
+            with comic_lock(comic_name):
+                try:
+                    yield timings
+                except Exception as exception:
+                    timings.error = exception
+                    raise
+                finally:
+                    record_stats(timings)
+
+
+def _update_locked(comic, raise_error=False, count=1, force=False):
+    """
+    Fetch the next `count` episodes of `comic` (stopping at the first error) and record them, in its progress and its
+    feed, with a single write each. Call this while holding comic_lock(comic.name), so reading, fetching and committing
+    progress are one transaction. Returns the error if there was one (and it wasn't raised), else None.
+
+    Failures are recorded in the progress too, and until its retry time (see Progress.record_failure()) the comic isn't
+    updated at all, unless `force`: that returns a BackingOffError. Only the first failure in a row gets an error entry
+    in the feed, so a comic that's stuck costs neither fetches nor feed rewrites.
+
+    Finding no next link (NoMatchForXPathError) isn't a failure, though: it's where every comic ends up once it has
+    caught up with the archive. That error is returned (or raised) all the same, but the comic doesn't back off, so a
+    new episode is picked up at the next update. Its progress counts such updates, and only the NO_NEXT_WARNING-th in a
+    row gets an error entry in the feed, in case it's the next link that moved.
+    """
+    if not force and comic.progress is not None and comic.progress.backing_off():
+        return BackingOffError(comic.name, 'backing off after {0} failures, until {1}'.format(
+            comic.progress.failures, time.strftime('%Y-%m-%d %H:%M', time.localtime(comic.progress.retry_at))))
+    queue = LookaheadQueue(comic.name)
+    queued = queue.read(comic.current_url)
+    num_queued = len(queued)
+    episodes = EpisodeIndex(comic.name)
+    first_episode = comic.progress.episode if comic.progress is not None else 1
+    chain = [comic.current_url]
+    items = []
+    error = None
+    for _ in range(count):
+        try:
+            # Episodes already seen (say, after seeking back) needn't be fetched again
+            next_url = queued.pop(0) if queued else (
+                episodes.following(first_episode + len(chain) - 1, chain[-1]) or comic.next_url())
+        except Exception as exception:
+            error = exception
+            break
         comic.update_progress(next_url)
-        put_comic(comic, overwrite=True)
-        write_success_rss(comic)
+        chain.append(next_url)
+        items.insert(0, entry_item(comic))
+
+    caught_up = isinstance(error, NoMatchForXPathError)
+    if caught_up:
+        comic.record_no_next()
+    elif error is not None:
+        comic.record_failure(error)
+    with timed('commit'):
+        put_progress(comic)
+        if len(queued) != num_queued:
+            queue.write(comic.current_url, queued)
+        episodes.record_chain(first_episode, chain)
+    if caught_up and comic.progress.no_next_count == NO_NEXT_WARNING:
+        items.insert(0, error_item('{0} (in {1} updates in a row, since {2}: has the next link moved?)'.format(
+            error, NO_NEXT_WARNING, time.strftime('%Y-%m-%d %H:%M', time.localtime(comic.progress.no_next_since))),
+            comic.current_url))
+    if error is not None:
+        if raise_error:
+            if items:
+                write_entries(comic.rss_file, items, drop_errors=True, num_entries=comic.num_entries,
+                              gzip=comic.gzip)
+            raise error
+        if not caught_up and comic.progress.failures == 1:
+            items.insert(0, error_item(error, comic.current_url))
+    if items:
+        write_entries(comic.rss_file, items, drop_errors=len(items) > 1 or error is None,
+                      num_entries=comic.num_entries, gzip=comic.gzip)
+    return error
+
+
+def update_all(patterns=None, workers=DEFAULT_WORKERS):
+    """
+    Update every configured comic (or only those whose name matches one of `patterns`) in one process. The config is
+    read once, and comics are updated concurrently by `workers` threads (each update locking only its own comic), so a
+    full sweep takes about as long as the slowest fetch rather than the sum of all of them. Returns a list of
+    (comic, exception) pairs, where exception is None for comics that were updated.
+    """
+    comics = [comic for comic in get_configured_comics()
+              if not patterns or any(fnmatchcase(comic.name, pattern) for pattern in patterns)]
+    if not comics:
+        logger.warning('No configured comics match {0}'.format(', '.join(patterns or [])))
+        return []
+
+    tripped = _tripped_host_breakers(comics)
+
+    def update(comic):
+        if comic in tripped:
+            return comic, BackingOffError(comic.name, 'every comic on {0} is failing'.format(
+                url_hostname(comic.current_url)))
+        try:
+            with _recorded_lock(comic.name) as timings:
+                with timed('read'):
+                    comic.progress = get_progress(comic.name)  # in case it was updated since we read the config
+                exception = timings.error = _update_locked(comic)
+        except Exception as error:
+            exception = error  # (python 3 unbinds the name of the except clause after it)
+            logger.debug('Error updating {0}'.format(comic.name), exc_info=True)
+        if exception is None:
+            logger.info('{0}: episode {1} at {2}'.format(comic.name, comic.progress.episode, comic.progress.next_url))
+        elif isinstance(exception, BackingOffError):
+            logger.info(six.text_type(exception))
+        elif isinstance(exception, NoMatchForXPathError):
+            logger.info('{0}: no new episode yet ({1})'.format(comic.name, exception))
+        else:
+            logger.error('{0}: {1}'.format(comic.name, exception))
+        return comic, exception
+
+    # Start on every host at once, rather than queueing on one host's rate limit while the others wait their turn
+    order = interleave_hosts(range(len(comics)), lambda i: comics[i].current_url)
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(max(1, min(workers, len(comics))))
+    try:
+        results = pool.map(lambda i: update(comics[i]), order, chunksize=1)
+        return [result for _, result in sorted(zip(order, results))]
+    finally:
+        pool.close()
+        pool.join()
+        get_page_cache().flush()
+
+
+def format_update_report(results):
+    """
+    One line per comic in `results` (as returned by update_all()).
+    """
+    lines = []
+    for comic, exception in results:
+        if exception is None:
+            lines.append('{0}: ok, episode {1} at {2}'.format(comic.name, comic.progress.episode,
+                                                              comic.progress.next_url))
+        elif isinstance(exception, BackingOffError):
+            lines.append('{0}: skipped, {1}'.format(comic.name, exception.reason))
+        elif isinstance(exception, NoMatchForXPathError):
+            lines.append('{0}: no new episode yet'.format(comic.name))
+        else:
+            lines.append('{0}: FAILED: {1}'.format(comic.name, exception))
+    return lines
+
+
+def _is_failure(exception):
+    # Backing off is the result of earlier failures, not a new one; and having caught up isn't a failure at all
+    return exception is not None and not isinstance(exception, (BackingOffError, NoMatchForXPathError))
+
+
+def _tripped_host_breakers(comics):
+    """
+    The comics not to update because every one of `comics` on their host is failing: the host is probably down, or
+    has changed its pages. Of those, only the comic due soonest is tried, as a probe; if it succeeds, the others
+    follow next time.
+    """
+    by_host = {}
+    for comic in comics:
+        by_host.setdefault(url_hostname(comic.current_url), []).append(comic)
+    tripped = set()
+    for host_comics in by_host.values():
+        if len(host_comics) > 1 and all(comic.progress is not None and comic.progress.failures
+                                        for comic in host_comics):
+            probe = min(host_comics, key=lambda comic: comic.progress.retry_at or 0)
+            tripped.update(comic for comic in host_comics if comic is not probe)
+    return tripped
+
+
+def serve_schedule(workers=DEFAULT_WORKERS):
+    scheduler = Scheduler(update=run_once, workers=workers)
+    install_signal_handlers(scheduler)
+    scheduler.run()
+
+
+def work(node=None, lease_duration=None, workers=DEFAULT_WORKERS):
+    worker = Worker(update=run_once, node=node, lease_duration=lease_duration or DEFAULT_LEASE_DURATION,
+                    workers=workers)
+    logger.info('Working as node {0}'.format(worker.node))
+    install_signal_handlers(worker)
+    worker.run()
+
+
+def serve_feeds(bind=None, port=None):
+    from .feedserver import DEFAULT_BIND, DEFAULT_PORT, FeedServer  # (http.server isn't needed by other commands)
+    server = FeedServer(bind=bind or DEFAULT_BIND, port=DEFAULT_PORT if port is None else port)
+    install_signal_handlers(server)
+    server.run()
+
+
+def import_file(filename, format=None, workers=DEFAULT_WORKERS, check=True, skip_invalid=False, overwrite=False):
+    try:
+        report = import_comics(filename, format=format, workers=workers, check=check, skip_invalid=skip_invalid,
+                               overwrite=overwrite)
+    except InvalidImportError as error:
+        print(os.linesep.join(format_report(error.results)))
+        raise
+    print(os.linesep.join(format_report(report)))
+    imported = sum(1 for _, _, error in report if error is None)
+    logger.info('Imported {0} of {1} comics'.format(imported, len(report)))
 
 
 def current_info(comic_name):
     config = get_comic(comic_name)
-    print(os.linesep.join(config.get_info()))
+    print(os.linesep.join(config.get_info(with_backlog=True)))
 
 
-def _write_rss(comic, op):
-    with open(comic.rss_file, 'r+b') as f:
-        prev_rss = parse_rss(f)
-        # feedparser closes file :-/
-    op(prev_rss)
-    with open(comic.rss_file, 'r+b') as f:
-        prev_rss.write_xml(f)
-        f.truncate()
+def show_stats(comic_name=None):
+    names = [comic_name] if comic_name else [comic.name for comic in get_configured_comics(allow_missing_file=True)]
+    shown = False
+    for name in names:
+        summary = summarise(StatsLog(name).records())
+        if summary is not None:
+            print(os.linesep.join(format_summary(name, summary)))
+            shown = True
+    if not shown:
+        print('(no updates recorded)')
 
 
 def write_error_rss(comic, exception, current_url):
-    _write_rss(comic, lambda parsed_rss: add_error_entry(parsed_rss, exception, current_url))
+    write_entries(comic.rss_file, [error_item(exception, current_url)], num_entries=comic.num_entries,
+                  gzip=comic.gzip)
 
 
 def write_success_rss(comic):
-    _write_rss(comic, lambda parsed_rss: add_entry(parsed_rss, comic))
+    write_entries(comic.rss_file, [entry_item(comic)], drop_errors=True, num_entries=comic.num_entries,
+                  gzip=comic.gzip)
 
 
 if __name__ == '__main__':
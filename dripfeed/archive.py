@@ -0,0 +1,192 @@
+"""
+Comics whose whole archive is listed on one page (an archive page, or sitemap.xml): an ArchiveComic is configured with
+the url of that page and an XPath expression selecting every episode link on it, in order. One fetch of the archive
+page resolves every episode, where following "next" links costs a fetch per episode.
+
+The list of episodes is kept in a per-comic index file, and updates walk it without touching the network. Only when
+the comic reaches the last known episode (or its current url isn't in the index yet) is the archive page fetched
+again, with a conditional GET: usually the server answers 304 Not Modified, and otherwise newly listed episodes are
+added to the end of the index (episodes that dropped off the page, as on archives showing only the latest few hundred,
+are kept).
+
+The index file holds a JSON header line (the archive url and expression it was built from, and the validators of the
+last response) followed by one episode url per line.
+"""
+from __future__ import unicode_literals
+import io
+import json
+from logging import getLogger
+from .comics import Comic, NoMatchForXPathError, comic_state_path, write_atomically
+from .fetch import get_fetcher, response_header
+from .twothree import urljoin
+
+__author__ = 'tikitu'
+
+
+logger = getLogger('dripfeed')
+
+
+class EndOfArchiveError(NoMatchForXPathError):
+    """
+    A NoMatchForXPathError, so that it's handled just like reaching the end of a comic that follows "next" links.
+    """
+
+    def __init__(self, archive_url=None, url=None):
+        Exception.__init__(self, '{0} is the last episode listed at {1}'.format(url, archive_url))
+        self.xpath = None
+        self.url = url
+        self.archive_url = archive_url
+
+
+class EmptyArchiveError(Exception):
+    """
+    The archive page lists no episodes at all: unlike reaching the end of the archive, that's a failure (most likely the
+    page changed, and item_xpath no longer matches).
+    """
+
+    def __init__(self, item_xpath=None, archive_url=None):
+        super(EmptyArchiveError, self).__init__('XPath expression {0} found no episodes listed at {1}'.format(
+            item_xpath, archive_url))
+        self.item_xpath = item_xpath
+        self.archive_url = archive_url
+
+
+class NotInArchiveError(Exception):
+    def __init__(self, archive_url=None, url=None):
+        super(NotInArchiveError, self).__init__('{0} is not listed at {1}'.format(url, archive_url))
+        self.archive_url = archive_url
+        self.url = url
+
+
+class ArchiveComic(Comic):
+    """
+    @arg archive_url: the page listing every episode
+    @arg item_xpath: selects the episode links on it (elements with an href, elements whose text is the url like a
+        sitemap's <loc>, or strings like //a/@href)
+    @arg newest_first: the archive page lists the latest episode first
+    @arg max_body_size: refuse archive pages larger than this many bytes
+    """
+
+    __slots__ = ('archive_url', 'item_xpath', 'newest_first', 'max_body_size')
+
+    def __init__(self, archive_url=None, item_xpath=None, newest_first=False, max_body_size=None, **kwargs):
+        super(ArchiveComic, self).__init__(**kwargs)
+        self.archive_url = archive_url
+        self.item_xpath = item_xpath
+        self.newest_first = newest_first
+        self.max_body_size = max_body_size
+
+    @property
+    def selector(self):
+        from .extract import get_selector  # lxml is only needed once we fetch
+        return get_selector(self.item_xpath)
+
+    @property
+    def index(self):
+        return ArchiveIndex(self)
+
+    def _next_url(self, current_url):
+        """
+        Call this while holding comic_lock(), since the index may be refreshed.
+        """
+        index = self.index
+        urls = index.read()
+        if current_url not in urls or urls[-1] == current_url:
+            urls = index.refresh()
+        try:
+            position = urls.index(current_url)
+        except ValueError:
+            raise NotInArchiveError(archive_url=self.archive_url, url=current_url)
+        if position == len(urls) - 1:
+            raise EndOfArchiveError(archive_url=self.archive_url, url=current_url)
+        return urls[position + 1]
+
+    def add_to_global_config(self, global_config):
+        super(ArchiveComic, self).add_to_global_config(global_config)
+        global_config.set(self.name, 'archive_url', self.archive_url)
+        global_config.set(self.name, 'item_xpath', self.item_xpath)
+        if self.newest_first:
+            global_config.set(self.name, 'newest_first', 'true')
+        if self.max_body_size is not None:
+            global_config.set(self.name, 'max_body_size', str(self.max_body_size))
+
+    def backlog(self):
+        urls = self.index.read()
+        try:
+            listed = len(urls) - 1 - urls.index(self.current_url)
+        except ValueError:
+            listed = 0
+        return max(listed, super(ArchiveComic, self).backlog())
+
+    def get_info(self, with_backlog=False):
+        result = super(ArchiveComic, self).get_info(with_backlog=with_backlog)
+        result.insert(2, '  Episodes listed at {0}'.format(self.archive_url))
+        return result
+
+
+class ArchiveIndex(object):
+    def __init__(self, comic):
+        self.comic = comic
+        self.filename = comic_state_path('archive', comic.name)
+
+    def _read(self):
+        """
+        (header, urls); an index built from a different archive url or expression counts as empty.
+        """
+        try:
+            with io.open(self.filename, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                urls = f.read().split()
+        except (IOError, ValueError):
+            return {}, []
+        if (header.get('archive_url'), header.get('item_xpath')) != (self.comic.archive_url, self.comic.item_xpath):
+            return {}, []
+        return header, urls
+
+    def read(self):
+        """
+        The known episode urls, oldest first.
+        """
+        return self._read()[1]
+
+    def refresh(self):
+        """
+        Fetch the archive page (conditionally, if it was fetched before) and add any new episodes to the index.
+        Returns the episode urls.
+        """
+        header, known = self._read()
+        headers = {}
+        if header.get('etag'):
+            headers['If-None-Match'] = header['etag']
+        if header.get('last_modified'):
+            headers['If-Modified-Since'] = header['last_modified']
+        page = get_fetcher().get(self.comic.archive_url, headers=headers or None,
+                                 stream=self.comic.max_body_size is not None)
+        try:
+            if page.status_code == 304 and known:
+                logger.debug('{0} not modified'.format(self.comic.archive_url))
+                return known
+            listed = [urljoin(self.comic.archive_url, href)
+                      for href in self.comic.selector.find_all_hrefs(page, max_body_size=self.comic.max_body_size)]
+        finally:
+            page.close()  # if it was streamed, see XPathComic._next_url()
+        if not listed:
+            raise EmptyArchiveError(item_xpath=self.comic.item_xpath, archive_url=self.comic.archive_url)
+        if self.comic.newest_first:
+            listed.reverse()
+        seen = set(known)
+        added = []
+        for url in listed:
+            if url not in seen:
+                seen.add(url)
+                added.append(url)
+        logger.debug('{0}: {1} new episodes listed at {2}'.format(self.comic.name, len(added), self.comic.archive_url))
+        header = {
+            'archive_url': self.comic.archive_url,
+            'item_xpath': self.comic.item_xpath,
+            'etag': response_header(page, 'ETag'),
+            'last_modified': response_header(page, 'Last-Modified'),
+        }
+        urls = known + added
+        write_atomically(self.filename, json.dumps(header) + '\n' + ''.join(url + '\n' for url in urls))
+        return urls
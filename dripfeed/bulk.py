@@ -0,0 +1,267 @@
+"""
+Adding and dumping many comics at once: `dripfeed export` writes every configured comic (with its progress) as JSON or
+CSV, and `dripfeed import` adds the comics in such a file in a single locked write to the comic store.
+
+Before importing, each comic is checked the way its first update would use it: its start page is fetched (even for an
+exported comic that's further along, whose current page may well have no next link yet), concurrently for all comics
+through the shared Fetcher, and its "next" expression must match a link that resolves to an absolute http(s) URL. The
+result is a report per comic, and by default nothing is imported unless every comic passed.
+"""
+from __future__ import unicode_literals
+import csv
+import io
+import json
+from logging import getLogger
+import os
+import sys
+import six
+from .archive import ArchiveComic
+from .comics import XPathComic, Progress, get_configured_comics, get_page_cache, parse_interval, put_comics, \
+    DEFAULT_WORKERS
+from .fetch import interleave_hosts
+from .rss import init_rss
+from .twothree import urlsplit
+
+__author__ = 'tikitu'
+
+
+logger = getLogger('dripfeed')
+
+FORMATS = ('json', 'csv')
+FIELDS = ('name', 'full_name', 'start_url', 'rss_file', 'next_xpath', 'next_css', 'next_regex', 'stream',
+          'archive_url', 'item_xpath', 'newest_first', 'max_body_size', 'interval', 'num_entries', 'gzip', 'episode',
+          'next_url', 'updated')
+
+
+class InvalidImportError(ValueError):
+    """
+    Some comics in an import file aren't valid; `results` has the (name, next url, error) of every comic.
+    """
+
+    def __init__(self, results):
+        failed = [name for name, _, error in results if error is not None]
+        super(InvalidImportError, self).__init__('{0} of {1} comics failed validation: {2}'.format(
+            len(failed), len(results), ', '.join(failed)))
+        self.results = results
+
+
+def guess_format(filename, format=None):
+    if format is None:
+        format = 'csv' if filename and filename.lower().endswith('.csv') else 'json'
+    if format not in FORMATS:
+        raise ValueError('Unknown format {0} (try {1})'.format(format, ' or '.join(FORMATS)))
+    return format
+
+
+def comic_to_row(comic):
+    progress = comic.progress
+    return {
+        'name': comic.name,
+        'full_name': comic.full_name,
+        'start_url': comic.start_url,
+        'rss_file': comic.rss_file,
+        'next_xpath': getattr(comic, 'next_xpath', None),
+        'next_css': getattr(comic, 'next_css', None),
+        'next_regex': getattr(comic, 'next_regex', None),
+        'stream': getattr(comic, 'stream', False),
+        'archive_url': getattr(comic, 'archive_url', None),
+        'item_xpath': getattr(comic, 'item_xpath', None),
+        'newest_first': getattr(comic, 'newest_first', False),
+        'max_body_size': comic.max_body_size,
+        'interval': comic.interval,
+        'num_entries': comic.num_entries,
+        'gzip': comic.gzip,
+        'episode': progress.episode if progress is not None else None,
+        'next_url': progress.next_url if progress is not None else None,
+        'updated': progress.updated if progress is not None else None,
+    }
+
+
+def comic_from_row(row):
+    """
+    An XPathComic or ArchiveComic from a dict with (some of) the keys in FIELDS, as read from JSON or CSV (where every
+    value is a string, and an empty one means "not set"). Raises ValueError if it's incomplete.
+    """
+    row = dict((key, value) for key, value in row.items() if value not in (None, ''))
+    unknown = set(row) - set(FIELDS)
+    if unknown:
+        raise ValueError('unknown fields {0}'.format(', '.join(sorted(unknown))))
+    missing = [field for field in ('name', 'start_url', 'rss_file') if field not in row]
+    if missing:
+        raise ValueError('missing {0}'.format(', '.join(missing)))
+    if not any(field in row for field in ('next_xpath', 'next_css', 'next_regex', 'archive_url')):
+        raise ValueError('needs one of next_xpath, next_css, next_regex or archive_url')
+    progress = None
+    if 'next_url' in row:
+        progress = Progress(episode=int(row.get('episode', 1)), next_url=row['next_url'],
+                            updated=int(row['updated']) if 'updated' in row else None)
+    common = dict(name=row['name'], full_name=row.get('full_name'), start_url=row['start_url'],
+                  rss_file=os.path.abspath(row['rss_file']),
+                  max_body_size=int(row['max_body_size']) if 'max_body_size' in row else None,
+                  interval=row.get('interval'),
+                  num_entries=int(row['num_entries']) if 'num_entries' in row else None,
+                  gzip=_boolean(row.get('gzip', False)), progress=progress)
+    if 'archive_url' in row:
+        if 'item_xpath' not in row:
+            raise ValueError('archive_url needs an item_xpath')
+        return ArchiveComic(archive_url=row['archive_url'], item_xpath=row['item_xpath'],
+                            newest_first=_boolean(row.get('newest_first', False)), **common)
+    return XPathComic(next_xpath=row.get('next_xpath'), next_css=row.get('next_css'), next_regex=row.get('next_regex'),
+                      stream=_boolean(row.get('stream', False)), **common)
+
+
+def _boolean(value):
+    if isinstance(value, six.string_types):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def write_rows(rows, f, format):
+    if format == 'json':
+        f.write(six.text_type(json.dumps(rows, indent=2, sort_keys=True)))  # (ASCII bytes, on python 2)
+        f.write('\n')
+    else:
+        writer = csv.DictWriter(f, FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict((key, _csv_value(value)) for key, value in row.items()))
+
+
+def _csv_value(value):
+    if value is None or value is False:
+        return ''
+    if value is True:
+        return 'true'
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode('utf-8')  # python 2's csv module only handles bytes
+    return value
+
+
+def read_rows(f, format):
+    if format == 'json':
+        rows = json.load(f)
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError('Expected a JSON list of comics')
+        return rows
+    rows = csv.DictReader(f)
+    if six.PY2:
+        return [dict((_decoded(key), _decoded(value)) for key, value in row.items()) for row in rows]
+    return list(rows)
+
+
+def _decoded(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _open(filename, mode, format):
+    """
+    `filename` opened for read_rows() or write_rows() (in `mode` 'r' or 'w'): as UTF-8 text, except for CSV on python
+    2, whose csv module reads and writes bytes.
+    """
+    if six.PY2 and format == 'csv':
+        return open(filename, mode + 'b')
+    return io.open(filename, mode, encoding='utf-8', newline='')
+
+
+def export_comics(filename=None, format=None):
+    """
+    Write every configured comic to `filename` (stdout if it's None or -).
+    """
+    format = guess_format(filename, format)
+    rows = [comic_to_row(comic) for comic in get_configured_comics(allow_missing_file=True)]
+    if filename in (None, '-'):
+        write_rows(rows, sys.stdout, format)
+    else:
+        with _open(filename, 'w', format) as f:
+            write_rows(rows, f, format)
+    return rows
+
+
+def validate(comics, workers=DEFAULT_WORKERS):
+    """
+    Fetch the start page of each comic (concurrently) and find its next url. Returns [(name, next url, error)], with
+    either the next url or the error None.
+    """
+    def check(comic):
+        try:
+            if comic.interval is not None:
+                parse_interval(comic.interval)
+            comic.selector  # an invalid expression, or a missing cssselect
+            next_url = comic._next_url(comic.start_url)
+            parts = urlsplit(next_url)
+            if parts.scheme not in ('http', 'https') or not parts.netloc:
+                raise ValueError('next link {0} is not an absolute http(s) url'.format(next_url))
+            return comic.name, next_url, None
+        except Exception as error:
+            logger.debug('Validating {0}'.format(comic.name), exc_info=True)
+            return comic.name, None, error
+
+    if not comics:
+        return []
+    order = interleave_hosts(range(len(comics)), lambda i: comics[i].start_url)
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(max(1, min(workers, len(comics))))
+    try:
+        results = pool.map(lambda i: check(comics[i]), order, chunksize=1)
+        return [result for _, result in sorted(zip(order, results))]
+    finally:
+        pool.close()
+        pool.join()
+        get_page_cache().flush()
+
+
+def import_comics(filename, format=None, workers=DEFAULT_WORKERS, check=True, skip_invalid=False, overwrite=False):
+    """
+    Add the comics in `filename` (stdin if it's -) to the comic store, in one write, and create the feeds that don't
+    exist yet. Returns [(name, next url, error)] for every comic in the file (the next url is None if not `check`);
+    raises InvalidImportError, without importing anything, if any comic is invalid, unless `skip_invalid`.
+    """
+    format = guess_format(filename, format)
+    if filename == '-':
+        rows = read_rows(sys.stdin, format)
+    else:
+        with _open(filename, 'r', format) as f:
+            rows = read_rows(f, format)
+
+    configured = set(comic.name for comic in get_configured_comics(allow_missing_file=True))
+    report = []  # (name, next url, error), in the order of the file
+    comics = []
+    for number, row in enumerate(rows, 1):
+        try:
+            comic = comic_from_row(row)
+            if any(other.name == comic.name for _, other in comics):
+                raise ValueError('listed twice')
+            if comic.name in configured and not overwrite:
+                raise ValueError('already configured (import with --overwrite to replace it)')
+        except ValueError as error:
+            report.append((number, (row.get('name') or 'comic #{0}'.format(number), None, error)))
+            continue
+        comics.append((number, comic))
+    if check:
+        checked = validate([comic for _, comic in comics], workers=workers)
+    else:
+        checked = [(comic.name, None, None) for _, comic in comics]
+    report = [result for _, result in sorted(report + [(number, result) for (number, _), result
+                                                         in zip(comics, checked)])]
+    valid = [comic for (_, comic), (_, _, error) in zip(comics, checked) if error is None]
+    if len(valid) < len(report) and not skip_invalid:
+        raise InvalidImportError(report)
+
+    if valid:
+        put_comics(valid, create_file=True, overwrite=overwrite)
+        for comic in valid:
+            if not os.path.exists(comic.rss_file):
+                init_rss(comic)
+    return report
+
+
+def format_report(report):
+    lines = []
+    for name, next_url, error in report:
+        if error is not None:
+            lines.append('{0}: FAILED: {1}'.format(name, error))
+        elif next_url is not None:
+            lines.append('{0}: ok, next episode at {1}'.format(name, next_url))
+        else:
+            lines.append('{0}: not checked'.format(name))
+    return lines
@@ -1,11 +1,17 @@
 from __future__ import unicode_literals, print_function
-from .twothree import ConfigParser, urljoin
+from .twothree import ConfigParser, urljoin, quote, replace
 import contextlib
 from logging import getLogger
 import os
+import re
+import stat
+import tempfile
+import time
 import portalocker
-import requests
-import lxml.html
+from six import StringIO, text_type
+from .fetch import get_fetcher
+from .pagecache import PageCache
+from .timing import timed
 
 __author__ = 'tikitu'
 
@@ -14,14 +20,183 @@ CONF_FILENAME = os.path.expanduser('~/.dripfeed.cfg')
 
 logger = getLogger('dripfeed')
 
+DEFAULT_WORKERS = 8  # comics updated (or checked) concurrently
+
+
+def state_path(*parts):
+    """
+    Path for dripfeed's own bookkeeping files (caches and the like), which live in a directory next to the config file.
+    """
+    return os.path.join(CONF_FILENAME + '.d', *parts)
+
+
+def comic_state_path(kind, comic_name):
+    """
+    Path for one of a comic's own bookkeeping files (its lock, its progress, ...).
+    """
+    return state_path(kind, quote(comic_name, safe=''))
+
+
+def ensure_directory(directory):
+    """
+    Create `directory` (and its parents) if it doesn't exist, without failing when another process or thread creates
+    it at the same time.
+    """
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:  # created concurrently
+            if not os.path.isdir(directory):
+                raise
+
+
+def write_atomically(filename, content, skip_unchanged=False):
+    """
+    Readers of `filename` see either the old or the new content, never a half-written file: `content` (bytes or text)
+    goes to a temporary file next to it, which is synced to disk and then renamed over it, keeping its permissions.
+    Symlinks are followed, and anything that isn't a regular file (/dev/null, say) is simply written to.
+
+    `content` can also be an iterable of bytes chunks, so that it needn't all be in memory at once. If iterating it
+    raises, the file is left as it was.
+
+    @arg skip_unchanged: don't write at all if `filename` already holds exactly `content` (bytes or text only)
+    @return: whether the file was written
+    """
+    filename = os.path.realpath(filename)
+    mode = 'w' if isinstance(content, text_type) else 'wb'
+    if skip_unchanged and _has_content(filename, content):
+        return False
+    if os.path.exists(filename) and not os.path.isfile(filename):
+        with open(filename, mode) as f:
+            _write_content(f, content)
+        return True
+    directory = os.path.dirname(filename)
+    ensure_directory(directory)
+    permissions = _permissions(filename)
+    fd, temp_filename = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode) as f:
+            _write_content(f, content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_filename, permissions)
+        replace(temp_filename, filename)
+    except:
+        os.remove(temp_filename)
+        raise
+    _fsync_directory(directory)
+    return True
+
+
+def _write_content(f, content):
+    if isinstance(content, (bytes, text_type)):
+        f.write(content)
+    else:
+        for chunk in content:
+            f.write(chunk)
+
+
+def _has_content(filename, content):
+    try:
+        with open(filename, 'rb' if isinstance(content, bytes) else 'r') as f:
+            return f.read() == content
+    except IOError:
+        return False
+
+
+def _permissions(filename):
+    """
+    Those of `filename` if it exists, otherwise what the umask allows for a new file (mkstemp's are owner-only).
+    """
+    try:
+        return stat.S_IMODE(os.stat(filename).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def _fsync_directory(directory):
+    """
+    Make the rename itself durable. Not every platform can open a directory: there, this is up to the OS.
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def comic_lock(comic_name):
+    """
+    Exclusive lock on a single comic, held for a whole update (read progress, fetch, write progress and feed) so that
+    concurrent updates of the *same* comic can't interleave, while updates of different comics never wait for each
+    other. Structural changes to the store (adding and removing comics) lock the whole config file instead.
+    """
+    filename = comic_state_path('locks', comic_name)
+    ensure_directory(os.path.dirname(filename))
+    with open(filename, 'a') as fh:
+        with timed('lock'):
+            portalocker.lock(fh, portalocker.LOCK_EX)
+        yield
+
+
+_page_cache = None
+
+
+def get_page_cache():
+    global _page_cache
+    filename = state_path('pagecache')
+    if _page_cache is None or _page_cache.filename != filename:
+        _page_cache = PageCache(filename)
+    return _page_cache
+
+
+BACKOFF_BASE = 10 * 60
+BACKOFF_MAX = 24 * 60 * 60
+MAX_ERROR_LENGTH = 200
+NO_NEXT_WARNING = 10  # updates in a row finding no next link before the feed gets an error entry saying so
+
+_INTERVAL = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*([smhd]?)\s*$')
+_INTERVAL_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_interval(interval):
+    """
+    Seconds in an interval like '90', '90s', '30m', '8h' or '1.5d'.
+    """
+    match = _INTERVAL.match(interval)
+    seconds = float(match.group(1)) * _INTERVAL_UNITS[match.group(2)] if match is not None else 0
+    if seconds <= 0:
+        raise ValueError('Not an interval: {0} (try e.g. 30m, 8h or 1d)'.format(interval))
+    return seconds
+
 
 class Comic(object):
-    def __init__(self, name=None, full_name=None, start_url=None, rss_file=None, progress=None):
+    """
+    @arg interval: how often `dripfeed serve-schedule` should update the comic, e.g. '8h' (see parse_interval())
+    @arg num_entries: how many entries its feed keeps (None for rss.NUM_ENTRIES)
+    @arg gzip: also write a gzipped copy of the feed, <rss_file>.gz, for web servers to send as it is
+    """
+
+    __slots__ = ('name', 'full_name', 'start_url', 'rss_file', 'progress', 'interval', 'num_entries', 'gzip')
+
+    def __init__(self, name=None, full_name=None, start_url=None, rss_file=None, progress=None, interval=None,
+                 num_entries=None, gzip=False):
         self.name = name
         self.full_name = full_name or name
         self.start_url = start_url
         self.rss_file = rss_file
         self.progress = progress
+        self.interval = interval
+        self.num_entries = num_entries
+        self.gzip = gzip
 
     def next_update(self, config):
         raise NotImplementedError()
@@ -32,6 +207,12 @@ class Comic(object):
         global_config.set(self.name, 'long_name', self.full_name)
         global_config.set(self.name, 'start_url', self.start_url)
         global_config.set(self.name, 'rss_file', self.rss_file)
+        if self.interval is not None:
+            global_config.set(self.name, 'interval', self.interval)
+        if self.num_entries is not None:
+            global_config.set(self.name, 'num_entries', str(self.num_entries))
+        if self.gzip:
+            global_config.set(self.name, 'gzip', 'true')
         if self.progress is not None:
             self.progress.add_to_global_config(global_config, under_name=self.name)
 
@@ -50,17 +231,66 @@ class Comic(object):
             self.progress = Progress(episode=1, next_url=self.start_url)
         self.progress.episode += 1
         self.progress.next_url = next_url
+        self.progress.updated = int(time.time())
+        self.progress.record_episode()
+
+    def record_failure(self, exception):
+        if self.progress is None:
+            self.progress = Progress(episode=1, next_url=self.start_url)
+        self.progress.record_failure(exception)
+
+    def record_no_next(self):
+        if self.progress is None:
+            self.progress = Progress(episode=1, next_url=self.start_url)
+        self.progress.record_no_next()
 
-    def get_info(self):
+    def backlog(self):
+        """
+        The number of episodes known beyond the current one (see episodes.EpisodeIndex), without fetching anything.
+        """
+        from .episodes import EpisodeIndex  # (which imports this module)
+        index = EpisodeIndex(self.name)
+        episode = self.progress.episode if self.progress is not None else 1
+        if index.url(episode) != self.current_url:
+            return 0  # the index follows other urls from here (or doesn't reach this far)
+        return max(0, index.last - episode)
+
+    def get_info(self, with_backlog=False):
+        """
+        Lines describing the comic. `with_backlog` adds the number of episodes known beyond the current one, which
+        means reading its episode index (see backlog()): not something to do for every comic in a list.
+        """
         result = [
             '{0}: {1}'.format(self.name, self.full_name),
             '  Outputs to {0}'.format(self.rss_file),
         ]
         if self.progress is not None:
             result.append('  Episode {0} at {1}'.format(self.progress.episode, self.progress.next_url))
+            if self.progress.failures:
+                result.append('  Failed {0} times in a row, next try after {1}: {2}'.format(
+                    self.progress.failures, time.strftime('%Y-%m-%d %H:%M', time.localtime(self.progress.retry_at)),
+                    self.progress.last_error))
+            if self.progress.no_next_count:
+                result.append('  No next link since {0} ({1} updates in a row)'.format(
+                    time.strftime('%Y-%m-%d %H:%M', time.localtime(self.progress.no_next_since)),
+                    self.progress.no_next_count))
+        backlog = self.backlog() if with_backlog else 0
+        if backlog:
+            result.append('  {0} more episodes known (crawled or seen before), not yet in the feed'.format(backlog))
         return result
 
 
+class BackingOffError(Exception):
+    """
+    Not an error in itself: the comic wasn't updated because its recent updates failed (see Progress.backing_off()).
+    """
+
+    def __init__(self, comic_name=None, reason=None):
+        super(BackingOffError, self).__init__('{0}: not updating, {1}'.format(comic_name, reason))
+        self.comic_name = comic_name
+        self.reason = reason
+
+
 class NoMatchForXPathError(Exception):
     def __init__(self, xpath=None, url=None):
         super(NoMatchForXPathError, self).__init__('XPath expression {0} found no match in url {1}'.format(xpath, url))
@@ -69,23 +299,68 @@ class NoMatchForXPathError(Exception):
 
 
 class XPathComic(Comic):
-    def __init__(self, next_xpath=None, **kwargs):
+    """
+    The next link is selected by `next_xpath`, or instead by a CSS selector `next_css` or a regular expression
+    `next_regex` (see dripfeed.extract).
+
+    @arg stream: read pages incrementally, stopping as soon as the next link is found
+    @arg max_body_size: refuse pages larger than this many bytes
+    """
+
+    __slots__ = ('next_xpath', 'next_css', 'next_regex', 'stream', 'max_body_size')
+
+    def __init__(self, next_xpath=None, next_css=None, next_regex=None, stream=False, max_body_size=None, **kwargs):
         super(XPathComic, self).__init__(**kwargs)
         self.next_xpath = next_xpath
+        self.next_css = next_css
+        self.next_regex = next_regex
+        self.stream = stream
+        self.max_body_size = max_body_size
+
+    @property
+    def selector(self):
+        from .extract import get_selector  # lxml is only needed once we fetch
+        if self.next_regex is not None:
+            return get_selector(self.next_regex, kind='regex')
+        if self.next_css is not None:
+            return get_selector(self.next_css, kind='css')
+        return get_selector(self.next_xpath)
 
     def _next_url(self, current_url):
-        page = requests.get(current_url)
-        tree = lxml.html.fromstring(page.content)
-        elems = tree.xpath(self.next_xpath)
-        if not elems:
-            raise NoMatchForXPathError(xpath=self.next_xpath, url=current_url)
-        next_url = elems[0].attrib['href']
-        next_url = urljoin(current_url, next_url)  # convert relative url to absolute, e.g. ?p=2 to http://...
+        selector = self.selector
+        page_cache = get_page_cache()
+        cached = page_cache.lookup(current_url, selector.key)
+        # With a max_body_size, the body is read in chunks even if not self.stream, so that it can be cut off
+        page = get_fetcher().get(current_url, headers=cached.request_headers() if cached else None,
+                                 stream=self.stream or self.max_body_size is not None)
+        try:
+            if cached is not None and page.status_code == 304:
+                logger.debug('{0} not modified, reusing cached next url'.format(current_url))
+                next_url = cached.next_url
+            else:
+                next_url = self._extract_next_url(selector, page, current_url)
+                page_cache.store(current_url, selector.key, page, next_url)
+        finally:
+            page.close()  # a streamed page holds on to its connection (and its host's slot) until it's closed
+        if next_url is None:
+            raise NoMatchForXPathError(xpath=selector.expression, url=current_url)
         return next_url
 
+    def _extract_next_url(self, selector, page, current_url):
+        next_url = selector.find_href(page, stream=self.stream, max_body_size=self.max_body_size)
+        if next_url is None:
+            return None
+        return urljoin(current_url, next_url)  # convert relative url to absolute, e.g. ?p=2 to http://...
+
     def add_to_global_config(self, global_config):
         super(XPathComic, self).add_to_global_config(global_config)
-        global_config.set(self.name, 'next_xpath', self.next_xpath)
+        for option in ('next_xpath', 'next_css', 'next_regex'):
+            if getattr(self, option) is not None:
+                global_config.set(self.name, option, getattr(self, option))
+        if self.stream:
+            global_config.set(self.name, 'stream', 'true')
+        if self.max_body_size is not None:
+            global_config.set(self.name, 'max_body_size', str(self.max_body_size))
 
 
 class Progress(object):
@@ -95,9 +370,55 @@ class Progress(object):
     url for the comic.
     """
 
-    def __init__(self, episode=1, next_url=None):
+    __slots__ = ('episode', 'next_url', 'updated', 'failures', 'last_error', 'retry_at', 'no_next_since',
+                 'no_next_count')
+
+    def __init__(self, episode=1, next_url=None, updated=None, failures=0, last_error=None, retry_at=None,
+                 no_next_since=None, no_next_count=0):
         self.episode = episode
         self.next_url = next_url
+        self.updated = updated  # unix time of the last successful update, if known
+        self.failures = failures  # number of updates in a row that failed
+        self.last_error = last_error
+        self.retry_at = retry_at  # unix time: after failures, updates are skipped until then
+        self.no_next_since = no_next_since  # unix time of the first update in a row that found no next link
+        self.no_next_count = no_next_count  # number of updates in a row that found no next link
+
+    def record_failure(self, exception, now=None):
+        """
+        Back off exponentially: each failure in a row doubles the time until the next try, up to BACKOFF_MAX.
+        """
+        now = time.time() if now is None else now
+        self.failures += 1
+        self.last_error = ' '.join(text_type(exception).split())[:MAX_ERROR_LENGTH]
+        self.retry_at = int(now + min(BACKOFF_BASE * 2 ** (self.failures - 1), BACKOFF_MAX))
+
+    def record_success(self):
+        self.failures = 0
+        self.last_error = None
+        self.retry_at = None
+
+    def record_episode(self):
+        """
+        There's a next link again, or the comic was moved to a known episode.
+        """
+        self.record_success()
+        self.no_next_since = None
+        self.no_next_count = 0
+
+    def record_no_next(self, now=None):
+        """
+        Not a failure: that's what updates find once the comic has caught up. But if it goes on for long, the next
+        link may have moved (see NO_NEXT_WARNING).
+        """
+        self.record_success()
+        if not self.no_next_count:
+            self.no_next_since = int(time.time() if now is None else now)
+        self.no_next_count += 1
+
+    def backing_off(self, now=None):
+        now = time.time() if now is None else now
+        return self.retry_at is not None and now < self.retry_at
 
     def add_to_global_config(self, global_config, under_name):
         """
@@ -105,61 +426,70 @@ class Progress(object):
         """
         global_config.set(under_name, 'next_url', self.next_url)
         global_config.set(under_name, 'episode', str(self.episode))
+        if self.updated is not None:
+            global_config.set(under_name, 'updated', str(self.updated))
+        failure_options = (
+            ('failures', str(self.failures)),
+            ('last_error', (self.last_error or '').replace('%', '%%')),  # %% for the ConfigParser's interpolation
+            ('retry_at', str(self.retry_at)),
+        )
+        for option, value in failure_options:
+            if self.failures:
+                global_config.set(under_name, option, value)
+            elif global_config.has_option(under_name, option):
+                global_config.remove_option(under_name, option)  # it was failing when this config was written
+        for option, value in (('no_next_since', str(self.no_next_since)), ('no_next_count', str(self.no_next_count))):
+            if self.no_next_count:
+                global_config.set(under_name, option, value)
+            elif global_config.has_option(under_name, option):
+                global_config.remove_option(under_name, option)
 
 
 @contextlib.contextmanager
-def _locked_config_file():
+def _locked_config_file(shared=False):
     """
     Get and release lock on global config file.
-    We use this whenever reading/writing (but *not* over whole program run!).
-    This locking pattern makes it safe to run multiple instances concurrently, so long as they don't update the same
-    comic: update Gunnerkrigg Court daily and Narbonic hourly with separate cron jobs (but don't update Narbonic hourly
-    *and* daily, although why would you want to?).
+    We use this whenever reading/writing (but *not* over whole program run!): readers take a shared lock, writers an
+    exclusive one. Progress updates don't write the config file at all (see put_progress()), so this is only
+    contended by structural changes.
+    Writers replace the config file rather than rewriting it (see write_atomically()), so the lock is on a separate
+    lock file: a lock on the config file itself would stay with the replaced file.
     """
     filename = CONF_FILENAME
     if not all((os.path.isfile(filename),
                 os.access(filename, os.R_OK),
                 os.access(filename, os.W_OK))):
         raise ValueError('File {0} either does not exist or is not read/writeable.'.format(filename))
-    fh = None
-    try:
-        fh = open(filename, 'r+')
-        portalocker.lock(fh, portalocker.LOCK_EX)
-        yield fh
-    finally:
-        if fh is not None:
-            fh.close()
+    lock_filename = state_path('config.lock')
+    ensure_directory(os.path.dirname(lock_filename))
+    with open(lock_filename, 'a') as lock:
+        portalocker.lock(lock, portalocker.LOCK_SH if shared else portalocker.LOCK_EX)
+        with open(filename, 'r') as fh:  # opened only once locked: until then, it might still be replaced
+            yield fh
 
 
-def get_comic(comic_name):
-    with _locked_config_file() as f:
-        global_config = ConfigParser(defaults={'episode': 1, 'long_name': None})
-        global_config.read_file(f)
-        return _unlocked_get_comic(comic_name, global_config)
+def get_store():
+    """
+    The comic store in use: the SQLite database if one has been created (see migrate_to_sqlite()), otherwise the INI
+    config file. Both have the same methods as this module's get_comic(), put_comics(), etc.
+    """
+    filename = sqlite_filename()
+    if os.path.isfile(filename):
+        from .sqlitestore import SqliteStore
+        return SqliteStore(filename)
+    return IniStore()
 
 
-def _unlocked_get_comic(comic_name, global_config):
-    if not global_config.has_section(comic_name):
-        raise ValueError(u'Comic {0} is not configured'.format(comic_name))
-    if global_config.has_option(comic_name, 'next_url'):
-        progress = Progress(
-            episode=int(global_config.get(comic_name, 'episode')),
-            next_url=global_config.get(comic_name, 'next_url'),
-        )
-    else:
-        progress = None
-    comic = XPathComic(name=comic_name,
-                       full_name=global_config.get(comic_name, 'long_name'),
-                       start_url=global_config.get(comic_name, 'start_url'),
-                       rss_file=global_config.get(comic_name, 'rss_file'),
-                       next_xpath=global_config.get(comic_name, 'next_xpath'),
-                       progress=progress)
-    return comic
+def sqlite_filename():
+    return os.path.splitext(CONF_FILENAME)[0] + '.sqlite'
+
+
+def get_comic(comic_name):
+    return get_store().get_comic(comic_name)
 
 
 def get_configured_comics(allow_missing_file=False):
-    global_config = get_global_config(allow_missing_file=allow_missing_file)
-    return [_unlocked_get_comic(comic_name, global_config) for comic_name in global_config.sections()]
+    return get_store().get_configured_comics(allow_missing_file=allow_missing_file)
 
 
 def put_comic(comic, create_file=False, overwrite=False):
@@ -169,42 +499,258 @@ def put_comic(comic, create_file=False, overwrite=False):
 
     @arg comic: Comic object
     """
-    filename = CONF_FILENAME
-    if create_file and not os.path.isfile(filename):
-        logger.info('Creating file {0}'.format(filename))
-        with open(filename, 'w') as f:
-            f.write(os.linesep)
-    with _locked_config_file() as f:
-        global_config = ConfigParser()
-        global_config.read_file(f)
-        if global_config.has_section(comic.name) and not overwrite:
-            raise ValueError('Comic {0} is already configured!'.format(comic.name))
-        action = 'Updating' if overwrite else 'Adding'
-        logger.info('{0} {1} in config file {2}'.format(action, comic.name, filename))
-        comic.add_to_global_config(global_config)
+    put_comics([comic], create_file=create_file, overwrite=overwrite)
+
+
+def put_comics(comics, create_file=False, overwrite=False):
+    """
+    Like put_comic(), but for any number of comics in a single locked write.
+
+    @arg comics: list of Comic objects
+    """
+    get_store().put_comics(comics, create_file=create_file, overwrite=overwrite)
+
+
+def put_progress(comic):
+    """
+    Save only the progress of `comic`. Call this while holding comic_lock(comic.name).
+    """
+    get_store().put_progress(comic)
+
 
-        # Replace the *entire* file contents: this is why we need to lock so carefully!
-        f.seek(0)
-        global_config.write(f)
-        f.truncate()
+def get_progress(comic_name):
+    """
+    The latest saved progress of a comic (None if it hasn't been updated yet). Call this while holding
+    comic_lock(comic_name), to refresh a comic that was read earlier.
+    """
+    return get_store().get_progress(comic_name)
 
 
 def remove_comic(comic_name):
-    with _locked_config_file() as f:
+    return get_store().remove_comic(comic_name)
+
+
+def migrate_to_sqlite():
+    """
+    Copy every comic from the INI config file into a new SQLite database, which is used from then on.
+    """
+    filename = sqlite_filename()
+    if os.path.exists(filename):
+        raise ValueError('{0} already exists'.format(filename))
+    from .sqlitestore import SqliteStore
+    comics = IniStore().get_configured_comics()
+    if os.path.exists(filename + '.tmp'):
+        os.remove(filename + '.tmp')  # left over from an earlier attempt
+    store = SqliteStore(filename + '.tmp')
+    store.put_comics(comics)
+    os.rename(filename + '.tmp', filename)  # only start using it once it's complete
+    logger.info('Copied {0} comics to {1}; {2} is no longer used'.format(len(comics), filename, CONF_FILENAME))
+    return comics
+
+
+def comic_to_options(comic):
+    """
+    The config options of `comic`, as strings, exactly as they'd be written to its INI config file section.
+    """
+    global_config = ConfigParser()
+    comic.add_to_global_config(global_config)
+    return global_config.items(comic.name, raw=True)
+
+
+def comic_from_options(comic_name, options):
+    return _unlocked_get_comic(comic_name, options_config(comic_name, options))
+
+
+def options_config(comic_name, options):
+    """
+    A ConfigParser with a single section `comic_name`, holding `options` (as returned by comic_to_options()).
+    """
+    global_config = ConfigParser()
+    global_config.add_section(comic_name)
+    for option, value in options:
+        global_config.set(comic_name, option, value)
+    return global_config
+
+
+class IniStore(object):
+    """
+    Comics stored as sections of the INI config file CONF_FILENAME. Progress updates are written to a small file per
+    comic instead (under state_path('progress')), which overrides the progress in the config file: that way an update
+    never has to rewrite (or lock) the whole config file.
+    """
+
+    @property
+    def filename(self):
+        return CONF_FILENAME
+
+    def get_comic(self, comic_name):
+        with _locked_config_file(shared=True) as f:
+            global_config = self._index().section_config(f, comic_name)
+            comic = _unlocked_get_comic(comic_name, global_config)
+        self._read_progress_file(comic)
+        return comic
+
+    def get_configured_comics(self, allow_missing_file=False):
+        global_config = get_global_config(allow_missing_file=allow_missing_file)
+        comics = [_unlocked_get_comic(comic_name, global_config) for comic_name in global_config.sections()]
+        for comic in comics:
+            self._read_progress_file(comic)
+        return comics
+
+    def get_progress(self, comic_name):
+        global_config = self._progress_file_config(comic_name)
+        if global_config is None:
+            return self.get_comic(comic_name).progress
+        return _unlocked_get_progress(comic_name, global_config)
+
+    def _index(self):
+        from .configindex import ConfigIndex
+        return ConfigIndex(state_path('index.sqlite'))
+
+    def put_progress(self, comic):
         global_config = ConfigParser()
-        global_config.read_file(f)
-        removed = global_config.remove_section(comic_name)
-        f.seek(0)
-        global_config.write(f)
-        f.truncate()
-    return removed
+        global_config.add_section(comic.name)
+        comic.progress.add_to_global_config(global_config, under_name=comic.name)
+        out = StringIO()
+        global_config.write(out)
+        write_atomically(comic_state_path('progress', comic.name), out.getvalue())
+
+    def _write_config(self, filename, global_config):
+        """
+        Call this while holding the config file's exclusive lock.
+        """
+        out = StringIO()
+        global_config.write(out)
+        write_atomically(filename, out.getvalue(), skip_unchanged=True)
+
+    def _read_progress_file(self, comic):
+        global_config = self._progress_file_config(comic.name)
+        if global_config is not None:
+            comic.progress = _unlocked_get_progress(comic.name, global_config)
+
+    def _progress_file_config(self, comic_name):
+        try:
+            with open(comic_state_path('progress', comic_name), 'r') as f:
+                global_config = ConfigParser()
+                global_config.read_file(f)
+                return global_config
+        except IOError:  # never updated since it was put in the config file
+            return None
+
+    def _remove_progress_file(self, comic_name):
+        try:
+            os.remove(comic_state_path('progress', comic_name))
+        except OSError:
+            pass
+
+    def put_comics(self, comics, create_file=False, overwrite=False):
+        filename = self.filename
+        if create_file and not os.path.isfile(filename):
+            logger.info('Creating file {0}'.format(filename))
+            with open(filename, 'w') as f:
+                f.write(os.linesep)
+        with _locked_config_file() as f:
+            global_config = ConfigParser()
+            global_config.read_file(f)
+            for comic in comics:
+                if global_config.has_section(comic.name) and not overwrite:
+                    raise ValueError('Comic {0} is already configured!'.format(comic.name))
+            action = 'Updating' if overwrite else 'Adding'
+            for comic in comics:
+                logger.info('{0} {1} in config file {2}'.format(action, comic.name, filename))
+                if global_config.has_section(comic.name):
+                    # Replace the comic rather than merging into it (an old next_css would win over a new next_xpath),
+                    # but keep its place in the file
+                    for option in global_config.options(comic.name):
+                        global_config.remove_option(comic.name, option)
+                comic.add_to_global_config(global_config)
+
+            # Replace the *entire* file contents: this is why we need to lock so carefully!
+            self._write_config(filename, global_config)
+            for comic in comics:  # the config file has the latest progress now
+                self._remove_progress_file(comic.name)
+
+    def remove_comic(self, comic_name):
+        filename = self.filename
+        with _locked_config_file() as f:
+            global_config = ConfigParser()
+            global_config.read_file(f)
+            removed = global_config.remove_section(comic_name)
+            self._write_config(filename, global_config)
+            self._remove_progress_file(comic_name)
+        return removed
+
+
+def _unlocked_get_comic(comic_name, global_config):
+    if not global_config.has_section(comic_name):
+        raise ValueError(u'Comic {0} is not configured'.format(comic_name))
+    progress = _unlocked_get_progress(comic_name, global_config)
+    if global_config.has_option(comic_name, 'archive_url'):
+        from .archive import ArchiveComic
+        return ArchiveComic(name=comic_name,
+                            full_name=_get_option(global_config, comic_name, 'long_name'),
+                            start_url=global_config.get(comic_name, 'start_url'),
+                            rss_file=global_config.get(comic_name, 'rss_file'),
+                            archive_url=global_config.get(comic_name, 'archive_url'),
+                            item_xpath=global_config.get(comic_name, 'item_xpath'),
+                            newest_first=global_config.has_option(comic_name, 'newest_first') and
+                            global_config.getboolean(comic_name, 'newest_first'),
+                            max_body_size=_get_int_option(global_config, comic_name, 'max_body_size'),
+                            interval=_get_option(global_config, comic_name, 'interval'),
+                            num_entries=_get_int_option(global_config, comic_name, 'num_entries'),
+                            gzip=global_config.has_option(comic_name, 'gzip') and
+                            global_config.getboolean(comic_name, 'gzip'),
+                            progress=progress)
+    comic = XPathComic(name=comic_name,
+                       full_name=_get_option(global_config, comic_name, 'long_name'),
+                       start_url=global_config.get(comic_name, 'start_url'),
+                       rss_file=global_config.get(comic_name, 'rss_file'),
+                       next_xpath=_get_option(global_config, comic_name, 'next_xpath'),
+                       next_css=_get_option(global_config, comic_name, 'next_css'),
+                       next_regex=_get_option(global_config, comic_name, 'next_regex'),
+                       stream=global_config.has_option(comic_name, 'stream') and
+                       global_config.getboolean(comic_name, 'stream'),
+                       max_body_size=_get_int_option(global_config, comic_name, 'max_body_size'),
+                       interval=_get_option(global_config, comic_name, 'interval'),
+                       num_entries=_get_int_option(global_config, comic_name, 'num_entries'),
+                       gzip=global_config.has_option(comic_name, 'gzip') and
+                       global_config.getboolean(comic_name, 'gzip'),
+                       progress=progress)
+    return comic
+
+
+def _unlocked_get_progress(comic_name, global_config):
+    if not global_config.has_option(comic_name, 'next_url'):
+        return None
+    return Progress(
+        episode=int(_get_option(global_config, comic_name, 'episode', '1')),
+        next_url=global_config.get(comic_name, 'next_url'),
+        updated=_get_int_option(global_config, comic_name, 'updated'),
+        failures=_get_int_option(global_config, comic_name, 'failures', 0),
+        last_error=_get_option(global_config, comic_name, 'last_error'),
+        retry_at=_get_int_option(global_config, comic_name, 'retry_at'),
+        no_next_since=_get_int_option(global_config, comic_name, 'no_next_since'),
+        no_next_count=_get_int_option(global_config, comic_name, 'no_next_count', 0),
+    )
+
+
+def _get_option(global_config, section, option, default=None):
+    # ConfigParser(defaults=...) only takes strings on python 3, and fallback= doesn't exist on python 2
+    if global_config.has_option(section, option):
+        return global_config.get(section, option)
+    return default
+
+
+def _get_int_option(global_config, section, option, default=None):
+    value = _get_option(global_config, section, option)
+    return default if value is None else int(value)
 
 
 def get_global_config(allow_missing_file=False):
     filename = CONF_FILENAME
     if allow_missing_file and not os.path.isfile(filename):
         return ConfigParser()
-    with _locked_config_file() as f:
+    with _locked_config_file(shared=True) as f:
         global_config = ConfigParser()
         global_config.read_file(f)
     return global_config
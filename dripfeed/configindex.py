@@ -0,0 +1,126 @@
+"""
+An index of the sections of the INI config file, so that reading one comic doesn't mean parsing every comic: the index
+maps each comic name to the byte range of its section, and only that range is parsed. The index is a small SQLite
+database in the state directory. It records the size, modification time and inode of the config file it was built
+from, and when any of those change the next lookup rebuilds it, with a single scan for section headers. (dripfeed's own
+writes replace the config file, so they always change its inode; hand edits change its size or modification time.)
+
+Every lookup falls back to parsing the whole config file if the index can't be used: if it can't be written, or if the
+config file has a [DEFAULT] section (whose options apply to every section).
+"""
+from __future__ import unicode_literals
+import contextlib
+import io
+import locale
+from logging import getLogger
+import os
+import sqlite3
+from six import StringIO
+from .comics import ensure_directory
+from .twothree import ConfigParser
+
+__author__ = 'tikitu'
+
+
+logger = getLogger('dripfeed')
+
+BUSY_TIMEOUT = 60
+
+# The config file is read and written as a text file, in the locale's encoding
+_ENCODING = locale.getpreferredencoding(False) or 'utf-8'
+
+
+class UnindexableConfigError(Exception):
+    pass
+
+
+class ConfigIndex(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+    def section_config(self, f, comic_name):
+        """
+        A ConfigParser holding the section `comic_name` of the config file open as `f` (which the caller must hold a
+        lock on), or no sections at all if there's no such comic.
+        """
+        try:
+            text = self._section(f, comic_name)
+        except (UnindexableConfigError, sqlite3.Error, IOError, OSError) as exception:
+            logger.debug('Not using config index {0}: {1}'.format(self.filename, exception))
+            f.seek(0)
+            global_config = ConfigParser()
+            global_config.read_file(f)
+            return global_config
+        global_config = ConfigParser()
+        if text is not None:
+            global_config.read_file(StringIO(text))
+        return global_config
+
+    @contextlib.contextmanager
+    def _connection(self):
+        ensure_directory(os.path.dirname(self.filename))
+        connection = sqlite3.connect(self.filename, timeout=BUSY_TIMEOUT, isolation_level=None)
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS stamp (config TEXT NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS sections '
+                               '(name TEXT PRIMARY KEY, start INTEGER NOT NULL, length INTEGER NOT NULL)')
+            yield connection
+        finally:
+            connection.close()
+
+    def _section(self, f, comic_name):
+        stamp = _stamp(os.fstat(f.fileno()))
+        with self._connection() as connection:
+            row = connection.execute('SELECT config FROM stamp').fetchone()
+            if row is None or row[0] != stamp:
+                self._rebuild(connection, f, stamp)
+            row = connection.execute('SELECT start, length FROM sections WHERE name = ?', (comic_name,)).fetchone()
+        if row is None:
+            return None
+        start, length = row
+        with io.open(f.fileno(), 'rb', closefd=False) as binary:
+            binary.seek(start)
+            return binary.read(length).decode(_ENCODING)
+
+    def _rebuild(self, connection, f, stamp):
+        with io.open(f.fileno(), 'rb', closefd=False) as binary:
+            binary.seek(0)
+            sections = _scan_sections(binary)
+        logger.debug('Rebuilding config index {0} ({1} comics)'.format(self.filename, len(sections)))
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM stamp')
+            connection.execute('DELETE FROM sections')
+            connection.executemany('INSERT OR REPLACE INTO sections (name, start, length) VALUES (?, ?, ?)', sections)
+            connection.execute('INSERT INTO stamp (config) VALUES (?)', (stamp,))
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+
+def _stamp(stat):
+    return '{0} {1} {2}'.format(stat.st_size, getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_ino)
+
+
+def _scan_sections(binary):
+    """
+    [(name, start, length)] of each section in the config file: from the start of its header line to the start of the
+    next header line (or the end of the file), in bytes.
+    """
+    sections = []
+    name = None
+    start = offset = 0
+    for line in binary:
+        if line.startswith(b'['):
+            match = ConfigParser.SECTCRE.match(line.decode(_ENCODING).rstrip())
+            if match is not None:
+                if name is not None:
+                    sections.append((name, start, offset - start))
+                name, start = match.group('header'), offset
+                if name == 'DEFAULT':
+                    raise UnindexableConfigError('the [DEFAULT] section applies to every comic')
+        offset += len(line)
+    if name is not None:
+        sections.append((name, start, offset - start))
+    return sections
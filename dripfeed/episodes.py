@@ -0,0 +1,181 @@
+"""
+A per-comic index of every episode seen so far, by number: filled in as updates (and crawl) discover episodes, so
+that `dripfeed seek` can move a comic back (or forward, as far as it's been crawled) to any known episode without
+fetching anything, updates after seeking back walk the index instead of the network, and `dripfeed info` can show how
+many known episodes are still to come.
+
+The index starts at whichever episode the comic was at when it was first recorded (a comic that was already at
+episode 30 gets an index of episodes 30 onwards), kept in <name>.first. Then two append-only files: <name>.urls holds
+the urls, one per line, and <name>.ends holds, for the n-th url, its end offset in <name>.urls as an 8-byte
+little-endian integer at offset 8 * (n - 1). Looking up an episode reads two integers from the memory-mapped .ends file
+and then the url itself, however long the archive is.
+Appending writes the url before its end offset, so a reader never sees an offset pointing past the urls written; a
+crash in between leaves only unreferenced bytes, which the next append writes over. If an episode's url turns out to
+have changed (the archive was reorganised), the index is truncated there and grows again from the new url; if the comic
+jumps beyond the end of the index (say, its progress was imported), the index starts over from there.
+
+Losing the index costs nothing but refetches, so it isn't synced to disk on every append.
+"""
+from __future__ import unicode_literals
+import contextlib
+import mmap
+import os
+import struct
+from .comics import comic_lock, comic_state_path, ensure_directory, get_comic, put_progress, write_atomically, Progress
+
+__author__ = 'tikitu'
+
+
+_END = struct.Struct('<Q')
+
+
+class EpisodeIndex(object):
+    def __init__(self, comic_name):
+        base = comic_state_path('episodes', comic_name)
+        self.urls_filename = base + '.urls'
+        self.ends_filename = base + '.ends'
+        self.first_filename = base + '.first'
+
+    def __len__(self):
+        """
+        The number of episodes in the index (numbered `first` up to `last`).
+        """
+        try:
+            return os.path.getsize(self.ends_filename) // _END.size
+        except OSError:
+            return 0
+
+    @property
+    def first(self):
+        """
+        The number of the first episode in the index.
+        """
+        try:
+            with open(self.first_filename) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            return 1
+
+    @property
+    def last(self):
+        """
+        The number of the last episode in the index (`first` - 1 if it's empty).
+        """
+        return self.first + len(self) - 1
+
+    def url(self, episode):
+        """
+        The url of `episode` (counting from 1), or None if it isn't in the index.
+        """
+        position = episode - self.first + 1  # in the index, counting from 1
+        if position < 1:
+            return None
+        with self._mapped(self.ends_filename) as ends:
+            if ends is None or len(ends) < position * _END.size:
+                return None
+            end = _END.unpack_from(ends, (position - 1) * _END.size)[0]
+            start = _END.unpack_from(ends, (position - 2) * _END.size)[0] if position > 1 else 0
+        with open(self.urls_filename, 'rb') as f:
+            f.seek(start)
+            line = f.read(end - start)
+        if len(line) != end - start or not line.endswith(b'\n'):
+            return None  # the end offset reached the disk, but the url didn't
+        return line[:-1].decode('utf-8')
+
+    def record(self, episode, url):
+        """
+        Note that `url` is episode number `episode`. Call this while holding comic_lock(). The first episode recorded
+        starts the index; after that, recording an episode beyond the end of the index (leaving a gap) starts it over
+        from there, and episodes before its start aren't recorded.
+        """
+        first = self.first
+        count = len(self)
+        if episode < first and count:
+            return
+        if first <= episode < first + count:
+            if self.url(episode) == url:
+                return
+            count = episode - first
+            self._truncate(count)
+        if not count or episode != first + count:
+            ensure_directory(os.path.dirname(self.urls_filename))
+            self._truncate(0)  # before moving the start, so that readers never see urls under the wrong numbers
+            count = 0
+            write_atomically(self.first_filename, '{0}\n'.format(episode))
+        start = self._end(count)
+        line = url.encode('utf-8') + b'\n'
+        with open(self.urls_filename, 'ab') as f:
+            f.truncate(start)  # anything after the last recorded url was left by a crash
+            f.write(line)
+        with open(self.ends_filename, 'ab') as f:
+            f.truncate(count * _END.size)  # likewise
+            f.write(_END.pack(start + len(line)))
+
+    def record_chain(self, episode, urls):
+        """
+        Note that `urls` are episodes `episode`, `episode` + 1, ...
+        """
+        for number, url in enumerate(urls, episode):
+            self.record(number, url)
+
+    def following(self, episode, url):
+        """
+        The url of the episode after `episode`, if the index has it and `url` is where the index has `episode`, else
+        None.
+        """
+        if self.url(episode) != url:
+            return None
+        return self.url(episode + 1)
+
+    def _end(self, count):
+        if count == 0:
+            return 0
+        with self._mapped(self.ends_filename) as ends:
+            return _END.unpack_from(ends, (count - 1) * _END.size)[0]
+
+    def _truncate(self, count):
+        end = self._end(count)
+        with open(self.ends_filename, 'ab') as f:
+            f.truncate(count * _END.size)
+        with open(self.urls_filename, 'ab') as f:
+            f.truncate(end)
+
+    @contextlib.contextmanager
+    def _mapped(self, filename):
+        try:
+            f = open(filename, 'rb')
+        except IOError:
+            yield None
+            return
+        try:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield None  # can't map an empty file
+                return
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+        finally:
+            f.close()
+
+
+def seek(comic_name, episode):
+    """
+    Move the comic to `episode` (its first episode, or one in its index), without fetching anything or adding to its
+    feed: its next update adds episode `episode` + 1. Returns the comic.
+    """
+    with comic_lock(comic_name):
+        comic = get_comic(comic_name)
+        index = EpisodeIndex(comic_name)
+        url = comic.start_url if episode == 1 else index.url(episode)
+        if url is None:
+            raise ValueError('{0}: episode {1} is not known (the index has episodes {2} to {3}; crawl or update to '
+                             'find more)'.format(comic_name, episode, index.first, index.last))
+        if comic.progress is None:
+            comic.progress = Progress()
+        comic.progress.episode = episode
+        comic.progress.next_url = url
+        comic.progress.record_episode()
+        put_progress(comic)
+    return comic
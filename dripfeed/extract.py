@@ -0,0 +1,251 @@
+"""
+Extracting the "next" link from a fetched comic page.
+
+The link can be selected with an XPath expression (the default), a CSS selector (needs the optional cssselect package;
+it is translated to XPath once), or a regular expression over the raw page text. The regex engine never builds a DOM,
+which makes it by far the cheapest for simple patterns like <a rel="next" href="...">. Selectors are compiled once per
+process and shared, since the same expression is used for every page of a comic.
+
+By default the whole page is downloaded and parsed before selecting. In streaming mode the response is read in chunks
+and fed to an incremental parser (or scanned by the regex); for selectors whose matches can't be undone by later
+content, we stop reading soon after there is a match, so the rest of the page (comments, scripts, ...) is never
+downloaded or parsed.
+"""
+from __future__ import unicode_literals
+import codecs
+import re
+import lxml.etree
+import lxml.html
+import six
+from .timing import add_bytes, timed
+from .twothree import html_unescape
+
+__author__ = 'tikitu'
+
+
+CHUNK_SIZE = 16 * 1024
+
+# Functions and axes that can make a match in a partial document disappear (or change which match comes first) once
+# more of the document has been parsed.
+_NON_INCREMENTAL = re.compile(r'last\s*\(|count\s*\(|not\s*\(|position\s*\(|following|string\s*\(|normalize-space|'
+                              r'string-length|sum\s*\(|=\s*\.|\.\s*=|text\s*\(\s*\)\s*[!<>=]')
+
+
+class ResponseTooLargeError(Exception):
+    def __init__(self, url=None, max_body_size=None):
+        super(ResponseTooLargeError, self).__init__(
+            'Response from {0} is larger than the maximum of {1} bytes'.format(url, max_body_size))
+        self.url = url
+        self.max_body_size = max_body_size
+
+
+def is_incremental_xpath(xpath):
+    """
+    Whether the first match of `xpath` in a partially parsed document is guaranteed to still be the first match in the
+    complete document. Every element's start tag (with its attributes) has been seen when it's in the tree, so that
+    holds unless the expression counts, negates, or compares text content that might still be growing.
+    """
+    return not _NON_INCREMENTAL.search(xpath)
+
+
+class XPathSelector(object):
+    kind = 'xpath'
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.xpath = expression
+        self._compiled = lxml.etree.XPath(expression)
+        self.incremental = is_incremental_xpath(expression)
+
+    @property
+    def key(self):
+        # Plain XPath expressions are their own key, as they were before there were other kinds of selector
+        return self.expression if self.kind == 'xpath' else '{0}:{1}'.format(self.kind, self.expression)
+
+    def find_href(self, page, stream=False, max_body_size=None):
+        """
+        Return the href of the first element of `page` (a requests response) that matches, or None.
+        """
+        if stream:
+            with timed('parse'):  # downloading, parsing and selecting, interleaved
+                return self._find_href_streaming(page, max_body_size)
+        content = _check_size(page, max_body_size)
+        with timed('parse'):
+            root = lxml.html.fromstring(content)
+        with timed('select'):
+            return self.find_href_in_tree(root)
+
+    def find_href_in_tree(self, root):
+        elems = self._compiled(root)
+        if not elems:
+            return None
+        return elems[0].attrib['href']
+
+    def find_all_hrefs(self, page, max_body_size=None):
+        """
+        Every link in `page` that matches, in document order: the href of a matching element, or its text if it has no
+        href (like the <loc> elements of a sitemap), or a matching string (for expressions like //a/@href).
+        """
+        content = _check_size(page, max_body_size)
+        with timed('parse'):
+            root = lxml.html.fromstring(content)
+        with timed('select'):
+            hrefs = []
+            for match in self._compiled(root):
+                if isinstance(match, six.string_types):
+                    href = match
+                elif match.get('href') is not None:
+                    href = match.get('href')
+                else:
+                    href = ''.join(match.itertext())
+                if href.strip():
+                    hrefs.append(href.strip())
+            return hrefs
+
+    def _find_href_streaming(self, page, max_body_size):
+        parser = lxml.etree.HTMLPullParser(events=('start',))
+        root = None
+        size = checked_size = 0
+        try:
+            for chunk in _iter_limited(page, max_body_size):
+                parser.feed(chunk)
+                size += len(chunk)
+                new_elements = False
+                for _, element in parser.read_events():
+                    new_elements = True
+                    if root is None:
+                        root = element.getroottree().getroot()
+                # Each check runs over the whole tree so far, so checking after every chunk would cost time quadratic
+                # in the size of the page. Checking again only once the tree has doubled keeps the total linear, at the
+                # price of reading at most twice as far as needed.
+                if self.incremental and new_elements and size >= 2 * checked_size:
+                    href = self.find_href_in_tree(root)
+                    if href is not None:
+                        return href
+                    checked_size = size
+            root = parser.close()
+            return None if root is None else self.find_href_in_tree(root)
+        finally:
+            page.close()  # without reading the rest, if we stopped early
+
+
+class CssSelector(XPathSelector):
+    kind = 'css'
+
+    def __init__(self, expression):
+        try:
+            from cssselect import HTMLTranslator
+        except ImportError:
+            raise ValueError('CSS selectors need the cssselect package (pip install cssselect)')
+        xpath = HTMLTranslator().css_to_xpath(expression)
+        super(CssSelector, self).__init__(xpath)
+        self.expression = expression
+
+
+class RegexSelector(object):
+    """
+    The href is the first group of the pattern if it has one, otherwise the whole match; HTML entities like &amp; are
+    unescaped. For example: <a[^>]*rel="next"[^>]*href="([^"]*)"
+    """
+    kind = 'regex'
+
+    def __init__(self, expression):
+        self.expression = expression
+        self._compiled = re.compile(expression)
+
+    @property
+    def key(self):
+        return '{0}:{1}'.format(self.kind, self.expression)
+
+    def find_href(self, page, stream=False, max_body_size=None):
+        if stream:
+            with timed('parse'):
+                return self._find_href_streaming(page, max_body_size)
+        content = _check_size(page, max_body_size)
+        with timed('select'):
+            if isinstance(content, bytes):
+                content = content.decode(_encoding(page), 'replace')
+            return self._href(self._compiled.search(content))
+
+    def _find_href_streaming(self, page, max_body_size):
+        decoder = codecs.getincrementaldecoder(_encoding(page))('replace')
+        text = ''
+        try:
+            for chunk in _iter_limited(page, max_body_size):
+                searched = len(text)
+                text += decoder.decode(chunk)
+                # A match may straddle the previous chunk boundary, but it can't start too far back; and a match that
+                # runs up to the end of what we have may still grow with the next chunk.
+                match = self._compiled.search(text, max(0, searched - CHUNK_SIZE))
+                if match is not None and match.end() < len(text):
+                    return self._href(match)
+            text += decoder.decode(b'', True)
+            return self._href(self._compiled.search(text))
+        finally:
+            page.close()
+
+    def _href(self, match):
+        if match is None:
+            return None
+        href = match.group(1) if self._compiled.groups else match.group(0)
+        return html_unescape(href)
+
+
+SELECTOR_TYPES = dict((cls.kind, cls) for cls in (XPathSelector, CssSelector, RegexSelector))
+
+_selectors = {}
+
+
+def get_selector(expression, kind='xpath'):
+    """
+    The compiled selector for `expression`, shared by the whole process.
+    """
+    key = (kind, expression)
+    selector = _selectors.get(key)
+    if selector is None:
+        selector = _selectors[key] = SELECTOR_TYPES[kind](expression)
+    return selector
+
+
+def find_next_href(page, xpath, stream=False, max_body_size=None):
+    """
+    Return the href of the first element of `page` (a requests response) that matches `xpath`, or None.
+    """
+    return get_selector(xpath).find_href(page, stream=stream, max_body_size=max_body_size)
+
+
+def _check_size(page, max_body_size):
+    """
+    The body of `page`. With a `max_body_size`, `page` should have been fetched with stream=True: the body is then read
+    in chunks, and reading stops as soon as it's too large, so the limit bounds the download as well as memory.
+    """
+    if max_body_size is None:
+        return page.content
+    with timed('download'):
+        try:
+            # The whole body would be read, so a Content-Length that's too large can be refused without reading any of
+            # it (when streaming, the link may well come before the limit: only the bytes actually read count)
+            length = page.headers.get('Content-Length')
+            if isinstance(length, six.string_types) and length.isdigit() and int(length) > max_body_size:
+                raise ResponseTooLargeError(url=page.url, max_body_size=max_body_size)
+            return b''.join(_iter_limited(page, max_body_size))
+        finally:
+            page.close()
+
+
+def _iter_limited(page, max_body_size):
+    size = 0
+    for chunk in page.iter_content(CHUNK_SIZE):
+        size += len(chunk)
+        add_bytes(len(chunk))
+        if max_body_size is not None and size > max_body_size:
+            raise ResponseTooLargeError(url=page.url, max_body_size=max_body_size)
+        yield chunk
+
+
+def _encoding(page):
+    encoding = getattr(page, 'encoding', None)
+    try:
+        return codecs.lookup(encoding).name
+    except (TypeError, LookupError):
+        return 'utf-8'
@@ -0,0 +1,235 @@
+"""
+`dripfeed serve`: a small HTTP server for the feeds themselves, so that feed readers can poll them without a separate
+web server. Every configured comic's feed is served at /<comic-name>.rss.
+
+Each feed is kept in memory and only read again when its file changes: a request costs one stat() of the feed (feeds
+are replaced as a whole, see write_atomically(), so a new size, mtime or inode means new content). Responses carry an
+ETag and Last-Modified, so the usual poll from a reader that already has the feed is answered with 304 Not Modified
+and no body; readers that accept gzip get the feed compressed, once per change of the feed rather than per request.
+
+The comics are reloaded when the comic store changes (checked every few seconds) or on SIGHUP, like serve-schedule.
+"""
+from __future__ import unicode_literals
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from logging import getLogger
+import os
+import threading
+import time
+import zlib
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import unquote
+from .comics import get_configured_comics
+from .schedule import POLL_INTERVAL, _store_stamp
+
+__author__ = 'tikitu'
+
+
+logger = getLogger('dripfeed')
+
+DEFAULT_BIND = '127.0.0.1'
+DEFAULT_PORT = 8080
+CONTENT_TYPE = 'application/rss+xml'
+
+
+class CachedFeed(object):
+    """
+    The content of a feed file as of one stat() of it.
+    """
+
+    __slots__ = ('stamp', 'body', 'etag', 'mtime', 'last_modified', '_gzipped')
+
+    def __init__(self, stamp, body, mtime):
+        self.stamp = stamp
+        self.body = body
+        self.etag = '"{0:x}-{1:x}-{2:x}"'.format(*stamp)
+        self.mtime = int(mtime)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self._gzipped = None
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:  # (two threads might both compress it: no harm done)
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._gzipped = compressor.compress(self.body) + compressor.flush()
+        return self._gzipped
+
+    def not_modified(self, if_none_match, if_modified_since):
+        """
+        Whether a client sending these request headers (either may be None) already has this version of the feed.
+        """
+        if if_none_match is not None:  # takes precedence over If-Modified-Since
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or any(_strong(tag) in (self.etag, _gzip_etag(self.etag)) for tag in tags)
+        if if_modified_since is not None:
+            parsed = parsedate_tz(if_modified_since)
+            return parsed is not None and mktime_tz(parsed) >= self.mtime
+        return False
+
+
+class FeedCache(object):
+    def __init__(self):
+        self._feeds = {}  # rss_file: CachedFeed
+
+    def get(self, rss_file):
+        """
+        The CachedFeed of `rss_file`, reading it only if it changed since it was last read. Raises IOError or OSError
+        if it can't be read.
+        """
+        stat = os.stat(rss_file)
+        stamp = (stat.st_size, getattr(stat, 'st_mtime_ns', int(stat.st_mtime * 1e9)), stat.st_ino)
+        feed = self._feeds.get(rss_file)
+        if feed is None or feed.stamp != stamp:
+            with open(rss_file, 'rb') as f:
+                body = f.read()
+            feed = self._feeds[rss_file] = CachedFeed(stamp, body, stat.st_mtime)
+            logger.debug('Read {0} ({1} bytes)'.format(rss_file, len(body)))
+        return feed
+
+    def retain(self, rss_files):
+        """
+        Forget the feeds that aren't in `rss_files`.
+        """
+        for rss_file in set(self._feeds) - set(rss_files):
+            self._feeds.pop(rss_file, None)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive: pollers reuse their connection
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+    server_version = 'dripfeed'
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body):
+        rss_file = self.server.rss_file(self.path)
+        if rss_file is None:
+            self.send_error(404)
+            return
+        try:
+            feed = self.server.cache.get(rss_file)
+        except (IOError, OSError) as exception:
+            logger.error('Serving {0}: {1}'.format(rss_file, exception))
+            self.send_error(404)
+            return
+        gzip = _accepts_gzip(self.headers.get('Accept-Encoding'))
+        etag = _gzip_etag(feed.etag) if gzip else feed.etag
+        if feed.not_modified(self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')):
+            self.send_response(304)
+            self._send_validators(etag, feed)
+            self.end_headers()
+            return
+        body = feed.gzipped if gzip else feed.body
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        if gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self._send_validators(etag, feed)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_validators(self, etag, feed):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', feed.last_modified)
+        self.send_header('Vary', 'Accept-Encoding')
+
+    def log_message(self, format, *args):
+        logger.debug('{0} {1}'.format(self.address_string(), format % args))
+
+
+class FeedServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, bind=DEFAULT_BIND, port=DEFAULT_PORT, poll_interval=POLL_INTERVAL):
+        BaseHTTPServer.HTTPServer.__init__(self, (bind, port), _Handler)
+        self.cache = FeedCache()
+        self.poll_interval = poll_interval
+        self._rss_files = {}  # path: rss_file
+        self._reload_lock = threading.Lock()
+        self._reload_requested = True
+        self._checked_at = None
+        self._store_stamp = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def rss_file(self, path):
+        """
+        The feed file served at `path`, or None.
+        """
+        self._maybe_reload()
+        return self._rss_files.get(unquote(path.split('?', 1)[0]))
+
+    def _maybe_reload(self):
+        now = time.time()
+        if not self._reload_requested and now - self._checked_at < self.poll_interval:
+            return
+        with self._reload_lock:
+            if not self._reload_requested and now - self._checked_at < self.poll_interval:
+                return  # another thread got here first
+            stamp = _store_stamp()
+            if self._reload_requested or stamp != self._store_stamp:
+                self._reload_requested = False
+                self._store_stamp = stamp
+                self.reload()
+            self._checked_at = now
+
+    def reload(self):
+        comics = get_configured_comics(allow_missing_file=True)
+        self._rss_files = dict(('/{0}.rss'.format(comic.name), comic.rss_file) for comic in comics)
+        self.cache.retain(self._rss_files.values())
+        logger.info('Serving {0} feeds on port {1}'.format(len(comics), self.port))
+
+    def request_reload(self):
+        self._reload_requested = True
+
+    def stop(self):
+        # shutdown() waits for serve_forever() to return, so it can't be called from the thread running it (which is
+        # where signal handlers run)
+        stopper = threading.Thread(target=self.shutdown)
+        stopper.daemon = True
+        stopper.start()
+
+    def run(self):
+        self._maybe_reload()
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+
+
+def _accepts_gzip(accept_encoding):
+    """
+    Whether an Accept-Encoding header allows gzip (a q-value of 0 refuses it).
+    """
+    qualities = {}
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qualities:
+            return qualities[name] > 0
+    return False
+
+
+def _gzip_etag(etag):
+    # The gzipped feed is a different representation, so it needs a different ETag
+    return etag[:-1] + '-gzip"'
+
+
+def _strong(tag):
+    return tag[2:] if tag.startswith('W/') else tag
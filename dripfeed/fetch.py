@@ -0,0 +1,261 @@
+"""
+HTTP fetching for comic pages. All fetches go through a Fetcher, which keeps one pooled keep-alive requests.Session per
+host (so a batch update or a multi-episode run opens one connection per host, not one per page), caps the number of
+concurrent requests to each host, and applies a default timeout. A request fetched with stream=True downloads its body
+as it's read, so it counts against its host's cap until the response is closed: callers must close() it.
+
+To stay polite (and not get throttled or banned), the Fetcher can also limit the rate of requests to each host with a
+token bucket: bursts of up to `burst` requests, and `rate` requests per second on average. A 429 or 503 response blocks
+the host for its Retry-After (or DEFAULT_BACKOFF seconds): fetches from a blocked host wait if the block ends within
+`max_wait` seconds, and otherwise fail straight away with a ThrottledError, without sending anything.
+"""
+from __future__ import unicode_literals
+from email.utils import parsedate_tz, mktime_tz
+import threading
+import time
+import six
+from .timing import add_time, record_response
+from .twothree import urlsplit
+
+__author__ = 'tikitu'
+
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_PER_HOST = 4
+DEFAULT_TIMEOUT = 30
+DEFAULT_BURST = 5
+DEFAULT_MAX_WAIT = 30
+DEFAULT_BACKOFF = 60
+THROTTLED_STATUSES = (429, 503)
+
+
+class ThrottledError(Exception):
+    def __init__(self, url=None, retry_after=None):
+        super(ThrottledError, self).__init__(
+            'Throttled by the server of {0}: not fetching for another {1:.0f} seconds'.format(url, retry_after or 0))
+        self.url = url
+        self.retry_after = retry_after
+
+
+class Fetcher(object):
+    """
+    @arg pool_size: number of keep-alive connections kept open per host
+    @arg per_host: maximum number of concurrent requests to a single host
+    @arg timeout: seconds to wait for connecting or reading, unless overridden per request
+    @arg rate: average number of requests per second to a single host (None for no limit)
+    @arg burst: number of requests to a single host that may go out at once, before the rate applies
+    @arg host_rates: {hostname: rate} for hosts that should get a rate other than `rate`
+    @arg max_wait: seconds a fetch may wait for a throttled host (beyond that it fails with a ThrottledError)
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, per_host=DEFAULT_PER_HOST, timeout=DEFAULT_TIMEOUT, rate=None,
+                 burst=DEFAULT_BURST, host_rates=None, max_wait=DEFAULT_MAX_WAIT):
+        self.pool_size = pool_size
+        self.per_host = per_host
+        self.timeout = timeout
+        self.rate = rate
+        self.burst = burst
+        self.host_rates = dict((hostname.lower(), rate) for hostname, rate in (host_rates or {}).items())
+        self.max_wait = max_wait
+        self._hosts = {}
+        self._limits = {}  # hostname -> _HostLimit, shared by http and https (and any port)
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        host = self._host(url)
+        kwargs.setdefault('timeout', self.timeout)
+        stream = kwargs.get('stream', False)
+        for attempt in (1, 2):
+            waited = host.limit.wait(url, self.max_wait)
+            if waited:
+                add_time('throttle', waited)
+            host.slots.acquire()
+            start = time.time()
+            try:
+                response = host.session.get(url, **kwargs)
+            except Exception:
+                host.slots.release()
+                add_time('request', time.time() - start)  # connection errors and timeouts count too
+                raise
+            if stream:
+                _release_on_close(response, host.slots.release)  # the body is still to be downloaded
+            else:
+                host.slots.release()
+            record_response(response, time.time() - start, streamed=stream)
+            if response.status_code not in THROTTLED_STATUSES:
+                return response
+            host.limit.block(retry_after(response))
+            response.close()  # (returning a streamed response's connection to the pool)
+        raise ThrottledError(url=url, retry_after=host.limit.blocked_until - time.time())
+
+    def _host(self, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc.lower())
+        with self._lock:
+            host = self._hosts.get(key)
+            if host is None:
+                hostname = url_hostname(url)
+                limit = self._limits.get(hostname)
+                if limit is None:
+                    rate = self.host_rates.get(hostname, self.rate)
+                    limit = self._limits[hostname] = _HostLimit(rate=rate, burst=self.burst)
+                host = self._hosts[key] = _Host(pool_size=self.pool_size, per_host=self.per_host, limit=limit)
+            return host
+
+    def close(self):
+        with self._lock:
+            hosts, self._hosts = self._hosts, {}
+        for host in hosts.values():
+            host.session.close()
+
+
+class _Host(object):
+    def __init__(self, pool_size, per_host, limit):
+        import requests  # not at module level: commands that never fetch shouldn't pay for importing it
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, per_host))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.slots = threading.BoundedSemaphore(per_host)
+        self.limit = limit
+
+
+def _release_on_close(response, release):
+    """
+    Call `release` when `response` is first closed.
+    """
+    close = response.close
+    released = []
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released:
+                released.append(True)
+                release()
+    response.close = close_and_release
+
+
+class TokenBucket(object):
+    """
+    Holds up to `burst` tokens, refilled at `rate` per second. Callers reserve a token and wait until it's theirs, so
+    waiting callers are served in order.
+    """
+
+    def __init__(self, rate, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token, and return the number of seconds until it can be used.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0, -self._tokens / self.rate)
+
+
+class _HostLimit(object):
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.blocked_until = 0
+
+    def wait(self, url, max_wait):
+        """
+        Wait until a request to this host may go out; returns the number of seconds waited.
+        """
+        blocked = self.blocked_until - time.time()
+        if blocked > max_wait:
+            raise ThrottledError(url=url, retry_after=blocked)
+        waited = max(0, blocked)
+        if self.bucket is not None:
+            waited = max(waited, self.bucket.reserve())
+        if waited:
+            time.sleep(waited)
+        return waited
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+
+def retry_after(response, default=DEFAULT_BACKOFF):
+    """
+    Seconds to wait according to the Retry-After header of `response` (either a number of seconds or an HTTP date).
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return default
+    try:
+        return max(0, float(value))
+    except (TypeError, ValueError):
+        pass
+    date = parsedate_tz(value)
+    if date is None:
+        return default
+    return max(0, mktime_tz(date) - time.time())
+
+
+def response_header(response, name):
+    """
+    The value of header `name` of `response`, or None (also when it isn't a string, as with some mocked responses).
+    """
+    value = response.headers.get(name)
+    return value if isinstance(value, six.string_types) else None
+
+
+def url_hostname(url):
+    return (urlsplit(url).hostname or '').lower()
+
+
+def interleave_hosts(items, url_of):
+    """
+    Reorder `items` round-robin by the host of `url_of(item)` (keeping their order within each host), so that working
+    through them in order spreads the load over the hosts instead of queueing on one host's rate limit at a time.
+    """
+    by_host = {}
+    hosts = []
+    for item in items:
+        hostname = url_hostname(url_of(item))
+        if hostname not in by_host:
+            by_host[hostname] = []
+            hosts.append(hostname)
+        by_host[hostname].append(item)
+    interleaved = []
+    for i in range(max(len(queue) for queue in by_host.values()) if by_host else 0):
+        interleaved.extend(by_host[hostname][i] for hostname in hosts if i < len(by_host[hostname]))
+    return interleaved
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher():
+    """
+    The process-wide Fetcher: everything that fetches pages should use this, so connections are shared.
+    """
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = Fetcher()
+        return _fetcher
+
+
+def configure_fetcher(**kwargs):
+    """
+    Replace the process-wide Fetcher with one built from `kwargs` (see Fetcher), closing the old one's connections.
+    """
+    global _fetcher
+    with _fetcher_lock:
+        old, _fetcher = _fetcher, Fetcher(**kwargs)
+    if old is not None:
+        old.close()
+    return _fetcher
@@ -0,0 +1,213 @@
+"""
+Coordination between `dripfeed work` processes, on any number of machines sharing the directory of the comic store,
+through files only: there's no coordinator to run, and no locking that a network filesystem might not support.
+
+Each worker (a "node") announces itself with a heartbeat file under state_path('nodes'), renewed every few seconds.
+Comics are sharded over the live nodes by rendezvous hashing (see owner()): each comic belongs to the node for which
+a hash of (node, comic name) is highest, so every node gets about the same share, and when a node joins or leaves only
+its own share moves.
+
+Before updating a comic a node also takes out a lease on it, under state_path('leases', <comic name>): shard views can
+briefly disagree while nodes join and leave, and the lease makes sure even then only one node updates a comic at a
+time. Leases expire unless they are renewed, so the comics of a node that died are taken over once its lease and its
+heartbeat run out. Expiry times are wall-clock times, so the nodes' clocks should agree to within a small fraction of
+the lease duration.
+
+A lease is a file named by its generation number: claiming a comic means creating the next generation, which only one
+node can do (files are published with os.link(), which never replaces an existing file), and only once the current
+generation has expired or been released. Renewing and releasing rewrite the holder's own generation in place.
+"""
+from __future__ import unicode_literals
+import hashlib
+import json
+from logging import getLogger
+import os
+import socket
+import tempfile
+import time
+from .comics import state_path, comic_state_path, ensure_directory, write_atomically
+from .twothree import quote
+
+__author__ = 'tikitu'
+
+
+logger = getLogger('dripfeed')
+
+DEFAULT_LEASE_DURATION = 5 * 60
+
+
+def default_node():
+    return '{0}-{1}'.format(socket.gethostname(), os.getpid())
+
+
+def owner(comic_name, nodes):
+    """
+    The node (of the non-empty collection `nodes`) whose shard `comic_name` is in.
+    """
+    return max(nodes, key=lambda node: (hashlib.md5('{0}\0{1}'.format(node, comic_name).encode('utf-8')).digest(),
+                                         node))
+
+
+class Lease(object):
+    def __init__(self, leases, comic_name, generation):
+        self.leases = leases
+        self.comic_name = comic_name
+        self.generation = generation
+
+    @property
+    def filename(self):
+        return os.path.join(self.leases.directory(self.comic_name), str(self.generation))
+
+    def held(self):
+        """
+        Whether this is still the current lease: false once someone else took the comic over (after it expired).
+        """
+        return self.leases.current_generation(self.comic_name) == self.generation
+
+    def renew(self):
+        """
+        Extend the lease by its full duration. Returns False (and doesn't renew) if it's no longer held.
+        """
+        if not self.held():
+            return False
+        write_atomically(self.filename, _lease_content(self.leases.node, time.time() + self.leases.duration))
+        return True
+
+    def release(self):
+        if self.held():
+            write_atomically(self.filename, _lease_content(self.leases.node, 0))
+
+
+class Leases(object):
+    """
+    @arg node: this node's name, unique among the nodes sharing the store
+    @arg duration: seconds a lease lasts unless it's renewed
+    """
+
+    def __init__(self, node, duration=DEFAULT_LEASE_DURATION):
+        self.node = node
+        self.duration = duration
+
+    def directory(self, comic_name):
+        return comic_state_path('leases', comic_name)
+
+    def generations(self, comic_name):
+        try:
+            return sorted(int(name) for name in os.listdir(self.directory(comic_name)) if name.isdigit())
+        except OSError:  # never leased
+            return []
+
+    def current_generation(self, comic_name):
+        generations = self.generations(comic_name)
+        return generations[-1] if generations else 0
+
+    def claim(self, comic_name):
+        """
+        A Lease on `comic_name`, or None if another node holds one.
+        """
+        generations = self.generations(comic_name)
+        generation = generations[-1] if generations else 0
+        if generation:
+            holder, expires = _read_lease(os.path.join(self.directory(comic_name), str(generation)))
+            if expires > time.time():
+                if holder != self.node:
+                    return None
+                logger.debug('{0}: already leased to this node'.format(comic_name))
+                return Lease(self, comic_name, generation)
+            if holder is not None and expires:
+                logger.info('{0}: taking over from {1}, whose lease expired'.format(comic_name, holder))
+        lease = Lease(self, comic_name, generation + 1)
+        if not _create_exclusively(lease.filename, _lease_content(self.node, time.time() + self.duration)):
+            return None  # another node claimed it first
+        for old in generations:
+            _remove_quietly(os.path.join(self.directory(comic_name), str(old)))
+        return lease
+
+
+class Nodes(object):
+    """
+    Heartbeat files of the nodes sharing the store.
+    """
+
+    def __init__(self, node, duration=DEFAULT_LEASE_DURATION):
+        self.node = node
+        self.duration = duration
+
+    @property
+    def directory(self):
+        return state_path('nodes')
+
+    def announce(self):
+        write_atomically(os.path.join(self.directory, quote(self.node, safe='')),
+                         _lease_content(self.node, time.time() + self.duration))
+
+    def leave(self):
+        _remove_quietly(os.path.join(self.directory, quote(self.node, safe='')))
+
+    def live(self):
+        """
+        The names of the nodes whose heartbeat hasn't expired, always including this one. Heartbeats that expired
+        long ago are cleaned up.
+        """
+        nodes = set([self.node])
+        now = time.time()
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError:
+            return nodes
+        for filename in filenames:
+            if filename.startswith('.'):
+                continue  # write_atomically()'s temporary files
+            path = os.path.join(self.directory, filename)
+            node, expires = _read_lease(path)
+            if expires > now:
+                nodes.add(node)
+            elif node is not None and expires < now - 10 * self.duration:
+                _remove_quietly(path)
+        return nodes
+
+
+def _lease_content(node, expires):
+    return json.dumps({'node': node, 'expires': expires})
+
+
+def _read_lease(filename):
+    """
+    (node, expiry time) from a lease or heartbeat file; (None, 0) if it's gone or unreadable.
+    """
+    try:
+        with open(filename, 'r') as f:
+            lease = json.load(f)
+        return lease['node'], float(lease['expires'])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None, 0
+
+
+def _create_exclusively(filename, content):
+    """
+    Create `filename` holding `content`, unless it already exists: readers never see it incomplete.
+    """
+    directory = os.path.dirname(filename)
+    ensure_directory(directory)
+    fd, temp_filename = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(temp_filename, filename)
+        except OSError:
+            if os.path.exists(filename):
+                return False
+            raise
+        return True
+    finally:
+        os.remove(temp_filename)
+
+
+def _remove_quietly(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
@@ -0,0 +1,89 @@
+"""
+Crawling ahead in a comic's archive. The archive is a linked list, so normally every update costs a network round trip
+(at cron time, to whatever host the comic is on). `dripfeed crawl <comic> --ahead N` follows the next links up to N
+episodes beyond the comic's current page, politely and at a time of your choosing, and stores the resolved chain of
+urls in a per-comic queue file. Updates then take their next url from the queue without touching the network, and only
+fetch live when the queue is used up.
+
+The queue file holds one url per line: first the url the chain starts from, then the urls following it in order. A
+queue whose first url isn't the comic's current url is stale (the comic was updated some other way) and is ignored.
+"""
+from __future__ import unicode_literals
+import io
+from logging import getLogger
+import time
+from .comics import comic_lock, comic_state_path, get_comic, get_progress, get_page_cache, write_atomically, \
+    NoMatchForXPathError
+from .episodes import EpisodeIndex
+
+__author__ = 'tikitu'
+
+
+logger = getLogger('dripfeed')
+
+DEFAULT_DELAY = 1.0
+
+
+class LookaheadQueue(object):
+    def __init__(self, comic_name):
+        self.filename = comic_state_path('lookahead', comic_name)
+
+    def read(self, current_url):
+        """
+        The queued urls following `current_url`, oldest first (empty if there are none, or the queue is stale).
+        """
+        try:
+            with io.open(self.filename, 'r', encoding='utf-8') as f:
+                urls = f.read().split()
+        except IOError:
+            return []
+        if not urls or urls[0] != current_url:
+            return []
+        return urls[1:]
+
+    def write(self, current_url, urls):
+        write_atomically(self.filename, ''.join(url + '\n' for url in [current_url] + urls))
+
+
+def crawl(comic_name, ahead, delay=DEFAULT_DELAY):
+    """
+    Make sure up to `ahead` urls beyond the comic's current url are queued, fetching (with `delay` seconds between
+    fetches) whatever isn't queued yet. The comic isn't locked while fetching, so updates can go on meanwhile.
+    Returns the number of urls queued.
+    """
+    queue = LookaheadQueue(comic_name)
+    with comic_lock(comic_name):
+        comic = get_comic(comic_name)
+        start_url = comic.current_url
+        queued = queue.read(start_url)
+    chain = [start_url] + queued
+
+    new_urls = []
+    try:
+        while len(queued) + len(new_urls) < ahead:
+            if new_urls:
+                time.sleep(delay)
+            try:
+                new_urls.append(comic._next_url((chain + new_urls)[-1]))
+            except NoMatchForXPathError:
+                logger.info('{0}: reached the end of the archive'.format(comic_name))
+                break
+    except Exception as exception:
+        logger.error('{0}: stopped crawling at {1}: {2}'.format(comic_name, (chain + new_urls)[-1], exception))
+    finally:
+        get_page_cache().flush()
+
+    with comic_lock(comic_name):
+        # Updates may have used up some of the queue (or, if it ran out, fetched beyond it) while we were crawling
+        progress = get_progress(comic_name)
+        current_url = start_url if progress is None else progress.next_url
+        full_chain = chain + new_urls
+        if current_url not in full_chain:
+            logger.warning('{0}: moved to {1} while crawling, discarding the crawled urls'.format(
+                comic_name, current_url))
+            return 0
+        urls = full_chain[full_chain.index(current_url) + 1:]
+        queue.write(current_url, urls)
+        EpisodeIndex(comic_name).record_chain(1 if progress is None else progress.episode, [current_url] + urls)
+    logger.info('{0}: {1} urls queued ({2} new)'.format(comic_name, len(urls), len(new_urls)))
+    return len(urls)
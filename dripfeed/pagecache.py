@@ -0,0 +1,123 @@
+"""
+A small on-disk cache of HTTP validators (ETag / Last-Modified) for comic pages, together with the next url that was
+extracted from each page. Re-fetching a page we've seen before sends a conditional GET; if the server answers 304 Not
+Modified we reuse the cached next url without downloading or parsing the page again. This mostly pays off when a comic
+is caught up (or erroring), since every update then re-fetches the same page.
+
+The cache file holds one JSON list per line, least recently used first, and is trimmed to a maximum size in bytes.
+"""
+from __future__ import unicode_literals
+from collections import OrderedDict
+import json
+import os
+import threading
+import portalocker
+from .fetch import response_header
+
+__author__ = 'tikitu'
+
+
+DEFAULT_MAX_BYTES = 1024 * 1024
+
+
+class CachedPage(object):
+    def __init__(self, etag=None, last_modified=None, next_url=None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.next_url = next_url
+
+    def request_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class PageCache(object):
+    """
+    Entries are keyed by (url, selector), since the same page can be read with different expressions. Lookups and
+    stores only touch memory (and are thread-safe); call flush() to merge them into the file on disk.
+    """
+
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self._entries = None
+        self._touched = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, url, selector):
+        key = (url, selector)
+        with self._lock:
+            entries = self._loaded()
+            entry = entries.get(key)
+            if entry is not None:
+                self._touched.pop(key, None)
+                self._touched[key] = entry
+            return entry
+
+    def store(self, url, selector, response, next_url):
+        """
+        Remember the validators of `response` and the next url extracted from it (None if there was no match).
+        Responses without validators can't be revalidated, so they aren't cached.
+        """
+        etag = response_header(response, 'ETag')
+        last_modified = response_header(response, 'Last-Modified')
+        if not (etag or last_modified):
+            return
+        key = (url, selector)
+        with self._lock:
+            entry = CachedPage(etag=etag, last_modified=last_modified, next_url=next_url)
+            self._loaded()[key] = entry
+            self._touched.pop(key, None)
+            self._touched[key] = entry
+
+    def flush(self):
+        with self._lock:
+            if not self._touched:
+                return
+            from .comics import ensure_directory  # (which imports this module)
+            ensure_directory(os.path.dirname(self.filename))
+            with open(self.filename, 'a+') as f:
+                portalocker.lock(f, portalocker.LOCK_EX)
+                f.seek(0)
+                entries = _read_entries(f)  # other processes may have written since we loaded
+                for key, entry in self._touched.items():
+                    entries.pop(key, None)
+                    entries[key] = entry
+                lines = [_entry_line(key, entry) for key, entry in entries.items()]
+                size = sum(len(line) + 1 for line in lines)
+                while lines and size > self.max_bytes:
+                    size -= len(lines.pop(0)) + 1
+                f.seek(0)
+                f.truncate()
+                f.write(''.join(line + '\n' for line in lines))
+            self._entries = None
+            self._touched = OrderedDict()
+
+    def _loaded(self):
+        if self._entries is None:
+            self._entries = OrderedDict()
+            if os.path.isfile(self.filename):
+                with open(self.filename, 'r') as f:
+                    portalocker.lock(f, portalocker.LOCK_SH)
+                    self._entries = _read_entries(f)
+        return self._entries
+
+
+def _entry_line(key, entry):
+    url, selector = key
+    return json.dumps([url, selector, entry.etag, entry.last_modified, entry.next_url])
+
+
+def _read_entries(f):
+    entries = OrderedDict()
+    for line in f:
+        try:
+            url, selector, etag, last_modified, next_url = json.loads(line)
+        except ValueError:
+            continue  # a torn or hand-edited line: just forget it
+        entries[(url, selector)] = CachedPage(etag=etag, last_modified=last_modified, next_url=next_url)
+    return entries
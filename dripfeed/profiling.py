@@ -0,0 +1,158 @@
+"""
+Profiling switches for one-off investigations, without patching the installed package: `--profile <file>` runs the
+command under cProfile and writes the stats to <file> (for pstats, snakeviz, ...), and `--trace-memory <n>` traces
+allocations with tracemalloc and reports peak memory and the <n> source lines holding the most memory at the end.
+
+For update-all and serve-schedule, each comic is profiled and traced on its own: its profile is aggregated over all
+its updates into a file of its own (<file> with the comic name inserted before the extension), and it gets its own
+memory report. cProfile and tracemalloc can't tell concurrent updates apart, so comics are then updated one at a time.
+"""
+from __future__ import unicode_literals, print_function
+import contextlib
+import os
+import threading
+from .twothree import quote
+
+__author__ = 'tikitu'
+
+
+class Profiler(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self._stats = {}  # comic name (None for the whole command) -> pstats.Stats
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def profiling(self, comic_name=None):
+        import cProfile
+        import pstats
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                if comic_name in self._stats:
+                    self._stats[comic_name].add(profile)
+                else:
+                    self._stats[comic_name] = pstats.Stats(profile)
+
+    def filename_for(self, comic_name):
+        if comic_name is None:
+            return self.filename
+        base, extension = os.path.splitext(self.filename)
+        return '{0}.{1}{2}'.format(base, quote(comic_name, safe=''), extension or '.prof')
+
+    def dump(self):
+        with self._lock:
+            for comic_name, stats in self._stats.items():
+                stats.dump_stats(self.filename_for(comic_name))
+                print('Profile written to {0}'.format(self.filename_for(comic_name)))
+
+
+class MemoryTracer(object):
+    def __init__(self, top):
+        try:
+            import tracemalloc
+        except ImportError:
+            raise ValueError('--trace-memory needs python 3.4 or later')
+        self._tracemalloc = tracemalloc
+        self.top = top
+        self.reports = []
+
+    @contextlib.contextmanager
+    def tracing(self, comic_name=None):
+        tracemalloc = self._tracemalloc
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        if hasattr(tracemalloc, 'reset_peak'):  # python 3.9; before that, peaks are since tracing started
+            tracemalloc.reset_peak()
+        before = self._snapshot()
+        try:
+            yield
+        finally:
+            after = self._snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started:
+                tracemalloc.stop()
+            self.reports.append(self._report(comic_name, before, after, peak))
+
+    def _snapshot(self):
+        tracemalloc = self._tracemalloc
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ])
+
+    def _report(self, comic_name, before, after, peak):
+        lines = ['Memory{0}: peak {1:.1f} MiB; top {2} allocations still held at the end:'.format(
+            '' if comic_name is None else ' for ' + comic_name, peak / 1024.0 / 1024.0, self.top)]
+        lines.extend('  {0}'.format(stat) for stat in after.compare_to(before, 'lineno')[:self.top])
+        return os.linesep.join(lines)
+
+    def report(self):
+        for report in self.reports:
+            print(report)
+
+
+_profiler = None
+_tracer = None
+_per_comic = False
+
+
+@contextlib.contextmanager
+def profiled(profile_file=None, trace_memory=None, per_comic=False):
+    """
+    Profile and/or trace memory (if `profile_file` or `trace_memory` are given) for the duration of the block: as a
+    whole, or only inside profiled_comic() if `per_comic`.
+    """
+    global _profiler, _tracer, _per_comic
+    if not (profile_file or trace_memory):
+        yield
+        return
+    _profiler = Profiler(profile_file) if profile_file else None
+    _tracer = MemoryTracer(trace_memory) if trace_memory else None
+    _per_comic = per_comic
+    try:
+        if per_comic:
+            yield
+        else:
+            with _profiled(None):
+                yield
+    finally:
+        if _profiler is not None:
+            _profiler.dump()
+        if _tracer is not None:
+            _tracer.report()
+        _profiler, _tracer, _per_comic = None, None, False
+
+
+def is_profiling():
+    return _profiler is not None or _tracer is not None
+
+
+@contextlib.contextmanager
+def profiled_comic(comic_name):
+    """
+    Wrap each update of a comic in this, so that it's profiled on its own when profiling per comic.
+    """
+    if not _per_comic:
+        yield
+        return
+    with _profiled(comic_name):
+        yield
+
+
+@contextlib.contextmanager
+def _profiled(comic_name):
+    with (_profiler.profiling(comic_name) if _profiler is not None else _nothing()):
+        with (_tracer.tracing(comic_name) if _tracer is not None else _nothing()):
+            yield
+
+
+@contextlib.contextmanager
+def _nothing():
+    yield
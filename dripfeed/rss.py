@@ -4,15 +4,104 @@ store: nothing outside the RSS file needs to keep track of earlier entries that
 we need to be able to round-trip an RSS file: parse it to python objects, manipulate those objects (adding an entry,
 possibly removing any error entries there might be) and generate a new RSS feed for the new content. There doesn't seem
 to be a library that handles *both* ends of this, funnily enough.
+
+Since we only ever add entries at the top, updates don't need the full round trip, though: write_entries() reads a
+feed that we wrote ourselves as its header, its serialised <item>s and its footer, and writes the new items in front
+of the old ones without parsing or re-serialising those. The old items are streamed one at a time from the old file to
+the new one, so memory doesn't grow with the depth of the feed (see Comic.num_entries). Only feeds it doesn't recognise
+(edited by hand, say) go through feedparser.
+
+Feeds are always replaced as a whole (see write_atomically()), so a feed reader polling the file never sees half of it.
+With Comic.gzip, a gzipped copy is written next to the feed after each change (<rss_file>.gz, the name web servers
+look for, like nginx's gzip_static), so that it needn't be compressed again for every request.
 """
 from datetime import datetime
-import feedparser as rss_parse
-import PyRSS2Gen as rss_gen
+from io import BytesIO
+import os
+import re
+import zlib
+import six
+from .comics import write_atomically
+from .timing import timed
+from .twothree import html_unescape
+# feedparser, PyRSS2Gen and xml.sax (which pulls in urllib.request) are imported by the functions that use them, so
+# that commands which never touch a feed don't pay for loading them.
 
 __author__ = 'tikitu'
 
 
+NUM_ENTRIES = 20
+CHUNK_SIZE = 64 * 1024
+
+_HEADER = re.compile(br'^<\?xml version="1.0" encoding="([A-Za-z0-9._-]+)"\?>\n<rss version="2.0"><channel>')
+_FOOTER = b'</channel></rss>'
+_ITEM_TITLE = re.compile(br'^<item><title>(.*?)</title>', re.DOTALL)
+_ITEM_START = b'<item>'
+_ITEM_END = b'</item>'
+
+
+class UnrecognisedFeedError(Exception):
+    pass
+
+
+class _FeedReader(object):
+    """
+    Reads a feed that we wrote ourselves from `f` (a binary file) in chunks: its header up to the first item, then
+    items() yields each serialised <item> in turn, and then `footer` is what comes after them. Raises
+    UnrecognisedFeedError (on reading the header, or from items()) if the feed isn't laid out that way.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self._buffer = b''
+        while True:
+            end = _earliest(self._buffer, (_ITEM_START, _FOOTER))
+            if end != -1 or not self._fill():
+                break
+        header = _HEADER.match(self._buffer)
+        if header is None or end == -1:
+            raise UnrecognisedFeedError()
+        self.encoding = header.group(1).decode('ascii')
+        self.header = self._take(end)
+        self.footer = None
+
+    def items(self):
+        while True:
+            while len(self._buffer) < len(_ITEM_START) and self._fill():
+                pass
+            if not self._buffer.startswith(_ITEM_START):
+                break
+            end = self._buffer.find(_ITEM_END)
+            while end == -1:
+                searched = len(self._buffer)
+                if not self._fill():
+                    raise UnrecognisedFeedError()
+                end = self._buffer.find(_ITEM_END, max(0, searched - len(_ITEM_END)))
+            yield self._take(end + len(_ITEM_END))
+        while self._fill():
+            pass
+        if self._buffer.strip() != _FOOTER:
+            raise UnrecognisedFeedError()  # something other than <item>s between the channel fields and the footer
+        self.footer = self._take(len(self._buffer))
+
+    def _fill(self):
+        chunk = self._f.read(CHUNK_SIZE)
+        self._buffer += chunk
+        return bool(chunk)
+
+    def _take(self, length):
+        taken, self._buffer = self._buffer[:length], self._buffer[length:]
+        return taken
+
+
+def _earliest(content, substrings):
+    found = [position for position in (content.find(substring) for substring in substrings) if position != -1]
+    return min(found) if found else -1
+
+
 def parse_rss(fp):
+    import feedparser as rss_parse
+    import PyRSS2Gen as rss_gen
     parsed = rss_parse.parse(fp)
 
     to_gen = rss_gen.RSS2(
@@ -33,52 +122,175 @@ def parse_rss(fp):
     return to_gen
 
 
-def add_entry(rss, comic, num_entries=20):
+def entry_item(comic):
+    import PyRSS2Gen as rss_gen
+    return rss_gen.RSSItem(
+        title='New {0} episode'.format(comic.full_name),
+        description='Episode {0} provided by dripfeed'.format(comic.progress.episode),
+        link=comic.progress.next_url,
+        pubDate=datetime.utcnow()
+    )
+
+
+def error_item(exception, current_url):
+    import PyRSS2Gen as rss_gen
+    return rss_gen.RSSItem(
+        title='Latest episode has an error',
+        description=six.text_type(exception),
+        pubDate=datetime.utcnow(),
+        link=current_url,
+    )
+
+
+def add_entry(rss, comic, num_entries=NUM_ENTRIES):
     while rss.items and rss.items[0].title.endswith('error'):
         rss.items.pop(0)
-    rss.items[0:0] = [
-        rss_gen.RSSItem(
-            title='New {0} episode'.format(comic.full_name),
-            description='Episode {0} provided by dripfeed'.format(comic.progress.episode),
-            link=comic.progress.next_url,
-            pubDate=datetime.utcnow()
-        )
-    ]
+    rss.items[0:0] = [entry_item(comic)]
     rss.items = rss.items[:num_entries]
 
 
-def add_error_entry(rss, exception, current_url, num_entries=20):
-    rss.items[0:0] = [
-        rss_gen.RSSItem(
-            title='Latest episode has an error',
-            description=unicode(exception),
-            pubDate=datetime.utcnow(),
-            link=current_url,
-        )
-    ]
+def add_error_entry(rss, exception, current_url, num_entries=NUM_ENTRIES):
+    rss.items[0:0] = [error_item(exception, current_url)]
     rss.items = rss.items[:num_entries]
 
 
+def write_entries(rss_file, items, drop_errors=False, num_entries=None, gzip=False):
+    """
+    Add `items` (newest first) to the top of the feed in `rss_file`, keeping at most `num_entries` items (None for
+    NUM_ENTRIES). With `drop_errors`, error entries currently at the top of the feed are removed first. If that leaves
+    the feed as it was, the file isn't written at all. With `gzip`, <rss_file>.gz is rewritten too (or created, if it's
+    missing).
+    """
+    num_entries = NUM_ENTRIES if num_entries is None else num_entries
+    try:
+        with timed('rss_read'):
+            changed = items or _changes_without_items(rss_file, drop_errors, num_entries)
+        if changed:
+            with timed('rss_write'):
+                with open(rss_file, 'rb') as f:
+                    write_atomically(rss_file, _prepended_items(f, items, drop_errors, num_entries))
+    except UnrecognisedFeedError:
+        changed = _rewrite_parsed(rss_file, items, drop_errors, num_entries)
+    if gzip and (changed or not os.path.exists(rss_file + '.gz')):
+        with timed('rss_write'):
+            write_gzipped(rss_file)
+
+
+def _changes_without_items(rss_file, drop_errors, num_entries):
+    """
+    Whether dropping errors (if `drop_errors`) or trimming to `num_entries` would change the feed.
+    """
+    with open(rss_file, 'rb') as f:
+        reader = _FeedReader(f)
+        for number, item in enumerate(reader.items(), 1):
+            if number == 1 and drop_errors and _item_title(item, reader.encoding).endswith('error'):
+                return True
+            if number > num_entries:
+                return True
+    return False
+
+
+def _prepended_items(f, items, drop_errors, num_entries):
+    """
+    The new feed, in chunks: `items` in front of those of the feed being read from `f`.
+    """
+    reader = _FeedReader(f)
+    yield reader.header
+    written = 0
+    for item in items[:num_entries]:
+        yield _serialise_item(item, reader.encoding)
+        written += 1
+    dropping = drop_errors
+    for item in reader.items():  # read to the end even once we have enough, to check the footer
+        if dropping and _item_title(item, reader.encoding).endswith('error'):
+            continue
+        dropping = False
+        if written < num_entries:
+            yield item
+            written += 1
+    yield reader.footer
+
+
+def _rewrite_parsed(rss_file, items, drop_errors, num_entries):
+    """
+    write_entries() for feeds that _FeedReader doesn't recognise: the full round trip through feedparser.
+    """
+    with timed('rss_read'):
+        with open(rss_file, 'rb') as f:
+            original = f.read()
+        rss = parse_rss(BytesIO(original))
+    with timed('rss_write'):
+        if drop_errors:
+            while rss.items and rss.items[0].title.endswith('error'):
+                rss.items.pop(0)
+        rss.items[0:0] = items
+        rss.items = rss.items[:num_entries]
+        out = BytesIO()
+        rss.write_xml(out)
+        content = out.getvalue()
+        if content == original:
+            return False
+        write_atomically(rss_file, content)
+        return True
+
+
+def write_gzipped(rss_file):
+    """
+    Replace <rss_file>.gz with a gzipped copy of `rss_file`, compressed a chunk at a time. Only regular files get one
+    (there's no /dev/null.gz).
+    """
+    if not os.path.isfile(rss_file):
+        return
+    with open(rss_file, 'rb') as f:
+        write_atomically(rss_file + '.gz', _gzipped(f))
+
+
+def _gzipped(f):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16+: with a gzip header and trailer
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+def _serialise_item(item, encoding):
+    from xml.sax import saxutils
+    out = BytesIO()
+    handler = saxutils.XMLGenerator(out, encoding)
+    item.publish(handler)
+    handler.endDocument()  # flushes
+    return out.getvalue()
+
+
+def _item_title(item, encoding):
+    title = _ITEM_TITLE.match(item)
+    return html_unescape(title.group(1).decode(encoding)) if title else ''
+
+
 def init_rss(comic):
+    import PyRSS2Gen as rss_gen
     now = datetime.utcnow()
     rss = rss_gen.RSS2(
         title='Dripfeed for {0}'.format(comic.full_name),
         link='file://{0}'.format(comic.rss_file),
         description='Dripfeed replays comic archives at the rate you choose',
         lastBuildDate=now,
-        items=[
-            rss_gen.RSSItem(
-                title='First {0} episode'.format(comic.full_name),
-                description='Episode 1 provided by dripfeed',
-                link=comic.start_url,
-                pubDate=now,
-            )
-        ]
+        items=[],
+    )
+    first = rss_gen.RSSItem(
+        title='First {0} episode'.format(comic.full_name),
+        description='Episode 1 provided by dripfeed',
+        link=comic.start_url,
+        pubDate=now,
     )
-    with open(comic.rss_file, 'w+') as f:
-        rss.write_xml(f)
-        f.truncate()
+    out = BytesIO()
+    rss.write_xml(out)
+    channel = out.getvalue()
+    body_end = channel.rfind(_FOOTER)
+    encoding = _HEADER.match(channel).group(1).decode('ascii')
+    write_atomically(comic.rss_file, [channel[:body_end], _serialise_item(first, encoding), channel[body_end:]])
+    if comic.gzip:
+        write_gzipped(comic.rss_file)
 
 
 def struct_time_to_datetime(struct_time):
-    return datetime(*struct_time[:6])
\ No newline at end of file
+    return datetime(*struct_time[:6])
@@ -0,0 +1,257 @@
+"""
+A long-running alternative to one cron job per comic: `dripfeed serve-schedule` loads the comics once and keeps them in
+a heap ordered by when each is next due, according to its `interval` option (comics without one aren't scheduled).
+Due updates run on a pool of worker threads, in the same process, so there's no interpreter start-up, no re-importing
+and no new connections per update.
+
+The comics are reloaded when the comic store changes (checked every few seconds) or on SIGHUP; SIGTERM or SIGINT stop
+scheduling new updates and wait for running ones to finish.
+
+`dripfeed work` is the same, except that it shares the comics with the other `dripfeed work` processes using the same
+comic store, on this machine or others: a Worker only schedules its own shard of the comics, and holds a lease on each
+comic while updating it (see dripfeed.leases).
+"""
+from __future__ import unicode_literals
+import heapq
+from logging import getLogger
+import os
+import signal
+import threading
+import time
+from .comics import get_comic, get_configured_comics, get_store, parse_interval, DEFAULT_WORKERS
+from .leases import DEFAULT_LEASE_DURATION, Leases, Nodes, default_node, owner
+
+__author__ = 'tikitu'
+
+
+logger = getLogger('dripfeed')
+
+POLL_INTERVAL = 5.0
+
+
+class Scheduler(object):
+    """
+    @arg update: called as update(comic_name) on a worker thread for each due comic
+    @arg accept: if given, only comics for which accept(comic_name) is true are scheduled
+    """
+
+    def __init__(self, update, workers=DEFAULT_WORKERS, poll_interval=POLL_INTERVAL, accept=None):
+        self.update = update
+        self.accept = accept
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._heap = []  # (due time, comic name)
+        self._due = {}  # comic name -> due time, for comics that are scheduled (not running)
+        self._intervals = {}  # comic name -> seconds
+        self._running = set()  # comic names
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._reload_requested = False
+        self._store_stamp = None
+
+    def reload(self):
+        """
+        Pick up added and removed comics and changed intervals. New comics are due one interval after their last
+        update (so, right away if they were never updated).
+        """
+        self._store_stamp = _store_stamp()
+        intervals = {}
+        last_updates = {}
+        for comic in get_configured_comics(allow_missing_file=True):
+            if comic.interval is None or (self.accept is not None and not self.accept(comic.name)):
+                continue
+            try:
+                intervals[comic.name] = parse_interval(comic.interval)
+            except ValueError as exception:
+                logger.error('{0}: {1}'.format(comic.name, exception))
+                continue
+            last_updates[comic.name] = comic.progress.updated if comic.progress is not None else None
+        now = time.time()
+        with self._lock:
+            self._intervals = intervals
+            for name in list(self._due):
+                if name not in intervals:
+                    del self._due[name]  # its heap entry is skipped when it comes up
+            for name, interval in intervals.items():
+                if name not in self._due and name not in self._running:
+                    last_update = last_updates[name]
+                    self._schedule(name, now if last_update is None else max(now, last_update + interval))
+        logger.info('Scheduling {0} comics'.format(len(intervals)))
+
+    def request_reload(self):
+        self._reload_requested = True
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+
+    def run(self):
+        """
+        Run due updates until stop() is called, then wait for the running ones.
+        """
+        from multiprocessing.pool import ThreadPool
+        self.reload()
+        pool = ThreadPool(self.workers)
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                if self._reload_requested or _store_stamp() != self._store_stamp:
+                    self._reload_requested = False
+                    self.reload()
+                for name in self._pop_due():
+                    pool.apply_async(self._run_update, (name,))
+                self._wakeup.wait(self._seconds_until_due())
+        finally:
+            logger.info('Waiting for running updates to finish')
+            pool.close()
+            pool.join()
+
+    def _pop_due(self):
+        now = time.time()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_time, name = heapq.heappop(self._heap)
+                if self._due.get(name) != due_time:
+                    continue  # removed or rescheduled since
+                del self._due[name]
+                self._running.add(name)
+                due.append(name)
+        return due
+
+    def _seconds_until_due(self):
+        with self._lock:
+            if not self._heap:
+                return self.poll_interval
+            return max(0, min(self._heap[0][0] - time.time(), self.poll_interval))
+
+    def _run_update(self, name):
+        try:
+            self.update(name)
+        except Exception:
+            logger.exception('{0}: update failed'.format(name))
+        finally:
+            with self._lock:
+                self._running.discard(name)
+                if name in self._intervals:
+                    self._schedule(name, time.time() + self._intervals[name])
+            self._wakeup.set()
+
+    def _schedule(self, name, due_time):
+        self._due[name] = due_time
+        heapq.heappush(self._heap, (due_time, name))
+
+
+class Worker(object):
+    """
+    Schedules this node's shard of the comics, and keeps its heartbeat and the leases of the comics it's updating
+    renewed. Has the same run(), stop() and request_reload() as Scheduler.
+
+    @arg node: this worker's name, unique among the workers sharing the comic store
+    @arg lease_duration: seconds after which the heartbeat and leases of a worker that stopped renewing them expire
+    """
+
+    def __init__(self, update, node=None, lease_duration=DEFAULT_LEASE_DURATION, workers=DEFAULT_WORKERS,
+                 poll_interval=POLL_INTERVAL):
+        self.update = update
+        self.node = node or default_node()
+        self.leases = Leases(self.node, lease_duration)
+        self.nodes = Nodes(self.node, lease_duration)
+        self.scheduler = Scheduler(self._leased_update, workers=workers, poll_interval=poll_interval,
+                                   accept=self._in_shard)
+        self._live = set([self.node])  # node names
+        self._held = {}  # comic name -> Lease, while updating
+        self._held_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def run(self):
+        self.nodes.announce()
+        self._live = self.nodes.live()
+        heartbeat = threading.Thread(target=self._heartbeats)
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            self.scheduler.run()
+        finally:
+            self._stopped.set()
+            heartbeat.join()
+            self.nodes.leave()  # so that the other nodes take over its share right away
+
+    def stop(self):
+        self.scheduler.stop()
+
+    def request_reload(self):
+        self.scheduler.request_reload()
+
+    def _in_shard(self, comic_name):
+        return owner(comic_name, self._live) == self.node
+
+    def _heartbeats(self):
+        while not self._stopped.wait(self.leases.duration / 3.0):
+            try:
+                self._heartbeat()
+            except (IOError, OSError) as exception:
+                logger.error('Heartbeat failed: {0}'.format(exception))
+
+    def _heartbeat(self):
+        self.nodes.announce()
+        with self._held_lock:
+            held = list(self._held.values())
+        for lease in held:
+            if not lease.renew():
+                logger.warning('{0}: lost the lease to another node'.format(lease.comic_name))
+        live = self.nodes.live()
+        if live != self._live:
+            logger.info('Sharing comics between {0} nodes'.format(len(live)))
+            self._live = live
+            self.scheduler.request_reload()
+
+    def _leased_update(self, comic_name):
+        lease = self.leases.claim(comic_name)
+        if lease is None:
+            logger.debug('{0}: leased to another node'.format(comic_name))
+            return
+        with self._held_lock:
+            self._held[comic_name] = lease
+        try:
+            if _is_due(get_comic(comic_name)):  # another node may have updated it since this one last reloaded
+                self.update(comic_name)
+        finally:
+            with self._held_lock:
+                del self._held[comic_name]
+            lease.release()
+
+
+def _is_due(comic, now=None):
+    if comic.interval is None:
+        return False
+    if comic.progress is None or comic.progress.updated is None:
+        return True
+    now = time.time() if now is None else now
+    return now >= comic.progress.updated + parse_interval(comic.interval)
+
+
+def _store_stamp():
+    filename = get_store().filename
+    stamp = []
+    for path in (filename, filename + '-wal'):  # the latter for SQLite's write-ahead log
+        try:
+            stat = os.stat(path)
+            stamp.append((stat.st_mtime, stat.st_size))
+        except OSError:
+            stamp.append(None)
+    return stamp
+
+
+def install_signal_handlers(scheduler):
+    """
+    SIGHUP reloads the comics, SIGTERM and SIGINT stop gracefully. Only call this from the main thread.
+
+    @arg scheduler: Scheduler, Worker or feedserver.FeedServer (anything with stop() and request_reload())
+    """
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: scheduler.request_reload())
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: scheduler.stop())
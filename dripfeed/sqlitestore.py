@@ -0,0 +1,92 @@
+"""
+Comics stored in a SQLite database instead of the INI config file: one row per comic, holding the same options the
+INI file would. Updating a comic's progress rewrites just that row, in a short transaction, rather than parsing and
+rewriting the whole config file under an exclusive lock; and in WAL mode readers never wait for a writer. With hundreds
+of comics updated by concurrent cron jobs, that's the difference between queueing on one lock and not noticing each
+other.
+
+Create the database from an existing config file with `dripfeed migrate-sqlite` (see comics.migrate_to_sqlite()).
+"""
+from __future__ import unicode_literals
+import contextlib
+import json
+from logging import getLogger
+import sqlite3
+from .comics import comic_to_options, comic_from_options, options_config
+
+__author__ = 'tikitu'
+
+
+logger = getLogger('dripfeed')
+
+BUSY_TIMEOUT = 60
+
+
+class SqliteStore(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+    @contextlib.contextmanager
+    def _connection(self):
+        connection = sqlite3.connect(self.filename, timeout=BUSY_TIMEOUT, isolation_level=None)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS comics (name TEXT PRIMARY KEY, options TEXT NOT NULL)')
+            yield connection
+        finally:
+            connection.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._connection() as connection:
+            connection.execute('BEGIN IMMEDIATE')  # take the write lock up front, rather than fail to upgrade later
+            try:
+                yield connection
+            except:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def get_comic(self, comic_name):
+        with self._connection() as connection:
+            row = connection.execute('SELECT options FROM comics WHERE name = ?', (comic_name,)).fetchone()
+        if row is None:
+            raise ValueError(u'Comic {0} is not configured'.format(comic_name))
+        return comic_from_options(comic_name, json.loads(row[0]))
+
+    def get_configured_comics(self, allow_missing_file=False):
+        with self._connection() as connection:
+            rows = connection.execute('SELECT name, options FROM comics ORDER BY rowid').fetchall()
+        return [comic_from_options(name, json.loads(options)) for name, options in rows]
+
+    def put_comics(self, comics, create_file=False, overwrite=False):
+        rows = [(comic.name, json.dumps(comic_to_options(comic))) for comic in comics]
+        with self._transaction() as connection:
+            if not overwrite:
+                for name, _ in rows:
+                    if connection.execute('SELECT 1 FROM comics WHERE name = ?', (name,)).fetchone():
+                        raise ValueError('Comic {0} is already configured!'.format(name))
+            action = 'Updating' if overwrite else 'Adding'
+            for name, options in rows:
+                logger.info('{0} {1} in {2}'.format(action, name, self.filename))
+                updated = connection.execute('UPDATE comics SET options = ? WHERE name = ?', (options, name))
+                if not updated.rowcount:
+                    connection.execute('INSERT INTO comics (name, options) VALUES (?, ?)', (name, options))
+
+    def get_progress(self, comic_name):
+        return self.get_comic(comic_name).progress
+
+    def put_progress(self, comic):
+        with self._transaction() as connection:
+            row = connection.execute('SELECT options FROM comics WHERE name = ?', (comic.name,)).fetchone()
+            if row is None:
+                raise ValueError(u'Comic {0} is not configured'.format(comic.name))
+            global_config = options_config(comic.name, json.loads(row[0]))
+            comic.progress.add_to_global_config(global_config, under_name=comic.name)
+            options = json.dumps(global_config.items(comic.name, raw=True))
+            connection.execute('UPDATE comics SET options = ? WHERE name = ?', (options, comic.name))
+
+    def remove_comic(self, comic_name):
+        with self._transaction() as connection:
+            return connection.execute('DELETE FROM comics WHERE name = ?', (comic_name,)).rowcount > 0
+
@@ -0,0 +1,185 @@
+"""
+Per-comic update statistics. Every update appends one record of its timings (see dripfeed.timing) to a log file in the
+comic's state directory; the log is a ring buffer, trimmed to its newest half once it grows beyond `max_bytes`, so it
+holds roughly the last few hundred updates. `dripfeed stats` summarises the logs as rolling percentiles per phase,
+bytes fetched and error rates.
+
+Records can also be sent as StatsD lines (over UDP, usually to a local agent) with `--statsd host:port`.
+"""
+from __future__ import unicode_literals
+import io
+import json
+from logging import getLogger
+import os
+import re
+import time
+from .comics import BackingOffError, NoMatchForXPathError, comic_state_path, ensure_directory, write_atomically
+from .timing import PHASES
+
+__author__ = 'tikitu'
+
+
+logger = getLogger('dripfeed')
+
+MAX_BYTES = 128 * 1024
+
+
+class StatsLog(object):
+    def __init__(self, comic_name, max_bytes=MAX_BYTES):
+        self.filename = comic_state_path('stats', comic_name)
+        self.max_bytes = max_bytes
+
+    def append(self, timings):
+        """
+        Call this while holding comic_lock(), so that appending and trimming don't race.
+        """
+        ensure_directory(os.path.dirname(self.filename))
+        with io.open(self.filename, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(_record(timings)) + '\n')
+            size = f.tell()
+        if size > self.max_bytes:
+            self._trim()
+
+    def records(self):
+        """
+        The logged records, oldest first.
+        """
+        try:
+            with io.open(self.filename, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except IOError:
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue  # a torn line: skip it
+        return records
+
+    def _trim(self):
+        with io.open(self.filename, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        kept = []
+        size = 0
+        for line in reversed(lines):
+            size += len(line)
+            if size > self.max_bytes // 2:
+                break
+            kept.append(line)
+        write_atomically(self.filename, ''.join(reversed(kept)))
+
+
+def _record(timings):
+    timings.finish()
+    caught_up = isinstance(timings.error, NoMatchForXPathError)
+    return {
+        'time': int(timings.started),
+        'total': _ms(timings.total),
+        'phases': dict((phase, _ms(seconds)) for phase, seconds in timings.phases.items()),
+        'bytes': timings.bytes,
+        'error': type(timings.error).__name__ if timings.error is not None and not caught_up else None,
+        'caught_up': caught_up,  # found no next link: not an error (see dripfeed._update_locked())
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarise(records):
+    """
+    Rolling statistics over `records` (from StatsLog.records()), or None if there are none. Times are in milliseconds.
+    """
+    if not records:
+        return None
+    errors = [record for record in records if record['error']]
+    phases = [phase for phase in PHASES if any(phase in record['phases'] for record in records)]
+    fetched = sum(record['bytes'] for record in records)
+
+    def distribution(values):
+        return dict((name, percentile(values, fraction)) for name, fraction in (('p50', 0.5), ('p90', 0.9),
+                                                                                ('p99', 0.99)))
+    return {
+        'since': records[0]['time'],
+        'updates': len(records),
+        'errors': len(errors),
+        'error_rate': len(errors) / float(len(records)),
+        'bytes': fetched,
+        'bytes_per_update': fetched / float(len(records)),
+        'total': distribution([record['total'] for record in records]),
+        'phases': dict((phase, distribution([record['phases'].get(phase, 0) for record in records]))
+                       for phase in phases),
+    }
+
+
+def format_summary(comic_name, summary):
+    lines = ['{0}: {1} updates since {2}, {3} errors ({4:.1%}), {5:.1f} kB fetched ({6:.1f} kB per update)'.format(
+        comic_name, summary['updates'], time.strftime('%Y-%m-%d %H:%M', time.localtime(summary['since'])),
+        summary['errors'], summary['error_rate'], summary['bytes'] / 1024.0, summary['bytes_per_update'] / 1024.0)]
+    rows = [('total', summary['total'])] + [(phase, summary['phases'][phase]) for phase in PHASES
+                                            if phase in summary['phases']]
+    for name, distribution in rows:
+        lines.append('  {0:<10} p50 {p50:9.1f}ms  p90 {p90:9.1f}ms  p99 {p99:9.1f}ms'.format(name, **distribution))
+    return lines
+
+
+class StatsdClient(object):
+    """
+    Sends each update as StatsD timers (total and per phase) and counters (updates, errors, bytes), named
+    <prefix>.<comic name>.<metric>.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='dripfeed'):
+        import socket
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, timings):
+        record = _record(timings)
+        name = '{0}.{1}'.format(self.prefix, re.sub(r'[^A-Za-z0-9_-]', '_', timings.comic_name))
+        lines = ['{0}.updates:1|c'.format(name), '{0}.total:{1}|ms'.format(name, record['total']),
+                 '{0}.bytes:{1}|c'.format(name, record['bytes'])]
+        lines.extend('{0}.{1}:{2}|ms'.format(name, phase, ms) for phase, ms in sorted(record['phases'].items()))
+        if record['error']:
+            lines.append('{0}.errors:1|c'.format(name))
+        try:
+            self._socket.sendto('\n'.join(lines).encode('utf-8'), self.address)
+        except (IOError, OSError) as exception:  # socket.error, in python 2
+            logger.debug('Could not send stats to {0}:{1}: {2}'.format(self.address[0], self.address[1], exception))
+
+
+_statsd = None
+
+
+def configure_statsd(address):
+    """
+    Send update stats to the StatsD agent at `address` ('host:port'), or stop sending them if it's None.
+    """
+    global _statsd
+    if address is None:
+        _statsd = None
+        return
+    host, _, port = address.rpartition(':')
+    _statsd = StatsdClient(host=host or '127.0.0.1', port=int(port))
+
+
+def record_stats(timings):
+    """
+    Log `timings` for its comic, and send them to StatsD if that's configured. Stats are never worth failing an update
+    for, so errors are only logged.
+    """
+    if isinstance(timings.error, BackingOffError):
+        return  # nothing happened
+    try:
+        StatsLog(timings.comic_name).append(timings)
+    except (IOError, OSError) as exception:
+        logger.warning('{0}: could not record stats: {1}'.format(timings.comic_name, exception))
+    if _statsd is not None:
+        _statsd.send(timings)
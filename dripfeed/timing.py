@@ -0,0 +1,97 @@
+"""
+Lightweight timers for the phases of an update. While an update is being recorded (see recording()), the code doing
+each phase adds its elapsed time with timed(), so the time of one update can be split into waiting for the comic's
+lock, reading the config, the HTTP request and download, HTML parsing, evaluating the selector, and reading and
+writing the feed. Outside of recording() the timers do nothing.
+
+The timings belong to the current thread, so concurrent updates in update-all each record their own.
+"""
+from __future__ import unicode_literals
+import contextlib
+from datetime import timedelta
+import threading
+import time
+
+__author__ = 'tikitu'
+
+
+PHASES = ('lock', 'read', 'throttle', 'request', 'download', 'parse', 'select', 'rss_read', 'rss_write', 'commit')
+
+_local = threading.local()
+
+
+class UpdateTimings(object):
+    def __init__(self, comic_name):
+        self.comic_name = comic_name
+        self.started = time.time()
+        self.total = None
+        self.phases = {}  # phase name -> seconds
+        self.bytes = 0  # fetched
+        self.error = None
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def finish(self):
+        if self.total is None:
+            self.total = time.time() - self.started
+
+
+def current():
+    """
+    The timings being recorded in this thread, or None.
+    """
+    return getattr(_local, 'timings', None)
+
+
+@contextlib.contextmanager
+def recording(comic_name):
+    timings = UpdateTimings(comic_name)
+    previous, _local.timings = current(), timings
+    try:
+        yield timings
+    finally:
+        timings.finish()
+        _local.timings = previous
+
+
+@contextlib.contextmanager
+def timed(phase):
+    timings = current()
+    if timings is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.time() - start)
+
+
+def add_time(phase, seconds):
+    timings = current()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+def record_response(response, seconds, streamed):
+    """
+    Split the `seconds` a fetch took into waiting for the response headers and downloading the body (not downloaded
+    yet if `streamed`: the parser times that).
+    """
+    timings = current()
+    if timings is None:
+        return
+    elapsed = getattr(response, 'elapsed', None)  # from sending the request until the headers were parsed
+    request = elapsed.total_seconds() if isinstance(elapsed, timedelta) else seconds
+    request = min(request, seconds)
+    timings.add('request', request)
+    if not streamed:
+        timings.add('download', seconds - request)
+        add_bytes(len(response.content or b''))
+
+
+def add_bytes(count):
+    timings = current()
+    if timings is not None:
+        timings.bytes += count
@@ -5,9 +5,16 @@ __author__ = 'tikitu'
 
 if six.PY3:
     from configparser import ConfigParser
+    from html import unescape as html_unescape
 else:
     from ConfigParser import SafeConfigParser as ConfigParser
     ConfigParser.read_file = ConfigParser.readfp
+    from HTMLParser import HTMLParser
+    html_unescape = HTMLParser().unescape
 
-from six.moves.urllib.parse import urljoin
+from six.moves.urllib.parse import urljoin, urlsplit, quote
 
+try:
+    from os import replace
+except ImportError:  # python 2: rename already replaces atomically on POSIX
+    from os import rename as replace
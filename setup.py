@@ -47,6 +47,9 @@ setup(
     author_email='tikitu@logophile.org',
     url='https://bitbucket.org/tikitu/dripfeed',
     install_requires=REQUIRES,
+    extras_require={
+        'css': ['cssselect'],
+    },
     license=read("LICENSE"),
     zip_safe=False,
     keywords='dripfeed',
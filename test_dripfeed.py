@@ -5,12 +5,32 @@ import shutil
 from datetime import datetime, timedelta
 from six import BytesIO, StringIO
 from threading import Thread
-from time import sleep
+from time import sleep, time
 import os
+import subprocess
+import sys
 import tempfile
-from dripfeed import create_comic, run_once
-from dripfeed.comics import Comic, XPathComic, Progress, put_comic, _unlocked_get_comic, ConfigParser
-from dripfeed.rss import parse_rss
+import dripfeed
+import dripfeed.comics
+from dripfeed import create_comic, run_once, update_all
+from dripfeed.comics import Comic, XPathComic, Progress, put_comic, _unlocked_get_comic, ConfigParser, get_comic, \
+    NoMatchForXPathError, get_page_cache, get_configured_comics, get_store, migrate_to_sqlite, remove_comic, \
+    _locked_config_file, parse_interval, comic_lock, put_progress, BackingOffError, put_comics, get_global_config, \
+    write_atomically, comic_to_options, comic_from_options, NO_NEXT_WARNING
+from dripfeed.lookahead import crawl, LookaheadQueue
+from dripfeed.extract import find_next_href, ResponseTooLargeError, get_selector
+from dripfeed.fetch import Fetcher, TokenBucket, ThrottledError, interleave_hosts
+from dripfeed.pagecache import PageCache
+from dripfeed.profiling import profiled
+from dripfeed.archive import ArchiveComic, EmptyArchiveError
+from dripfeed.bulk import InvalidImportError, export_comics, import_comics
+from dripfeed.episodes import EpisodeIndex, seek
+from dripfeed.leases import Leases, owner
+from dripfeed.schedule import Scheduler, Worker
+from dripfeed.sqlitestore import SqliteStore
+from dripfeed.stats import StatsLog, StatsdClient, summarise
+from dripfeed.timing import recording
+from dripfeed.rss import parse_rss, init_rss, add_entry, add_error_entry, write_entries, entry_item, error_item
 import mock
 import PyRSS2Gen as rss_gen
 
@@ -57,7 +77,7 @@ def test_run_once():
     comic = XPathComic(name='gunnerkrigg',
                        next_xpath="//img[@src='http://www.gunnerkrigg.com/images/next_a.jpg']/..",
                        progress=Progress(next_url='http://gunnerkrigg.com/?p=1'))
-    with mock.patch('requests.get', return_value=first_gunnerkrigg_page()):
+    with mock.patch('requests.Session.get', return_value=first_gunnerkrigg_page()):
         next_url = comic.next_url()
     assert next_url == 'http://gunnerkrigg.com/?p=2'
 
@@ -66,7 +86,7 @@ def test_absolute_url():
     # Making sure that the treatment of *relative* URLs still lets *absolute* URLs work if we get those
     comic = comic=XPathComic(name='blah', next_xpath='//a',
                              progress=Progress(next_url='http://base.com/'))
-    with mock.patch('requests.get', return_value=mock.Mock()) as get_mock:
+    with mock.patch('requests.Session.get', return_value=mock.Mock()) as get_mock:
         get_mock.return_value.content = '<a href="http://elsewhere.com/">'
         next_url = comic.next_url()
     assert next_url == 'http://elsewhere.com/'
@@ -75,7 +95,7 @@ def test_absolute_url():
 def test_progress_is_optional():
     # Make sure that a Comic() created with progress=None is enough to get started
     comic = XPathComic(name='gunnerkrigg', next_xpath='//a', start_url='http://gunnerkrigg.com/?p=1')
-    with mock.patch('requests.get') as get_mock:
+    with mock.patch('requests.Session.get') as get_mock:
         get_mock.return_value.content = '<a href="?p=2"></a>'
         next_url = comic.next_url()
     assert next_url == 'http://gunnerkrigg.com/?p=2'
@@ -92,7 +112,7 @@ next_xpath = //a
     global_config = ConfigParser()
     global_config.read_file(config_file)
     comic = _unlocked_get_comic('gunnerkrigg', global_config)
-    with mock.patch('requests.get') as get_mock:
+    with mock.patch('requests.Session.get') as get_mock:
         get_mock.return_value.content = '<a href="?p=2"></a>'
         next_url = comic.next_url()
         comic.update_progress(next_url)
@@ -160,7 +180,7 @@ def test_init_adds_all_needed_data():
         rss_fname = os.path.join(d, 'test.rss')
         with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
             create_comic('gunnerkrigg', rss_fname, '//a', 'http://gunnerkrigg.com/?p=1')
-            with mock.patch('requests.get') as get_mock:
+            with mock.patch('requests.Session.get') as get_mock:
                 get_mock.return_value.content = '<a href="?p=2"></a>'
                 run_once('gunnerkrigg')
 
@@ -168,6 +188,9 @@ def test_init_adds_all_needed_data():
             content = f.read()
         assert content
         assert '[gunnerkrigg]' in content
+        # progress updates don't rewrite the config file, they have a file of their own
+        with open(os.path.join(conf_fname + '.d', 'progress', 'gunnerkrigg'), 'r') as f:
+            content = f.read()
         assert 'episode = 2' in content
         assert '?p=2' in content
         with open(rss_fname, 'r') as f:
@@ -218,4 +241,1261 @@ def test_file_locking():
             content = f.read()
         assert '[narbonic]' in content
         assert '[gunnerkrigg]' in content
-    
\ No newline at end of file
+    
+
+def test_update_all():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        pages = {
+            'http://gunnerkrigg.com/?p=1': '<a href="?p=2"></a>',
+            'http://narbonic.com/1': '<a href="/2"></a>',
+            'http://broken.com/': '<p>no links here</p>',
+        }
+
+        def fake_get(url, *args, **kwargs):
+            response = mock.Mock()
+            response.content = pages[url]
+            return response
+
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('gunnerkrigg', os.path.join(d, 'g.rss'), '//a', 'http://gunnerkrigg.com/?p=1')
+            create_comic('narbonic', os.path.join(d, 'n.rss'), '//a', 'http://narbonic.com/1')
+            create_comic('broken', os.path.join(d, 'b.rss'), '//a', 'http://broken.com/')
+            with mock.patch('requests.Session.get', side_effect=fake_get):
+                results = update_all()
+            assert len(results) == 3
+            errors = dict((comic.name, exception) for comic, exception in results)
+            assert errors['gunnerkrigg'] is None
+            assert errors['narbonic'] is None
+            assert isinstance(errors['broken'], NoMatchForXPathError)
+
+            assert get_comic('gunnerkrigg').progress.next_url == 'http://gunnerkrigg.com/?p=2'
+            assert get_comic('narbonic').progress.next_url == 'http://narbonic.com/2'
+            broken = get_comic('broken').progress  # still at the start (no next link isn't a failure)
+            assert (broken.episode, broken.next_url, broken.failures) == (1, 'http://broken.com/', 0)
+
+            with mock.patch('requests.Session.get', side_effect=fake_get) as get_mock:
+                results = update_all(['gunner*'])
+            assert [comic.name for comic, exception in results] == ['gunnerkrigg']
+            assert get_mock.call_count == 1
+
+        with open(os.path.join(d, 'n.rss'), 'r') as f:
+            assert 'http://narbonic.com/2' in f.read()
+        with open(os.path.join(d, 'b.rss'), 'r') as f:
+            assert 'has an error' not in f.read()
+
+
+def test_update_all_command_reports_and_fails_if_a_comic_failed():
+    from docopt import docopt
+
+    def get(url, **kwargs):
+        if 'down.com' in url:
+            raise IOError('down')
+        return numbered_pages(3)(url)
+
+    with temp_dir() as d:
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'test_config.cfg')):
+            create_comic('up', os.path.join(d, 'up.rss'), '//a', 'http://comic.com/1')
+            create_comic('down', os.path.join(d, 'down.rss'), '//a', 'http://down.com/1')
+            with mock.patch('requests.Session.get', side_effect=get):
+                with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+                    try:
+                        dripfeed.run_command(docopt(dripfeed.__doc__, argv=['update-all']))
+                    except SystemExit as exit:
+                        assert exit.code == 1
+                    else:
+                        assert False, 'Expected SystemExit'
+                assert stdout.getvalue().splitlines() == ['up: ok, episode 2 at http://comic.com/2',
+                                                          'down: FAILED: down']
+
+                # Backing off isn't a new failure
+                with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+                    dripfeed.run_command(docopt(dripfeed.__doc__, argv=['update-all', '--quiet']))
+                assert stdout.getvalue() == ''
+
+
+def test_fetcher_pools_sessions_per_host():
+    fetcher = Fetcher(per_host=2, timeout=5)
+    assert fetcher._host('http://a.com/1') is fetcher._host('http://A.com/2?p=3')
+    assert fetcher._host('http://a.com/1') is not fetcher._host('http://b.com/1')
+    assert fetcher._host('http://a.com/1') is not fetcher._host('https://a.com/1')
+
+    active = []
+    peak = [0]
+
+    def slow_get(url, **kwargs):
+        assert kwargs['timeout'] == 5
+        active.append(url)
+        peak[0] = max(peak[0], len(active))
+        sleep(0.1)
+        active.remove(url)
+        return fake_response()
+
+    with mock.patch('requests.Session.get', side_effect=slow_get):
+        threads = [Thread(target=fetcher.get, args=('http://a.com/{0}'.format(i),)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert peak[0] == 2
+
+
+def test_fetcher_holds_the_host_slot_until_a_streamed_response_is_closed():
+    fetcher = Fetcher(per_host=1)
+    slots = fetcher._host('http://a.com/1').slots
+    with mock.patch('requests.Session.get', side_effect=lambda url, **kwargs: fake_response()):
+        fetcher.get('http://a.com/1')
+        assert slots.acquire(False)  # not streamed: released straight away
+        slots.release()
+
+        response = fetcher.get('http://a.com/1', stream=True)
+        assert not slots.acquire(False)
+        response.close()
+        response.close()  # only released once
+        assert slots.acquire(False)
+        slots.release()
+
+    throttled, ok = fake_response(status_code=429, headers={'Retry-After': '0'}), fake_response('ok')
+    throttled_close = throttled.close
+    with mock.patch('requests.Session.get', side_effect=[throttled, ok]):
+        assert fetcher.get('http://a.com/2', stream=True) is ok
+    assert throttled_close.called  # its connection goes back to the pool before retrying
+    assert not slots.acquire(False)  # held by the response returned
+
+
+def fake_response(content='', status_code=200, headers=None):
+    response = mock.Mock()
+    response.content = content
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
+def test_conditional_get_reuses_cached_next_url():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        comic = XPathComic(name='gunnerkrigg', next_xpath='//a', start_url='http://gunnerkrigg.com/?p=1')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            first = fake_response('<a href="?p=2"></a>', headers={'ETag': '"v1"', 'Last-Modified': 'yesterday'})
+            with mock.patch('requests.Session.get', return_value=first) as get_mock:
+                assert comic.next_url() == 'http://gunnerkrigg.com/?p=2'
+            assert not get_mock.call_args[1]['headers']
+            get_page_cache().flush()
+            dripfeed.comics._page_cache = None  # as if in a new process
+
+            with mock.patch('requests.Session.get', return_value=fake_response(status_code=304)) as get_mock:
+                with mock.patch('lxml.html.fromstring') as parse_mock:
+                    assert comic.next_url() == 'http://gunnerkrigg.com/?p=2'
+            assert get_mock.call_args[1]['headers'] == {'If-None-Match': '"v1"', 'If-Modified-Since': 'yesterday'}
+            assert not parse_mock.called
+
+
+def test_page_cache_evicts_least_recently_used():
+    with temp_dir() as d:
+        fname = os.path.join(d, 'cache')
+        cache = PageCache(fname, max_bytes=200)
+        for i in range(5):
+            cache.store('http://a.com/{0}'.format(i), '//a', fake_response(headers={'ETag': str(i)}),
+                        'http://a.com/{0}'.format(i + 1))
+        cache.lookup('http://a.com/0', '//a')
+        cache.flush()
+        assert os.path.getsize(fname) <= 200
+
+        reloaded = PageCache(fname)
+        assert reloaded.lookup('http://a.com/0', '//a').next_url == 'http://a.com/1'
+        assert reloaded.lookup('http://a.com/4', '//a').etag == '4'
+        assert reloaded.lookup('http://a.com/1', '//a') is None
+
+
+def streamed_response(chunks):
+    consumed = []
+
+    def iter_content(chunk_size):
+        for chunk in chunks:
+            consumed.append(chunk)
+            yield chunk
+
+    response = fake_response(status_code=200)
+    response.iter_content = iter_content
+    return response, consumed
+
+
+def test_streaming_stops_at_first_match():
+    chunks = [b'<html><body><div class="nav"><a href="?p=2" rel="next">',
+              b'next</a></div>' + b'<p>comment</p>' * 1000,
+              b'</body></html>']
+    response, consumed = streamed_response(chunks)
+    assert find_next_href(response, '//a[@rel="next"]', stream=True) == '?p=2'
+    assert len(consumed) == 1
+    assert response.close.called
+
+    # Can't know that the first <a> is also the last one until the document is finished
+    response, consumed = streamed_response(chunks)
+    assert find_next_href(response, '//a[last()]', stream=True) == '?p=2'
+    assert len(consumed) == 3
+
+
+def test_streaming_checks_long_pages_a_logarithmic_number_of_times():
+    selector = get_selector('//a[@rel="next"]')
+    comments = [b'<p>comment</p>' * 100] * 1000
+    with mock.patch.object(type(selector), 'find_href_in_tree', autospec=True,
+                           side_effect=type(selector).find_href_in_tree) as find_mock:
+        response, consumed = streamed_response([b'<html><body>'] + comments + [b'</body></html>'])
+        assert selector.find_href(response, stream=True) is None
+        assert len(consumed) == 1002
+        assert find_mock.call_count < 30
+
+        find_mock.reset_mock()
+        response, consumed = streamed_response([b'<html><body>'] + comments + [b'<a href="?p=2" rel="next">'])
+        assert selector.find_href(response, stream=True) == '?p=2'
+        assert find_mock.call_count < 30
+
+
+def test_streaming_comic_respects_max_body_size():
+    comic = XPathComic(name='huge', next_xpath='//a[@rel="next"]', start_url='http://huge.com/1', stream=True,
+                       max_body_size=10000)
+    response, consumed = streamed_response([b'<html><body>', b'<p>comment</p>' * 1000, b'<a href="/2" rel="next">'])
+    with mock.patch('requests.Session.get', return_value=response) as get_mock:
+        try:
+            comic.next_url()
+        except ResponseTooLargeError:
+            pass
+        else:
+            assert False, 'Expected ResponseTooLargeError'
+    assert get_mock.call_args[1]['stream'] is True
+    assert len(consumed) == 2
+
+    # Only the bytes actually read count: a link before the limit is found, whatever the Content-Length says
+    response, consumed = streamed_response([b'<html><body><a href="/2" rel="next">next</a>', b'<p>comment</p>' * 1000])
+    response.headers = {'Content-Length': '160000'}
+    with mock.patch('requests.Session.get', return_value=response):
+        assert comic.next_url() == 'http://huge.com/2'
+    assert len(consumed) == 1
+
+
+def test_max_body_size_cuts_off_non_streaming_downloads():
+    comic = XPathComic(name='huge', next_xpath='//a[@rel="next"]', start_url='http://huge.com/1', max_body_size=10000)
+    for content_length, read in ((None, 2), ('20000', 0)):  # a Content-Length that's too large: nothing is read
+        response, consumed = streamed_response([b'<html><body>', b'<p>comment</p>' * 1000, b'<a href="/2" rel="next">'])
+        if content_length is not None:
+            response.headers = {'Content-Length': content_length}
+        close = response.close  # (the fetcher wraps it)
+        with mock.patch('requests.Session.get', return_value=response) as get_mock:
+            try:
+                comic.next_url()
+            except ResponseTooLargeError:
+                pass
+            else:
+                assert False, 'Expected ResponseTooLargeError'
+        assert get_mock.call_args[1]['stream'] is True
+        assert len(consumed) == read
+        assert close.called
+
+
+def test_selector_engines_agree():
+    page = fake_response(b'<html><body><a href="/archive">archive</a>'
+                         b'<a class="nav next" rel="next" href="?p=2&amp;lang=en">next</a></body></html>')
+    assert get_selector('//a[@rel="next"]').find_href(page) == '?p=2&lang=en'
+    assert get_selector('a.next', kind='css').find_href(page) == '?p=2&lang=en'
+    assert get_selector(r'<a[^>]*rel="next"[^>]*href="([^"]*)"', kind='regex').find_href(page) == '?p=2&lang=en'
+    assert get_selector('//a[@rel="prev"]').find_href(page) is None
+    assert get_selector('//a[@rel="next"]') is get_selector('//a[@rel="next"]')
+
+
+def test_regex_streaming_matches_across_chunks():
+    response, consumed = streamed_response([b'<p>hi</p><a rel="next" hr', b'ef="/2">next</a>', b'<p>rest</p>'])
+    assert get_selector(r'rel="next" href="([^"]*)"', kind='regex').find_href(response, stream=True) == '/2'
+    assert len(consumed) == 2
+
+
+def test_css_comic_config_round_trip():
+    comic = XPathComic(name='narbonic', next_css='a.next', start_url='http://narbonic.com/1', rss_file='/dev/null')
+    global_config = ConfigParser()
+    comic.add_to_global_config(global_config)
+    loaded = _unlocked_get_comic('narbonic', global_config)
+    assert loaded.next_xpath is None
+    assert loaded.selector.kind == 'css'
+    with mock.patch('requests.Session.get', return_value=fake_response('<a class="next" href="/2">')):
+        assert loaded.next_url() == 'http://narbonic.com/2'
+
+
+class FrozenDatetime(datetime):
+    frozen = None
+
+    @classmethod
+    def utcnow(cls):
+        return cls.frozen
+
+
+def legacy_write_rss(rss_file, op):
+    # How updates used to work: a full feedparser round trip
+    with open(rss_file, 'rb') as f:
+        rss = parse_rss(f)
+    op(rss)
+    with open(rss_file, 'r+b') as f:
+        rss.write_xml(f)
+        f.truncate()
+
+
+def test_incremental_rss_writer_matches_full_round_trip():
+    with temp_dir() as d:
+        legacy_fname = os.path.join(d, 'legacy.rss')
+        fname = os.path.join(d, 'new.rss')
+        comic = XPathComic(name='g', full_name='Gunnerkrigg & <Co> \xe9☃', start_url='http://g.com/?p=1&x=y',
+                           rss_file=legacy_fname, progress=Progress(episode=1, next_url='http://g.com/?p=1&x=y'))
+        start = datetime(2014, 3, 1, 12, 0, 0)
+        FrozenDatetime.frozen = start
+        with mock.patch('dripfeed.rss.datetime', FrozenDatetime):
+            init_rss(comic)
+            legacy_write_rss(legacy_fname, lambda rss: add_entry(rss, comic))  # feeds as they exist today
+            shutil.copy(legacy_fname, fname)
+
+            for i in range(2, 30):
+                FrozenDatetime.frozen = start + timedelta(hours=i)
+                if i % 4 == 0:
+                    exception = ValueError('No <a> & no "next" at ☃ {0}'.format(i))
+                    legacy_write_rss(legacy_fname, lambda rss: add_error_entry(rss, exception, comic.current_url))
+                    write_entries(fname, [error_item(exception, comic.current_url)])
+                else:
+                    comic.update_progress('http://g.com/?p={0}&x=y'.format(i))
+                    legacy_write_rss(legacy_fname, lambda rss: add_entry(rss, comic))
+                    write_entries(fname, [entry_item(comic)], drop_errors=True)
+                with open(legacy_fname, 'rb') as legacy, open(fname, 'rb') as new:
+                    assert legacy.read() == new.read()
+
+
+def test_rss_writer_falls_back_for_unrecognised_feeds():
+    with temp_dir() as d:
+        fname = os.path.join(d, 'edited.rss')
+        comic = XPathComic(name='g', start_url='http://g.com/1', rss_file=fname,
+                           progress=Progress(episode=2, next_url='http://g.com/2'))
+        init_rss(comic)
+        with open(fname, 'rb') as f:
+            content = f.read()
+        with open(fname, 'wb') as f:
+            f.write(content.replace(b'<item>', b'\n  <item>'))  # pretty-printed by hand
+        write_entries(fname, [entry_item(comic)], drop_errors=True)
+        with open(fname, 'rb') as f:
+            parsed = parse_rss(f)
+        assert [item.link for item in parsed.items] == ['http://g.com/2', 'http://g.com/1']
+
+
+def test_migrate_to_sqlite():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('gunnerkrigg', os.path.join(d, 'g.rss'), '//a', 'http://gunnerkrigg.com/?p=1',
+                         full_name='Gunnerkrigg Court')
+            create_comic('narbonic', os.path.join(d, 'n.rss'), None, 'http://narbonic.com/1', next_css='a.next',
+                         stream=True)
+            migrate_to_sqlite()
+            assert isinstance(get_store(), SqliteStore)
+            os.remove(conf_fname)  # no longer used
+
+            assert [comic.name for comic in get_configured_comics()] == ['gunnerkrigg', 'narbonic']
+            narbonic = get_comic('narbonic')
+            assert (narbonic.next_css, narbonic.stream, narbonic.progress) == ('a.next', True, None)
+
+            with mock.patch('requests.Session.get', return_value=fake_response('<a href="?p=2"></a>')):
+                run_once('gunnerkrigg')
+            gunnerkrigg = get_comic('gunnerkrigg')
+            assert gunnerkrigg.full_name == 'Gunnerkrigg Court'
+            assert (gunnerkrigg.progress.episode, gunnerkrigg.progress.next_url) == (2, 'http://gunnerkrigg.com/?p=2')
+            assert [comic.name for comic in get_configured_comics()] == ['gunnerkrigg', 'narbonic']
+
+            try:
+                put_comic(XPathComic(name='narbonic', next_xpath='//a', start_url='http://narbonic.com/1',
+                                     rss_file='/dev/null'))
+            except ValueError:
+                pass
+            else:
+                assert False, 'Expected ValueError'
+            assert remove_comic('narbonic')
+            assert not remove_comic('narbonic')
+            assert [comic.name for comic in get_configured_comics()] == ['gunnerkrigg']
+
+
+def test_sqlite_store_concurrent_puts():
+    with temp_dir() as d:
+        store = SqliteStore(os.path.join(d, 'comics.sqlite'))
+
+        def add_comic(name):
+            store.put_comics([XPathComic(name=name, next_xpath='//a', start_url='http://test.com/',
+                                         rss_file='test.rss')])
+
+        threads = [Thread(target=add_comic, args=('comic{0}'.format(i),)) for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sorted(comic.name for comic in store.get_configured_comics()) == sorted(
+            'comic{0}'.format(i) for i in range(10))
+
+
+def test_concurrent_updates_of_one_comic_serialise():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+
+        def slow_get(url, **kwargs):
+            sleep(0.3)
+            return fake_response('<a href="{0}x"></a>'.format(url))
+
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('gunnerkrigg', os.path.join(d, 'g.rss'), '//a', 'http://gunnerkrigg.com/')
+            with mock.patch('requests.Session.get', side_effect=slow_get):
+                threads = [Thread(target=run_once, args=('gunnerkrigg',)) for _ in range(2)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+            progress = get_comic('gunnerkrigg').progress
+            assert (progress.episode, progress.next_url) == (3, 'http://gunnerkrigg.com/xx')
+
+
+def test_progress_updates_dont_need_the_config_lock():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('gunnerkrigg', os.path.join(d, 'g.rss'), '//a', 'http://gunnerkrigg.com/?p=1')
+            with mock.patch('requests.Session.get', return_value=fake_response('<a href="?p=2"></a>')):
+                with _locked_config_file(shared=True):  # e.g. someone listing comics
+                    t = Thread(target=run_once, args=('gunnerkrigg',))
+                    t.start()
+                    t.join(5)
+                    assert not t.is_alive()
+            assert get_comic('gunnerkrigg').progress.episode == 2
+
+            # Putting the comic back in the config file (a structural change) also takes its progress along
+            put_comic(get_comic('gunnerkrigg'), overwrite=True)
+            assert not os.path.exists(os.path.join(conf_fname + '.d', 'progress', 'gunnerkrigg'))
+            assert get_comic('gunnerkrigg').progress.episode == 2
+
+
+def numbered_pages(last_page):
+    # Pages http://comic.com/1 .. /last_page, each linking to the next
+    def get(url, **kwargs):
+        number = int(url.rsplit('/', 1)[1])
+        if number >= last_page:
+            return fake_response('<p>The end (for now)</p>')
+        return fake_response('<a href="/{0}">next</a>'.format(number + 1))
+    return get
+
+
+def test_crawl_ahead_then_update_without_network():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('comic', os.path.join(d, 'c.rss'), '//a', 'http://comic.com/1')
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(5)) as get_mock:
+                assert crawl('comic', ahead=3, delay=0) == 3
+                assert get_mock.call_count == 3
+                assert crawl('comic', ahead=10, delay=0) == 4  # stops at the end of the archive
+                assert get_mock.call_count == 5
+
+            with mock.patch('requests.Session.get', side_effect=AssertionError('should not fetch')):
+                run_once('comic', raise_error=True)
+                run_once('comic', raise_error=True)
+            progress = get_comic('comic').progress
+            assert (progress.episode, progress.next_url) == (3, 'http://comic.com/3')
+            assert LookaheadQueue('comic').read('http://comic.com/3') == ['http://comic.com/4', 'http://comic.com/5']
+
+            # The queue only applies from the url it was crawled from
+            assert LookaheadQueue('comic').read('http://comic.com/2') == []
+
+
+def test_update_count_adds_several_entries_at_once():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        rss_fname = os.path.join(d, 'c.rss')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('comic', rss_fname, '//a', 'http://comic.com/1')
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(10)):
+                crawl('comic', ahead=2, delay=0)
+                with mock.patch('dripfeed.write_entries', wraps=dripfeed.write_entries) as write_mock:
+                    with mock.patch('dripfeed.put_progress', wraps=dripfeed.put_progress) as progress_mock:
+                        run_once('comic', count=4)
+            assert write_mock.call_count == 1
+            assert progress_mock.call_count == 1
+            for count in (0, -1):
+                try:
+                    run_once('comic', count=count)
+                    assert False, count
+                except ValueError:
+                    pass
+            progress = get_comic('comic').progress
+            assert (progress.episode, progress.next_url) == (5, 'http://comic.com/5')
+            with open(rss_fname, 'rb') as f:
+                assert [item.link for item in parse_rss(f).items] == [
+                    'http://comic.com/{0}'.format(i) for i in (5, 4, 3, 2, 1)]
+
+            # Stops at the end of the archive, keeping the episodes it found; having caught up isn't an error
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(7)):
+                assert isinstance(dripfeed._update_locked(get_comic('comic'), count=5), NoMatchForXPathError)
+            progress = get_comic('comic').progress
+            assert (progress.episode, progress.failures) == (7, 0)
+            with open(rss_fname, 'rb') as f:
+                items = parse_rss(f).items
+            assert [item.link for item in items[:3]] == ['http://comic.com/7', 'http://comic.com/6',
+                                                         'http://comic.com/5']
+
+
+def test_parse_interval():
+    assert parse_interval('90') == 90
+    assert parse_interval('30m') == 30 * 60
+    assert parse_interval('1.5h') == 90 * 60
+    assert parse_interval('1d') == 24 * 60 * 60
+    for bad in ('', 'soon', '-1h', '0'):
+        try:
+            parse_interval(bad)
+            assert False, bad
+        except ValueError:
+            pass
+
+
+def test_scheduler_updates_due_comics():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('fast', os.path.join(d, 'fast.rss'), '//a', 'http://comic.com/1', interval='1')
+            create_comic('slow', os.path.join(d, 'slow.rss'), '//a', 'http://comic.com/1', interval='1h')
+            create_comic('cron', os.path.join(d, 'cron.rss'), '//a', 'http://comic.com/1')
+            assert get_comic('fast').interval == '1'
+            assert get_comic('cron').interval is None
+
+            updates = []
+            scheduler = Scheduler(update=updates.append, workers=2, poll_interval=0.1)
+            thread = Thread(target=scheduler.run)
+            thread.start()
+            sleep(1.5)
+            scheduler.stop()
+            thread.join(5)
+            assert not thread.is_alive()
+            # Never-updated comics are due right away; after that only 'fast' comes round again
+            assert updates.count('fast') == 2
+            assert updates.count('slow') == 1
+            assert 'cron' not in updates
+
+
+def test_progress_records_update_time():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('comic', os.path.join(d, 'c.rss'), '//a', 'http://comic.com/1', interval='1h')
+            assert get_comic('comic').progress is None
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(3)):
+                run_once('comic', raise_error=True)
+            updated = get_comic('comic').progress.updated
+            assert updated is not None and abs(updated - time()) < 60
+
+            # So a restarted scheduler doesn't update it again until the interval has passed
+            updates = []
+            scheduler = Scheduler(update=updates.append, poll_interval=0.1)
+            thread = Thread(target=scheduler.run)
+            thread.start()
+            sleep(0.3)
+            scheduler.stop()
+            thread.join(5)
+            assert updates == []
+
+
+def test_list_does_not_import_heavy_dependencies():
+    # In a fresh interpreter, since this one has imported everything already
+    check = ('import sys, dripfeed; sys.argv = ["dripfeed", "list"]; dripfeed.main(); '
+             'print(" ".join(name for name in ("requests", "lxml", "feedparser", "PyRSS2Gen") if name in sys.modules))')
+    with temp_dir() as d:
+        output = subprocess.check_output([sys.executable, '-c', check], env=dict(os.environ, HOME=d))
+    assert output.decode('utf-8').splitlines()[-1] == ''
+
+
+def test_updates_record_phase_timings():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('comic', os.path.join(d, 'c.rss'), '//a', 'http://comic.com/1')
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(3)):
+                run_once('comic')
+                run_once('comic')
+                run_once('comic')  # the end of the archive
+            records = StatsLog('comic').records()
+            assert len(records) == 3
+            assert set(records[0]['phases']) == {'lock', 'read', 'request', 'download', 'parse', 'select', 'rss_read',
+                                                 'rss_write', 'commit'}
+            assert records[0]['bytes'] == len('<a href="/2">next</a>')
+            # Having caught up isn't an error
+            assert [record['error'] for record in records] == [None, None, None]
+            assert [record['caught_up'] for record in records] == [False, False, True]
+            assert 'commit' in records[2]['phases']  # the update is recorded in the progress
+
+            summary = summarise(records)
+            assert (summary['updates'], summary['errors']) == (3, 0)
+            assert set(summary['phases']['parse']) == {'p50', 'p90', 'p99'}
+
+
+def test_stats_log_is_a_ring_buffer():
+    with temp_dir() as d:
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'test_config.cfg')):
+            log = StatsLog('comic', max_bytes=2000)
+            for i in range(100):
+                with recording('comic') as timings:
+                    timings.bytes = i
+                log.append(timings)
+                assert os.path.getsize(log.filename) <= 2000
+            records = log.records()
+            assert 5 < len(records) < 100
+            assert [record['bytes'] for record in records] == list(range(100 - len(records), 100))
+
+
+def test_stats_are_sent_to_statsd():
+    import socket
+    agent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    agent.bind(('127.0.0.1', 0))
+    agent.settimeout(5)
+    try:
+        with recording('my.comic') as timings:
+            timings.add('parse', 0.25)
+        StatsdClient(port=agent.getsockname()[1]).send(timings)
+        lines = agent.recv(4096).decode('utf-8').split('\n')
+    finally:
+        agent.close()
+    assert 'dripfeed.my_comic.updates:1|c' in lines
+    assert 'dripfeed.my_comic.parse:250.0|ms' in lines
+
+
+def test_profiling_update_all_per_comic():
+    import pstats
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        profile_file = os.path.join(d, 'out.prof')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('a', os.path.join(d, 'a.rss'), '//a', 'http://comic.com/1')
+            create_comic('b/c', os.path.join(d, 'b.rss'), '//a', 'http://comic.com/11')
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(20)):
+                with mock.patch('sys.stdout', new_callable=StringIO):
+                    with profiled(profile_file=profile_file, trace_memory=5, per_comic=True):
+                        tracer = dripfeed.profiling._tracer
+                        update_all(workers=1)
+                        update_all(workers=1)
+        assert sorted(os.listdir(d)) == sorted(['a.rss', 'b.rss', 'out.a.prof', 'out.b%2Fc.prof', 'test_config.cfg',
+                                                'test_config.cfg.d'])
+        stats = pstats.Stats(os.path.join(d, 'out.a.prof'))
+        next_url_calls = [calls for (filename, _, function), (calls, _, _, _, _) in stats.stats.items()
+                          if function == '_next_url']
+        assert next_url_calls == [2]  # both updates of comic a, but none of comic b/c
+        assert len(tracer.reports) == 4
+        assert tracer.reports[0].startswith('Memory for a: peak')
+
+
+def test_token_bucket_allows_bursts_then_limits_the_rate():
+    bucket = TokenBucket(rate=10, burst=3)
+    waits = [bucket.reserve() for _ in range(6)]
+    assert waits[:3] == [0, 0, 0]
+    for expected, wait in zip([0.1, 0.2, 0.3], waits[3:]):
+        assert abs(wait - expected) < 0.01
+
+
+def test_fetcher_honours_retry_after():
+    fetcher = Fetcher(max_wait=5)
+    responses = [fake_response(status_code=429, headers={'Retry-After': '0'}), fake_response('ok')]
+    with mock.patch('requests.Session.get', side_effect=responses) as get_mock:
+        assert fetcher.get('http://a.com/1').content == 'ok'
+    assert get_mock.call_count == 2
+
+    with mock.patch('requests.Session.get', return_value=fake_response(status_code=503,
+                                                                       headers={'Retry-After': '120'})) as get_mock:
+        for _ in range(3):
+            try:
+                fetcher.get('http://a.com/2')
+                assert False
+            except ThrottledError as error:
+                assert 100 < error.retry_after <= 120
+        # Other hosts are unaffected
+        try:
+            fetcher.get('http://b.com/1')
+        except ThrottledError:
+            pass
+    assert get_mock.call_count == 2  # a.com/2 once (not again while blocked), and b.com/1
+
+
+def test_interleave_hosts():
+    urls = ['http://a.com/1', 'http://a.com/2', 'http://a.com/3', 'https://b.com/1', 'http://c.com/1',
+            'http://B.com:8080/2']
+    assert interleave_hosts(urls, lambda url: url) == ['http://a.com/1', 'https://b.com/1', 'http://c.com/1',
+                                                       'http://a.com/2', 'http://B.com:8080/2', 'http://a.com/3']
+
+
+def _expire_backoff(comic_name):
+    with comic_lock(comic_name):
+        comic = get_comic(comic_name)
+        comic.progress.retry_at = int(time()) - 1
+        put_progress(comic)
+
+
+def test_failing_comics_back_off():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        rss_fname = os.path.join(d, 'c.rss')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('comic', rss_fname, '//a', 'http://comic.com/1')
+            # Having caught up (no next link yet) isn't a failure
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(1)):
+                run_once('comic')
+            progress = get_comic('comic').progress
+            assert (progress.episode, progress.failures, progress.retry_at) == (1, 0, None)
+
+            with mock.patch('requests.Session.get', side_effect=IOError('down')):
+                run_once('comic')
+            progress = get_comic('comic').progress
+            assert (progress.episode, progress.failures) == (1, 1)
+            assert progress.last_error == 'down'
+            assert abs(progress.retry_at - (time() + 10 * 60)) < 60
+            with open(rss_fname, 'rb') as f:
+                feed = f.read()
+            assert b'has an error' in feed
+
+            # Until the retry time, updates don't fetch, write the feed or record stats
+            with mock.patch('requests.Session.get', side_effect=AssertionError('should not fetch')):
+                run_once('comic')
+            with open(rss_fname, 'rb') as f:
+                assert f.read() == feed
+            assert len(StatsLog('comic').records()) == 2  # the update that caught up, and the one that failed
+
+            # After it, a failure doubles the backoff, without another error entry
+            _expire_backoff('comic')
+            with mock.patch('requests.Session.get', side_effect=IOError('still down')):
+                run_once('comic')
+            progress = get_comic('comic').progress
+            assert progress.failures == 2
+            assert abs(progress.retry_at - (time() + 20 * 60)) < 60
+            with open(rss_fname, 'rb') as f:
+                assert f.read() == feed
+
+            # Forcing an update ignores the backoff; success clears the failures and the error entry
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(3)):
+                run_once('comic', force=True)
+            progress = get_comic('comic').progress
+            assert (progress.episode, progress.failures, progress.last_error, progress.retry_at) == (2, 0, None, None)
+            with open(rss_fname, 'rb') as f:
+                assert [item.title for item in parse_rss(f).items] == ['New comic episode', 'First comic episode']
+            with open(conf_fname + '.d/progress/comic') as f:
+                assert 'failures' not in f.read()
+
+
+def test_finding_no_next_link_for_long_gets_one_error_entry():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        rss_fname = os.path.join(d, 'c.rss')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('comic', rss_fname, '//a', 'http://comic.com/1')
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(1)):
+                for _ in range(NO_NEXT_WARNING - 1):
+                    run_once('comic')
+                with open(rss_fname, 'rb') as f:
+                    assert b'has an error' not in f.read()
+                progress = get_comic('comic').progress
+                assert (progress.no_next_count, progress.failures, progress.retry_at) == (NO_NEXT_WARNING - 1, 0, None)
+                assert abs(progress.no_next_since - time()) < 60
+                assert any(line.startswith('  No next link since') for line in get_comic('comic').get_info())
+
+                run_once('comic')
+                run_once('comic')
+            with open(rss_fname, 'rb') as f:
+                titles = [item.title for item in parse_rss(f).items]
+            assert titles == ['Latest episode has an error', 'First comic episode']
+
+            # A new episode clears it all
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(2)):
+                run_once('comic')
+            progress = get_comic('comic').progress
+            assert (progress.episode, progress.no_next_since, progress.no_next_count) == (2, None, 0)
+            with open(rss_fname, 'rb') as f:
+                assert [item.title for item in parse_rss(f).items] == ['New comic episode', 'First comic episode']
+            with open(conf_fname + '.d/progress/comic') as f:
+                assert 'no_next' not in f.read()
+
+
+def test_overwriting_a_comic_replaces_all_its_options():
+    with temp_dir() as d:
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'test_config.cfg')):
+            for migrate in (False, True):
+                put_comic(XPathComic(name='comic', next_css='a.next', start_url='http://comic.com/1', stream=True,
+                                     rss_file=os.path.join(d, 'c.rss')), create_file=True, overwrite=True)
+                if migrate:
+                    migrate_to_sqlite()
+                put_comic(XPathComic(name='comic', next_xpath='//a', start_url='http://comic.com/1',
+                                     rss_file=os.path.join(d, 'c.rss')), overwrite=True)
+                comic = get_comic('comic')
+                assert (comic.selector.kind, comic.next_css, comic.stream) == ('xpath', None, False)
+
+
+def test_failure_state_round_trips_through_stores():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('comic', os.path.join(d, 'c.rss'), '//a', 'http://comic.com/1')
+            comic = get_comic('comic')
+            comic.record_failure(ValueError('100% broken\nover two lines'))
+            put_progress(comic)
+            progress = get_comic('comic').progress
+            assert (progress.failures, progress.last_error) == (1, '100% broken over two lines')
+            migrate_to_sqlite()
+            progress = get_comic('comic').progress
+            assert (progress.failures, progress.last_error) == (1, '100% broken over two lines')
+            comic.update_progress('http://comic.com/2')
+            comic.record_no_next()
+            put_progress(comic)
+            progress = get_comic('comic').progress
+            assert (progress.failures, progress.no_next_count) == (0, 1)
+            assert abs(progress.no_next_since - time()) < 60
+
+
+def test_host_breaker_probes_one_comic_when_all_are_failing():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            for name in ('a', 'b', 'c'):
+                create_comic(name, os.path.join(d, name + '.rss'), '//a', 'http://down.com/{0}'.format(name))
+            create_comic('up', os.path.join(d, 'up.rss'), '//a', 'http://comic.com/1')
+            with mock.patch('requests.Session.get', side_effect=IOError('down')) as get_mock:
+                update_all(['a', 'b', 'c'])
+            assert get_mock.call_count == 3
+            for name in ('a', 'b', 'c'):
+                _expire_backoff(name)
+
+            fetched = []
+
+            def get(url, **kwargs):
+                fetched.append(url)
+                if 'down.com' in url:
+                    raise IOError('still down')
+                return fake_response('<a href="/2">next</a>')
+            with mock.patch('requests.Session.get', side_effect=get):
+                results = dict((comic.name, exception) for comic, exception in update_all())
+            assert len([url for url in fetched if 'down.com' in url]) == 1
+            assert sum(isinstance(exception, BackingOffError) for exception in results.values()) == 2
+            assert results['up'] is None
+
+
+def test_config_index_lookups_match_a_full_parse():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            put_comics([XPathComic(name='comic{0}'.format(i), next_xpath='//a', start_url='http://comic.com/1',
+                                   rss_file='/dev/null', full_name='Comic [{0}]'.format(i),
+                                   progress=Progress(episode=i, next_url='http://comic.com/{0}'.format(i)))
+                        for i in range(1, 50)], create_file=True)
+            global_config = get_global_config()
+            for name in ('comic1', 'comic25', 'comic49'):
+                indexed, parsed = get_comic(name), _unlocked_get_comic(name, global_config)
+                assert (indexed.full_name, indexed.progress.episode) == (parsed.full_name, parsed.progress.episode)
+            assert os.path.isfile(dripfeed.comics.state_path('index.sqlite'))
+
+            remove_comic('comic25')
+            try:
+                get_comic('comic25')
+            except ValueError:
+                pass
+            else:
+                assert False, 'Expected ValueError'
+            put_comic(XPathComic(name='comic2', next_xpath='//b', start_url='http://comic.com/1',
+                                 rss_file='/dev/null'), overwrite=True)
+            assert get_comic('comic2').next_xpath == '//b'
+            assert get_comic('comic49').progress.episode == 49
+
+            with open(conf_fname, 'a') as f:  # by hand, behind the index's back
+                f.write('[added]\nstart_url = http://added.com/\nrss_file = /dev/null\n')
+            assert get_comic('added').start_url == 'http://added.com/'
+
+            with open(conf_fname, 'a') as f:
+                f.write('[DEFAULT]\nnext_xpath = //c\n')
+            assert get_comic('added').next_xpath == '//c'  # not indexable: a full parse
+
+
+def test_comics_have_no_instance_dict():
+    comic = XPathComic(name='comic', progress=Progress())
+    for obj in (comic, comic.progress):
+        try:
+            obj.misspelt = True
+        except AttributeError:
+            pass
+        else:
+            assert False, 'Expected AttributeError'
+
+
+def test_write_atomically_replaces_whole_files():
+    with temp_dir() as d:
+        filename = os.path.join(d, 'file')
+        assert write_atomically(filename, 'old')
+        os.chmod(filename, 0o640)
+        os.symlink(filename, os.path.join(d, 'link'))
+        with open(filename, 'r') as reader:  # e.g. a feed reader in the middle of a poll
+            assert write_atomically(os.path.join(d, 'link'), 'new')
+            assert reader.read() == 'old'
+        assert os.path.islink(os.path.join(d, 'link'))
+        with open(filename, 'r') as f:
+            assert f.read() == 'new'
+        assert os.stat(filename).st_mode & 0o777 == 0o640
+        assert not write_atomically(filename, 'new', skip_unchanged=True)
+        assert sorted(os.listdir(d)) == ['file', 'link']  # no temp files left
+
+
+def test_feed_writes_replace_the_feed():
+    with temp_dir() as d:
+        comic = XPathComic(name='comic', full_name='Comic', start_url='http://comic.com/1',
+                           rss_file=os.path.join(d, 'c.rss'), progress=Progress(next_url='http://comic.com/1'))
+        init_rss(comic)
+        with open(comic.rss_file, 'rb') as reader:
+            comic.update_progress('http://comic.com/2')
+            write_entries(comic.rss_file, [entry_item(comic)])
+            assert b'Episode 2' not in reader.read()
+        with open(comic.rss_file, 'rb') as f:
+            assert b'Episode 2' in f.read()
+        before = os.stat(comic.rss_file)
+        write_entries(comic.rss_file, [], drop_errors=True)  # no change: not written at all
+        assert os.stat(comic.rss_file).st_ino == before.st_ino
+
+
+CLAIM_SCRIPT = '''
+import sys
+import dripfeed.comics
+from dripfeed.leases import Leases
+dripfeed.comics.CONF_FILENAME = sys.argv[1]
+leases = Leases(sys.argv[2], duration=60)
+for i in range(int(sys.argv[3])):
+    if leases.claim('comic{0}'.format(i)) is not None:
+        print('comic{0}'.format(i))
+'''
+
+
+def test_leases_are_exclusive_across_processes():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        workers = [subprocess.Popen([sys.executable, '-c', CLAIM_SCRIPT, conf_fname, 'node{0}'.format(i), '40'],
+                                    stdout=subprocess.PIPE) for i in range(4)]
+        claimed = [worker.communicate()[0].decode('ascii').split() for worker in workers]
+        assert sorted(sum(claimed, [])) == sorted('comic{0}'.format(i) for i in range(40))  # each exactly once
+
+
+def test_expired_leases_are_taken_over():
+    with temp_dir() as d:
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'test_config.cfg')):
+            dead = Leases('dead', duration=60).claim('comic')
+            assert Leases('alive').claim('comic') is None
+            with mock.patch('time.time', return_value=time() + 61):
+                lease = Leases('alive').claim('comic')
+            assert lease is not None and lease.held()
+            assert not dead.held() and not dead.renew()
+            lease.release()
+            assert Leases('other').claim('comic') is not None
+
+
+def test_sharding_is_balanced_and_stable():
+    names = ['comic{0}'.format(i) for i in range(3000)]
+    shards = dict((name, owner(name, ['a', 'b', 'c'])) for name in names)
+    assert all(900 < list(shards.values()).count(node) < 1100 for node in 'abc')
+    for name in names:  # when c leaves, only its comics move
+        assert owner(name, ['a', 'b']) == shards[name] or shards[name] == 'c'
+
+
+def test_workers_share_comics_without_double_updates():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            for i in range(20):
+                create_comic('comic{0}'.format(i), os.path.join(d, 'c{0}.rss'.format(i)), '//a',
+                             'http://comic{0}.com/1'.format(i), interval='1h')
+            workers = [Worker(run_once, node=node, lease_duration=3, poll_interval=0.1) for node in ('a', 'b')]
+            threads = [Thread(target=worker.run) for worker in workers]
+            with mock.patch('requests.Session.get', return_value=fake_response('<a href="2"></a>')):
+                for t in threads:
+                    t.start()
+                deadline = time() + 10
+                while time() < deadline and any(comic.progress is None for comic in get_configured_comics()):
+                    sleep(0.1)
+                for worker in workers:
+                    worker.stop()
+                for t in threads:
+                    t.join()
+            assert [comic.progress.episode for comic in get_configured_comics()] == [2] * 20
+            assert not os.listdir(os.path.join(conf_fname + '.d', 'nodes'))
+
+
+def test_export_then_import_round_trips():
+    with temp_dir() as d:
+        for extension in ('json', 'csv'):
+            export_fname = os.path.join(d, 'comics.' + extension)
+            with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'old.cfg')):
+                create_comic('gunnerkrigg', os.path.join(d, 'g.rss'), '//a', 'http://gunnerkrigg.com/?p=1',
+                             full_name='Gunnerkrigg Court \u2603', interval='8h')
+                with mock.patch('requests.Session.get', return_value=fake_response('<a href="?p=2"></a>')):
+                    run_once('gunnerkrigg')
+                export_comics(export_fname)
+                remove_comic('gunnerkrigg')
+            with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, extension + '.cfg')):
+                report = import_comics(export_fname, check=False)
+                assert [(name, error) for name, _, error in report] == [('gunnerkrigg', None)]
+                comic = get_comic('gunnerkrigg')
+                assert (comic.full_name, comic.interval, comic.next_xpath) == ('Gunnerkrigg Court \u2603', '8h', '//a')
+                assert (comic.progress.episode, comic.progress.next_url) == (2, 'http://gunnerkrigg.com/?p=2')
+
+
+def test_import_checks_the_start_page_of_exported_comics():
+    with temp_dir() as d:
+        export_fname = os.path.join(d, 'comics.json')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'exported.cfg')):
+            create_comic('comic', os.path.join(d, 'c.rss'), '//a', 'http://comic.com/1')
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(3)):
+                run_once('comic', count=5)  # caught up, at a page without a next link
+            export_comics(export_fname)
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'imported.cfg')):
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(3)):
+                report = import_comics(export_fname)
+            assert report == [('comic', 'http://comic.com/2', None)]
+            assert get_comic('comic').progress.next_url == 'http://comic.com/3'
+
+
+def test_import_validates_every_comic_before_writing():
+    pages = {
+        'http://good.com/1': '<a class="next" href="2">next</a>',
+        'http://nomatch.com/1': '<p>no links here</p>',
+        'http://relative.com/1': '<a class="next" href="mailto:someone@example.com">next</a>',
+    }
+    with temp_dir() as d:
+        import_fname = os.path.join(d, 'comics.csv')
+        with open(import_fname, 'w') as f:
+            f.write('name,start_url,rss_file,next_xpath,next_css\n')
+            for name in ('good', 'nomatch', 'relative'):
+                f.write('{0},http://{0}.com/1,{1},//a[@class="next"],\n'.format(name, os.path.join(d, name + '.rss')))
+            f.write('badcss,http://good.com/1,{0},,a[[\n'.format(os.path.join(d, 'badcss.rss')))
+            f.write('incomplete,http://good.com/1,,//a,\n')
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            with mock.patch('requests.Session.get', side_effect=lambda url, **kwargs: fake_response(pages[url])):
+                try:
+                    import_comics(import_fname)
+                except InvalidImportError as error:
+                    results = dict((name, (next_url, error)) for name, next_url, error in error.results)
+                else:
+                    assert False, 'Expected InvalidImportError'
+                assert not os.path.exists(conf_fname)  # nothing imported
+                assert results['good'] == ('http://good.com/2', None)
+                assert isinstance(results['nomatch'][1], NoMatchForXPathError)
+                assert 'absolute' in str(results['relative'][1])
+                assert results['badcss'][1] is not None
+                assert 'rss_file' in str(results['incomplete'][1])
+
+                import_comics(import_fname, skip_invalid=True)
+            assert [comic.name for comic in get_configured_comics()] == ['good']
+            assert os.path.exists(os.path.join(d, 'good.rss'))
+
+
+def archive_page(episodes):
+    return '<ul>{0}</ul>'.format(''.join('<li><a href="/{0}">#{0}</a></li>'.format(i) for i in episodes))
+
+
+def test_archive_comic_walks_its_index_without_fetching():
+    responses = {'etag': '"v1"', 'page': archive_page(range(1, 6))}
+    requests = []
+
+    def get(url, headers=None, **kwargs):
+        requests.append(headers)
+        if headers and headers.get('If-None-Match') == responses['etag']:
+            return fake_response(status_code=304)
+        return fake_response(responses['page'], headers={'ETag': responses['etag']})
+
+    with temp_dir() as d:
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'test_config.cfg')):
+            create_comic('archived', os.path.join(d, 'a.rss'), None, 'http://comic.com/1',
+                         archive_url='http://comic.com/archive', item_xpath='//li/a')
+            assert isinstance(get_comic('archived'), ArchiveComic)
+            with mock.patch('requests.Session.get', side_effect=get):
+                run_once('archived', raise_error=True, count=4)
+                assert get_comic('archived').progress.next_url == 'http://comic.com/5'
+                assert len(requests) == 1
+
+                run_once('archived')  # at the last episode: refetched conditionally, and still nothing new
+                assert requests[1] == {'If-None-Match': '"v1"'}
+                assert get_comic('archived').progress.failures == 0  # caught up, not failing
+                responses.update(etag='"v2"', page=archive_page(range(3, 8)))  # older episodes dropped off the page
+                run_once('archived')
+            comic = get_comic('archived')
+            assert (comic.progress.episode, comic.progress.next_url) == (6, 'http://comic.com/6')
+            assert comic.index.read() == ['http://comic.com/{0}'.format(i) for i in range(1, 8)]
+
+            # An archive page listing nothing at all is a failure, not the end of the archive
+            with mock.patch('requests.Session.get', side_effect=get):
+                run_once('archived')  # to the last episode in the index
+                responses.update(etag='"v3"', page='<p>Our archive has moved!</p>')
+                assert isinstance(dripfeed._update_locked(get_comic('archived')), EmptyArchiveError)
+            assert get_comic('archived').progress.failures == 1
+
+
+def test_archive_comic_reads_sitemaps_newest_first():
+    sitemap = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+               '<url><loc>http://comic.com/3</loc></url><url><loc>http://comic.com/2</loc></url>'
+               '<url><loc>http://comic.com/1</loc></url></urlset>').encode('utf-8')
+    with temp_dir() as d:
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'test_config.cfg')):
+            comic = ArchiveComic(name='sitemapped', start_url='http://comic.com/1', rss_file='/dev/null',
+                                 archive_url='http://comic.com/sitemap.xml', item_xpath='//loc', newest_first=True)
+            with mock.patch('requests.Session.get', return_value=fake_response(sitemap)):
+                assert comic.next_url() == 'http://comic.com/2'
+            options = comic_to_options(comic)
+            assert isinstance(comic_from_options('sitemapped', options), ArchiveComic)
+
+
+def test_episode_index_appends_and_truncates_on_a_changed_url():
+    with temp_dir() as d:
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'test_config.cfg')):
+            index = EpisodeIndex('comic')
+            assert (len(index), index.url(1)) == (0, None)
+            index.record_chain(1, ['http://comic.com/{0}'.format(i) for i in range(1, 6)])
+            assert [index.url(i) for i in (0, 1, 3, 5, 6)] == [
+                None, 'http://comic.com/1', 'http://comic.com/3', 'http://comic.com/5', None]
+            assert index.following(3, 'http://comic.com/3') == 'http://comic.com/4'
+            assert index.following(3, 'http://comic.com/elsewhere') is None
+
+            index.record(3, 'http://comic.com/3')  # already known
+            assert len(index) == 5
+            index.record(3, 'http://comic.com/new-3')
+            assert (len(index), index.url(2), index.url(3)) == (3, 'http://comic.com/2', 'http://comic.com/new-3')
+
+            # A crash between appending a url and its end offset leaves only bytes that the next append overwrites
+            with open(index.urls_filename, 'ab') as f:
+                f.write(b'http://comic.com/half')
+            index.record(4, 'http://comic.com/new-4')
+            assert [index.url(i) for i in (3, 4)] == ['http://comic.com/new-3', 'http://comic.com/new-4']
+
+            # A jump beyond the end starts the index over from there; episodes before its start aren't recorded
+            index.record(7, 'http://comic.com/7')
+            index.record(6, 'http://comic.com/6')
+            assert (index.first, index.last, index.url(4), index.url(7)) == (7, 7, None, 'http://comic.com/7')
+
+
+def test_seek_back_then_update_from_the_index():
+    with temp_dir() as d:
+        conf_fname = os.path.join(d, 'test_config.cfg')
+        rss_fname = os.path.join(d, 'c.rss')
+        with mock.patch('dripfeed.comics.CONF_FILENAME', conf_fname):
+            create_comic('comic', rss_fname, '//a', 'http://comic.com/1')
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(10)):
+                run_once('comic', count=3)
+                crawl('comic', ahead=2, delay=0)
+            assert len(EpisodeIndex('comic')) == 6
+            assert '  2 more episodes known (crawled or seen before), not yet in the feed' in \
+                get_comic('comic').get_info(with_backlog=True)
+            with mock.patch.object(Comic, 'backlog', side_effect=AssertionError('list should not read the index')):
+                assert not any('more episodes known' in line for line in get_comic('comic').get_info())
+
+            with mock.patch('requests.Session.get', side_effect=AssertionError('should not fetch')):
+                seek('comic', 2)
+                assert '  4 more episodes known (crawled or seen before), not yet in the feed' in \
+                    get_comic('comic').get_info(with_backlog=True)
+                run_once('comic', raise_error=True, count=2)
+                progress = get_comic('comic').progress
+                assert (progress.episode, progress.next_url) == (4, 'http://comic.com/4')
+                seek('comic', 6)  # forward, as far as was crawled
+                assert get_comic('comic').progress.next_url == 'http://comic.com/6'
+                try:
+                    seek('comic', 7)
+                    assert False, 'episode 7 was never seen'
+                except ValueError:
+                    pass
+                seek('comic', 1)
+                assert get_comic('comic').progress.next_url == 'http://comic.com/1'
+
+
+
+def test_deep_feeds_are_streamed_and_gzipped():
+    with temp_dir() as d:
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'test_config.cfg')):
+            create_comic('comic', os.path.join(d, 'c.rss'), '//a', 'http://comic.com/1', num_entries=50, gzip=True)
+            comic = get_comic('comic')
+            assert (comic.num_entries, comic.gzip) == (50, True)
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(100)):
+                run_once('comic', count=60)
+            shutil.copy(comic.rss_file, os.path.join(d, 'copy.rss'))
+            comic = get_comic('comic')
+            comic.update_progress('http://comic.com/62')
+            # Chunks far smaller than an item split every tag across reads; the result must be the same
+            write_entries(os.path.join(d, 'copy.rss'), [entry_item(comic)], num_entries=50)
+            with mock.patch('dripfeed.rss.CHUNK_SIZE', 5):
+                write_entries(comic.rss_file, [entry_item(comic)], num_entries=50, gzip=True)
+            with open(comic.rss_file, 'rb') as f, open(os.path.join(d, 'copy.rss'), 'rb') as copy:
+                content = f.read()
+                assert content == copy.read()
+            with open(comic.rss_file, 'rb') as f:
+                links = [item.link for item in parse_rss(f).items]
+            assert links == ['http://comic.com/{0}'.format(i) for i in range(62, 12, -1)]
+            import gzip
+            with gzip.open(comic.rss_file + '.gz', 'rb') as f:
+                assert f.read() == content
+
+
+def test_feed_server_answers_conditional_and_gzipped_requests():
+    from dripfeed.feedserver import FeedServer
+    from six.moves import http_client
+    import gzip
+    with temp_dir() as d:
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'test_config.cfg')):
+            create_comic('comic', os.path.join(d, 'c.rss'), '//a', 'http://comic.com/1')
+            server = FeedServer(port=0, poll_interval=0)
+            thread = Thread(target=server.run)
+            thread.start()
+            try:
+                connection = http_client.HTTPConnection('127.0.0.1', server.port)  # one keep-alive connection
+
+                def get(path, **headers):
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    return response, response.read()
+
+                response, body = get('/comic.rss')
+                with open(os.path.join(d, 'c.rss'), 'rb') as f:
+                    assert (response.status, body) == (200, f.read())
+                etag = response.getheader('ETag')
+                assert get('/comic.rss', **{'If-None-Match': etag})[0].status == 304
+                assert get('/comic.rss', **{'If-Modified-Since': response.getheader('Last-Modified')})[0].status == 304
+                assert get('/other.rss')[0].status == 404
+
+                response, zipped = get('/comic.rss', **{'Accept-Encoding': 'deflate, gzip;q=0.5'})
+                assert response.getheader('Content-Encoding') == 'gzip'
+                assert gzip.GzipFile(fileobj=BytesIO(zipped)).read() == body
+                assert get('/comic.rss', **{'Accept-Encoding': 'gzip;q=0'})[0].getheader('Content-Encoding') is None
+
+                with mock.patch('requests.Session.get', side_effect=numbered_pages(5)):
+                    run_once('comic')
+                response, new_body = get('/comic.rss', **{'If-None-Match': etag})
+                assert response.status == 200 and b'http://comic.com/2' in new_body
+            finally:
+                server.stop()
+                thread.join()
+
+
+def test_episode_index_starts_from_existing_progress():
+    with temp_dir() as d:
+        with mock.patch('dripfeed.comics.CONF_FILENAME', os.path.join(d, 'test_config.cfg')):
+            create_comic('comic', os.path.join(d, 'c.rss'), '//a', 'http://comic.com/1')
+            comic = get_comic('comic')
+            comic.progress = Progress(episode=30, next_url='http://comic.com/30')  # from before there was an index
+            put_progress(comic)
+            with mock.patch('requests.Session.get', side_effect=numbered_pages(40)):
+                run_once('comic', count=3)
+                crawl('comic', ahead=2, delay=0)
+            index = EpisodeIndex('comic')
+            assert (index.first, index.last, index.url(30)) == (30, 35, 'http://comic.com/30')
+            assert '  2 more episodes known (crawled or seen before), not yet in the feed' in \
+                get_comic('comic').get_info(with_backlog=True)
+
+            with mock.patch('requests.Session.get', side_effect=AssertionError('should not fetch')):
+                seek('comic', 31)
+                run_once('comic', raise_error=True)
+                progress = get_comic('comic').progress
+                assert (progress.episode, progress.next_url) == (32, 'http://comic.com/32')
+                seek('comic', 35)
+                try:
+                    seek('comic', 29)
+                    assert False, 'episode 29 was never seen'
+                except ValueError:
+                    pass
+